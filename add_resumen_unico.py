@@ -1,74 +1,116 @@
-from openpyxl import load_workbook
-from openpyxl.styles import Font
-from openpyxl.utils import quote_sheetname
-
-
-def encontrar_columna(ws, nombre):
-    for row in range(1, min(10, ws.max_row + 1)):
-        for col in range(1, ws.max_column + 1):
-            if ws.cell(row=row, column=col).value == nombre:
-                return col
-    return None
-
-
-def generar_resumen_unico(ruta_excel: str, paradas_por_hoja: dict = None) -> None:
-
-    wb = load_workbook(ruta_excel)
-
-    if "RESUMEN_UNICO" in wb.sheetnames:
-        del wb["RESUMEN_UNICO"]
-
-    operativas = []
-    if "ALMACEN" in wb.sheetnames:
-        operativas.append("ALMACEN")
-    if "HOSPITALES" in wb.sheetnames:
-        operativas.append("HOSPITALES")
-    if "FEDERACION" in wb.sheetnames:
-        operativas.append("FEDERACION")
-    zrep = sorted([s for s in wb.sheetnames if s.startswith("ZREP_")])
-    operativas.extend(zrep)
-
-    ws_res = wb.create_sheet("RESUMEN_UNICO", 0)
-    ws_res.append(["Clave", "Expediciones", "Bultos", "Kilos", "Paradas"])
-    for cell in ws_res[1]:
-        cell.font = Font(bold=True)
-
-    for fila_idx, hoja in enumerate(operativas, start=2):
-        ws = wb[hoja]
-        col_bultos = encontrar_columna(ws, "Bultos")
-        col_kilos = encontrar_columna(ws, "Kgs") or encontrar_columna(ws, "Kilos")
-
-        if col_bultos is None or col_kilos is None:
-            continue
-
-        letra_bultos = ws.cell(row=1, column=col_bultos).column_letter
-        letra_kilos = ws.cell(row=1, column=col_kilos).column_letter
-        paradas = paradas_por_hoja.get(hoja, "") if paradas_por_hoja else ""
-
-        ws_res.append([
-            hoja,
-            f"=COUNTA('{hoja}'!A:A)-1",
-            f"=SUM('{hoja}'!{letra_bultos}:{letra_bultos})",
-            f"=SUM('{hoja}'!{letra_kilos}:{letra_kilos})",
-            paradas
-        ])
-
-        # Hipervínculo en columna Clave → hoja correspondiente
-        cell = ws_res.cell(row=fila_idx, column=1)
-        cell.hyperlink = f"#{quote_sheetname(hoja)}!A1"
-        cell.font = Font(color="0000FF", underline="single")
-
-        # Hipervínculo de regreso en cada hoja → RESUMEN_UNICO en A1
-        ws.insert_rows(1)
-        cell_back = ws.cell(row=1, column=1)
-        cell_back.value = "← RESUMEN"
-        cell_back.hyperlink = f"#{quote_sheetname('RESUMEN_UNICO')}!A1"
-        cell_back.font = Font(color="0000FF", underline="single", bold=True)
-
-    ws_res.column_dimensions["A"].width = 30
-    ws_res.column_dimensions["B"].width = 15
-    ws_res.column_dimensions["C"].width = 15
-    ws_res.column_dimensions["D"].width = 15
-    ws_res.column_dimensions["E"].width = 12
-
-    wb.save(ruta_excel)
+from openpyxl import load_workbook
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter, quote_sheetname
+
+from instantanea import VOLVER_RESUMEN, guardar_libro
+from salida_excel import HojaSalida
+
+ENLACE_RESUMEN = f"#{quote_sheetname('RESUMEN_UNICO')}!A1"
+
+CABECERA_RESUMEN = ["Clave", "Expediciones", "Bultos", "Kilos", "Paradas"]
+ANCHOS_RESUMEN = {"A": 30, "B": 15, "C": 15, "D": 15, "E": 12}
+
+
+def encontrar_columna(ws, nombre):
+    for row in range(1, min(10, ws.max_row + 1)):
+        for col in range(1, ws.max_column + 1):
+            if ws.cell(row=row, column=col).value == nombre:
+                return col
+    return None
+
+
+def hojas_operativas(nombres) -> list:
+    """Hojas que resume RESUMEN_UNICO, en su orden: ALMACEN, HOSPITALES, FEDERACION y ZREP_*."""
+    operativas = [h for h in ("ALMACEN", "HOSPITALES", "FEDERACION") if h in nombres]
+    operativas.extend(sorted(h for h in nombres if h.startswith("ZREP_")))
+    return operativas
+
+
+def fila_resumen(hoja: str, letra_bultos: str, letra_kilos: str, paradas_por_hoja: dict = None) -> list:
+    paradas = paradas_por_hoja.get(hoja, "") if paradas_por_hoja else ""
+    return [
+        hoja,
+        f"=COUNTA('{hoja}'!A:A)-1",
+        f"=SUM('{hoja}'!{letra_bultos}:{letra_bultos})",
+        f"=SUM('{hoja}'!{letra_kilos}:{letra_kilos})",
+        paradas
+    ]
+
+
+def escribir_resumen_unico(wb, columnas_por_hoja: dict, paradas_por_hoja: dict = None) -> set:
+    """
+    RESUMEN_UNICO en un libro write_only (salida_excel) a partir de las
+    cabeceras de cada hoja, sin leer el libro. Devuelve las hojas resumidas:
+    son las que deben empezar por la fila de regreso (fila_volver).
+    """
+    ws_res = HojaSalida(wb, "RESUMEN_UNICO", anchos=ANCHOS_RESUMEN)
+    ws_res.fila(CABECERA_RESUMEN, "negrita")
+
+    resumidas = set()
+    for hoja in hojas_operativas(columnas_por_hoja):
+        columnas = list(columnas_por_hoja[hoja])
+        kilos = "Kgs" if "Kgs" in columnas else "Kilos"
+        if "Bultos" not in columnas or kilos not in columnas:
+            continue
+        fila = fila_resumen(
+            hoja,
+            get_column_letter(columnas.index("Bultos") + 1),
+            get_column_letter(columnas.index(kilos) + 1),
+            paradas_por_hoja,
+        )
+        fila[0] = ws_res.celda(hoja, "enlace", enlace=f"#{quote_sheetname(hoja)}!A1")
+        if fila[4] == "":
+            fila[4] = None
+        ws_res.fila(fila)
+        resumidas.add(hoja)
+    return resumidas
+
+
+def fila_volver(hoja: HojaSalida):
+    """Primera fila de cada hoja resumida: enlace de regreso a RESUMEN_UNICO."""
+    hoja.fila([hoja.celda(VOLVER_RESUMEN, "enlace_negrita", enlace=ENLACE_RESUMEN)])
+
+
+def generar_resumen_unico(ruta_excel: str, paradas_por_hoja: dict = None) -> None:
+
+    wb = load_workbook(ruta_excel)
+
+    if "RESUMEN_UNICO" in wb.sheetnames:
+        del wb["RESUMEN_UNICO"]
+
+    operativas = hojas_operativas(wb.sheetnames)
+
+    ws_res = wb.create_sheet("RESUMEN_UNICO", 0)
+    ws_res.append(CABECERA_RESUMEN)
+    for cell in ws_res[1]:
+        cell.font = Font(bold=True)
+
+    for hoja in operativas:
+        ws = wb[hoja]
+        col_bultos = encontrar_columna(ws, "Bultos")
+        col_kilos = encontrar_columna(ws, "Kgs") or encontrar_columna(ws, "Kilos")
+
+        if col_bultos is None or col_kilos is None:
+            continue
+
+        letra_bultos = ws.cell(row=1, column=col_bultos).column_letter
+        letra_kilos = ws.cell(row=1, column=col_kilos).column_letter
+
+        ws_res.append(fila_resumen(hoja, letra_bultos, letra_kilos, paradas_por_hoja))
+
+        # Hipervínculo en columna Clave → hoja correspondiente (las hojas saltadas no tienen fila)
+        cell = ws_res.cell(row=ws_res.max_row, column=1)
+        cell.hyperlink = f"#{quote_sheetname(hoja)}!A1"
+        cell.font = Font(color="0000FF", underline="single")
+
+        # Hipervínculo de regreso en cada hoja → RESUMEN_UNICO en A1
+        ws.insert_rows(1)
+        cell_back = ws.cell(row=1, column=1)
+        cell_back.value = VOLVER_RESUMEN
+        cell_back.hyperlink = ENLACE_RESUMEN
+        cell_back.font = Font(color="0000FF", underline="single", bold=True)
+
+    for letra, ancho in ANCHOS_RESUMEN.items():
+        ws_res.column_dimensions[letra].width = ancho
+
+    guardar_libro(wb, ruta_excel)
@@ -1,8 +1,6 @@
-import sys
 import uuid
 import shutil
 import tempfile
-import subprocess
 import datetime
 import requests
 import pandas as pd
@@ -12,7 +10,10 @@ import streamlit as st
 from auth import init_db, render_login, render_panel_admin, registrar_actividad
 from reordenar_rutas import reordenar_excel, generar_link_pueblos, generar_links_segmentos, generar_kml
 from add_resumen_unico import generar_resumen_unico
-from modulo_valencia_gestores import generar_libros_gestores
+from cache_resultados import tamano_cache as tamano_cache_resultados, vaciar_cache as vaciar_cache_resultados
+from instantanea import fila_cabecera, filas_hoja, guardar_libro, leer_libro, tabla_leida, tabla_valores
+from motor_reglas import cargar_reglas, compilar_reglas, ruta_compilado
+from trabajadores import PoolFase1
 from openpyxl import load_workbook
 
 # ==========================================================
@@ -29,7 +30,8 @@ if "usuario" not in st.session_state:
     render_login()
     st.stop()
 
-# Comprobación de estado de la API de Google Maps (una sola vez por sesión)
+# Comprobación de estado de la API de Google Maps (una sola vez por sesión).
+# Si no responde se trabaja sin conexión: caché y resolutor local
 if "google_api_ok" not in st.session_state:
     try:
         resp = requests.get(
@@ -38,13 +40,9 @@ if "google_api_ok" not in st.session_state:
             timeout=5,
         )
         data = resp.json()
-        if data.get("status") not in ("OK", "ZERO_RESULTS"):
-            st.error("🔌 Desconexión por falta de uso")
-            st.stop()
-        st.session_state.google_api_ok = True
+        st.session_state.google_api_ok = data.get("status") in ("OK", "ZERO_RESULTS")
     except Exception:
-        st.error("🔌 Desconexión por falta de uso")
-        st.stop()
+        st.session_state.google_api_ok = False
 
 usuario = st.session_state["usuario"]
 
@@ -80,10 +78,11 @@ with st.sidebar:
         st.session_state.workdir = Path(tempfile.mkdtemp(prefix="reparto_"))
         st.session_state.run_id = str(uuid.uuid4())[:8]
         st.rerun()
-    if st.button("🗑️ Limpiar caché geocodificación"):
-        from geocodificador import limpiar_cache
-        limpiar_cache()
-        st.success("Caché limpiada correctamente")
+    if not st.session_state.google_api_ok:
+        st.warning("🔌 Google Maps no responde: modo sin conexión (caché y coordenadas de referencia)")
+        if st.button("Reintentar conexión"):
+            del st.session_state["google_api_ok"]
+            st.rerun()
 
 # ==========================================================
 # CONFIG RUTAS
@@ -92,10 +91,25 @@ if "GOOGLE_MAPS_API_KEY" not in st.secrets:
     st.error("⚠️ Falta la clave GOOGLE_MAPS_API_KEY en los secrets. Contacta con el administrador.")
     st.stop()
 
+# Sin conexión no se llama a la API (ni geocodificación ni Routes)
+API_KEY = st.secrets["GOOGLE_MAPS_API_KEY"] if st.session_state.google_api_ok else ""
+
 REPO_DIR = Path(__file__).resolve().parent
-SCRIPT_REPARTO = REPO_DIR / "reparto_gpt.py"
 REGLAS_REPO = REPO_DIR / "Reglas_hospitales.xlsx"
 
+# CSV de llegadas a partir de este tamaño se procesan por bloques (memoria acotada)
+FASE1_BLOQUE_BYTES = 20 * 1024 * 1024
+FASE1_BLOQUE_FILAS = 20_000
+
+
+@st.cache_resource
+def pool_fase1() -> PoolFase1:
+    """Procesos de Fase 1 compartidos por todas las sesiones del servidor."""
+    return PoolFase1()
+
+
+pool_fase1()
+
 # ==========================================================
 # DELEGACIÓN
 # - Admin:   selector en sidebar
@@ -183,55 +197,41 @@ with tab1:
         input_csv = workdir / "llegadas.csv"
         input_csv.write_bytes(csv_file.getbuffer())
 
-        (workdir / "Reglas_hospitales.xlsx").write_bytes(
-            REGLAS_REPO.read_bytes()
-        )
+        # Las reglas compiladas van junto al Excel; se recompilan solo si ha cambiado
+        cargar_reglas(REGLAS_REPO)
+        for origen in (REGLAS_REPO, ruta_compilado(REGLAS_REPO)):
+            if origen.exists():
+                (workdir / origen.name).write_bytes(origen.read_bytes())
 
         if st.button("Generar salida.xlsx", key="fase1_btn"):
 
-            cmd = [
-                sys.executable,
-                str(SCRIPT_REPARTO),
-                "--csv", "llegadas.csv",
-                "--reglas", "Reglas_hospitales.xlsx",
-                "--out", "salida.xlsx",
-                "--delegacion", delegacion,
-                "--api_key", st.secrets["GOOGLE_MAPS_API_KEY"],
-                "--coordenadas", str(COORDENADAS_REPO),
-            ]
-
-            with st.spinner("Ejecutando reparto_gpt.py…"):
-                p = subprocess.run(
-                    cmd,
-                    cwd=str(workdir),
-                    capture_output=True,
-                    text=True,
+            with st.spinner("Clasificando expediciones…"):
+                # Un solo paso: salida.xlsx ya con ALMACEN y RESUMEN_UNICO y, en Valencia,
+                # los libros por gestor escritos con las mismas filas
+                r = pool_fase1().ejecutar(
+                    csv_path=input_csv,
+                    reglas_path=workdir / REGLAS_REPO.name,
+                    out_path=workdir / "salida.xlsx",
+                    origen="LLEGADAS",
+                    delegacion=delegacion,
+                    api_key=API_KEY,
+                    ruta_coordenadas=COORDENADAS_REPO,
+                    bloque=FASE1_BLOQUE_FILAS if input_csv.stat().st_size > FASE1_BLOQUE_BYTES else None,
+                    libro_final=True,
+                    asignacion_gestores=REPO_DIR / "gestor_zonas.xlsx" if delegacion == "valencia" else None,
+                    cache=True,
                 )
 
-            if p.returncode != 0:
-                st.error("Error en reparto_gpt.py")
-                st.code(p.stderr)
+            if not r["ok"]:
+                st.error(f"Error en la Fase 1: {r['error']}")
+                st.code(r["detalle"] or r["mensajes"])
             else:
                 salida = workdir / "salida.xlsx"
                 if salida.exists():
-                    # Crear hoja ALMACEN antes de generar resumen para que aparezca en él
-                    from openpyxl import load_workbook as _lw_f1
-                    _wb_f1 = _lw_f1(salida)
-                    if "ALMACEN" not in _wb_f1.sheetnames:
-                        _ref_hoja = next(
-                            (h for h in ["HOSPITALES", "FEDERACION"] + sorted([s for s in _wb_f1.sheetnames if s.startswith("ZREP_")])
-                             if h in _wb_f1.sheetnames),
-                            None
-                        )
-                        _idx_hosp = _wb_f1.sheetnames.index("HOSPITALES") if "HOSPITALES" in _wb_f1.sheetnames else 0
-                        _ws_alm = _wb_f1.create_sheet(title="ALMACEN", index=_idx_hosp)
-                        if _ref_hoja:
-                            _cabeceras = [c.value for c in next(_wb_f1[_ref_hoja].iter_rows(min_row=1, max_row=1))]
-                            _ws_alm.append(_cabeceras)
-                        _wb_f1.save(salida)
-                    generar_resumen_unico(str(salida))
                     registrar_actividad(usuario["id"], usuario["nombre"], delegacion, "Fase 1 - Clasificación zonas")
                     st.success("Archivo generado correctamente")
+                    if r["resultado"]["desde_cache"]:
+                        st.caption("Mismo CSV, reglas y parámetros que una ejecución anterior: resultado guardado.")
 
                     st.download_button(
                         "Descargar salida.xlsx",
@@ -241,13 +241,8 @@ with tab1:
                     )
 
                     # Excel por gestor solo para Valencia
-                    if delegacion == "valencia":
-                        ruta_asignacion = REPO_DIR / "gestor_zonas.xlsx"
-                        resultado_gestores = generar_libros_gestores(
-                            ruta_excel_final=str(salida),
-                            ruta_asignacion=str(ruta_asignacion),
-                            carpeta_salida=str(workdir)
-                        )
+                    resultado_gestores = r["resultado"]["gestores"]
+                    if resultado_gestores is not None:
                         if resultado_gestores["ok"]:
                             st.markdown("---")
                             st.subheader("Excel por gestor de tráfico")
@@ -307,11 +302,7 @@ with tab2:
                 hoja_destino = st.selectbox("Hoja destino", hojas_destino, key="hoja_destino")
 
             def ws_to_df(wb, nombre):
-                ws = wb[nombre]
-                datos = [r for r in ws.values if not (r[0] == "← RESUMEN")]
-                if not datos:
-                    return pd.DataFrame()
-                return pd.DataFrame(datos[1:], columns=datos[0])
+                return tabla_valores(wb[nombre].values)
 
             df_origen = ws_to_df(wb, hoja_origen)
             df_destino = ws_to_df(wb, hoja_destino)
@@ -544,7 +535,7 @@ with tab2:
                         st.rerun()
 
             ajuste_salida = workdir / "ajuste_salida.xlsx"
-            wb.save(ajuste_salida)
+            guardar_libro(wb, ajuste_salida)
             st.download_button(
                 "⬇️ Descargar Excel modificado",
                 data=ajuste_salida.read_bytes(),
@@ -593,9 +584,10 @@ with tab3:
                     COORDENADAS_REPO,
                     lat_origen,
                     lon_origen,
-                    api_key=st.secrets["GOOGLE_MAPS_API_KEY"],
+                    api_key=API_KEY,
                     delegacion=delegacion,
                     hora_salida=hora_salida,
+                    cache=True,
                 )
 
                 generar_resumen_unico(str(output_path), paradas_por_hoja=paradas)
@@ -648,28 +640,23 @@ with tab_refino:
 
         _refino_path = Path(st.session_state["refino_path"])
 
-        _wb_tmp = load_workbook(_refino_path, read_only=True)
+        # Instantánea de la Fase 3 si es el mismo fichero; si no, se lee el Excel una vez
+        _libro_refino = leer_libro(_refino_path)
         _hojas_refino = [
-            h for h in _wb_tmp.sheetnames
+            h for h in _libro_refino
             if h.startswith("ZREP_") or h in ("ALMACEN", "HOSPITALES", "FEDERACION")
         ]
-        _wb_tmp.close()
 
         if not _hojas_refino:
             st.warning("No se encontraron hojas operativas (ZREP_, HOSPITALES, FEDERACION).")
         else:
             _hoja_refino = st.selectbox("Seleccionar hoja", _hojas_refino, key="refino_hoja")
 
-            _wb_r = load_workbook(_refino_path, read_only=True, data_only=True)
-            _ws_r = _wb_r[_hoja_refino]
-            _all_rows = [tuple(c.value for c in row) for row in _ws_r.iter_rows()]
-            _wb_r.close()
+            _all_rows = filas_hoja(_libro_refino[_hoja_refino])
 
-            _hdr_idx = None
-            for _i, _row in enumerate(_all_rows):
-                if _row and "Exp" in _row:
-                    _hdr_idx = _i
-                    break
+            _hdr_idx = fila_cabecera(_all_rows) if _all_rows else None
+            if _hdr_idx is not None and "Exp" not in _all_rows[_hdr_idx]:
+                _hdr_idx = None
 
             if _hdr_idx is None:
                 st.error("No se encontró la cabecera (columna Exp) en la hoja seleccionada.")
@@ -931,7 +918,7 @@ with tab_refino:
                                     _ws_alm_save.append(_fila_alm)
                                 st.session_state[_almacen_key] = []
 
-                            _wb_save.save(_refino_path)
+                            guardar_libro(_wb_save, _refino_path)
 
                             registrar_actividad(
                                 usuario["id"], usuario["nombre"], delegacion,
@@ -980,12 +967,11 @@ if usuario["rol"] == "admin":
 
             _kml_path = Path(st.session_state["kml_path"])
 
-            _wb_kml = load_workbook(_kml_path, read_only=True)
+            _libro_kml = leer_libro(_kml_path)
             _hojas_kml = [
-                h for h in _wb_kml.sheetnames
+                h for h in _libro_kml
                 if h.startswith("ZREP_") or h in ("HOSPITALES", "FEDERACION")
             ]
-            _wb_kml.close()
 
             if not _hojas_kml:
                 st.warning("No se encontraron hojas operativas (ZREP_, HOSPITALES, FEDERACION).")
@@ -997,20 +983,11 @@ if usuario["rol"] == "admin":
                 else:
                     _lat_kml, _lon_kml = 39.804106, -0.217351
 
-                _df_kml = pd.read_excel(_kml_path, sheet_name=_hoja_kml, header=None)
-
-                _hdr_row = None
-                for _i, _row in _df_kml.iterrows():
-                    if "Exp" in _row.values:
-                        _hdr_row = _i
-                        break
+                _df_kml = tabla_leida(_libro_kml[_hoja_kml])
 
-                if _hdr_row is None:
+                if "Exp" not in _df_kml.columns:
                     st.error("No se encontró la cabecera en la hoja seleccionada.")
                 else:
-                    _df_kml.columns = _df_kml.iloc[_hdr_row]
-                    _df_kml = _df_kml.iloc[_hdr_row + 1:].reset_index(drop=True)
-
                     _kml_str = generar_kml(_df_kml, _hoja_kml, _lat_kml, _lon_kml)
 
                     st.download_button(
@@ -1029,4 +1006,151 @@ if usuario["rol"] == "admin":
 # ==========================================================
 if usuario["rol"] == "admin":
     with tab_admin:
-        render_panel_admin()
\ No newline at end of file
+        render_panel_admin()
+
+        # ── Reglas de clasificación ──────────────────────────
+        st.markdown("---")
+        st.subheader("Reglas de clasificación")
+        st.caption("Tras editar Reglas_hospitales.xlsx se recompilan solas en la siguiente Fase 1; "
+                   "precompilarlas evita esa espera y comprueba que el Excel se lee bien.")
+        if st.button("Precompilar reglas", key="reglas_compilar_btn"):
+            try:
+                motores = compilar_reglas(REGLAS_REPO)
+                st.success(" · ".join(f"{nombre}: {len(m)} reglas" for nombre, m in motores.items()))
+            except Exception as e:
+                st.error(f"No se pudieron compilar las reglas: {e}")
+
+        # ── Caché de geocodificación ─────────────────────────
+        st.markdown("---")
+        st.subheader("Caché de geocodificación")
+        from calentar_cache import calentar, informe_cobertura
+        from geocodificador import (
+            compactar_cache, exportar_cache, importar_cache, invalidar_cache,
+            limpiar_cache, podar_cache, tamano_cache,
+        )
+
+        tam = tamano_cache()
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("Entradas", tam["filas"])
+        c2.metric("Sin resultado", tam["negativas"])
+        c3.metric("Tamaño", f"{(tam['bytes'] + tam['bytes_wal']) / 1_048_576:.1f} MB")
+        c4.metric("Espacio libre", f"{tam['bytes_libres'] / 1_048_576:.1f} MB")
+
+        with st.expander("Invalidar entradas", expanded=False):
+            st.caption("Se borran las entradas que cumplen todos los filtros indicados.")
+            i1, i2 = st.columns(2)
+            with i1:
+                inv_municipio = st.text_input("Municipio", key="inv_municipio")
+                inv_cp = st.text_input("C.P.", key="inv_cp")
+                inv_patron = st.text_input("Calle (texto o patrón con * y ?)", key="inv_patron")
+            with i2:
+                inv_dias = st.number_input("Creadas hace más de (días, 0 = cualquiera)",
+                                           min_value=0, value=0, step=1, key="inv_dias")
+                inv_neg = st.checkbox("Solo entradas sin resultado", key="inv_neg")
+            filtros = dict(
+                municipio=inv_municipio, cp=inv_cp, patron=inv_patron,
+                dias=int(inv_dias) or None, solo_negativas=inv_neg,
+            )
+            b1, b2 = st.columns(2)
+            try:
+                with b1:
+                    if st.button("Vista previa", key="inv_previa_btn"):
+                        st.info(f"{invalidar_cache(**filtros, simular=True)} entradas cumplen los filtros")
+                with b2:
+                    if st.button("Invalidar", type="primary", key="inv_borrar_btn"):
+                        st.success(f"{invalidar_cache(**filtros)} entradas invalidadas")
+                        vaciar_cache_resultados()
+                        pool_fase1().reiniciar()
+            except ValueError as e:
+                st.error(str(e))
+
+        with st.expander("Mantenimiento", expanded=False):
+            if st.button("Podar entradas poco usadas", key="cache_podar_btn"):
+                st.success(f"{podar_cache()} entradas expulsadas")
+                vaciar_cache_resultados()
+                pool_fase1().reiniciar()
+            if st.button("Compactar (VACUUM)", key="cache_vacuum_btn"):
+                res = compactar_cache()
+                antes = res["antes"]["bytes"] + res["antes"]["bytes_wal"]
+                despues = res["despues"]["bytes"] + res["despues"]["bytes_wal"]
+                st.success(f"{antes / 1_048_576:.1f} MB → {despues / 1_048_576:.1f} MB")
+            st.markdown("---")
+            confirmar = st.checkbox("Entiendo que se borrará toda la caché", key="cache_confirmar_vaciar")
+            if st.button("🗑️ Vaciar caché geocodificación", disabled=not confirmar, key="cache_vaciar_btn"):
+                limpiar_cache()
+                vaciar_cache_resultados()
+                pool_fase1().reiniciar()
+                st.success("Caché limpiada correctamente")
+
+        with st.expander("Precalentar con llegadas históricas", expanded=False):
+            historicos = st.file_uploader(
+                "CSV de llegadas históricos", type=["csv"],
+                accept_multiple_files=True, key="cache_historicos"
+            )
+            rutas_hist = []
+            if historicos:
+                dir_hist = workdir / "historicos"
+                dir_hist.mkdir(exist_ok=True)
+                for f in historicos:
+                    ruta = dir_hist / f.name
+                    ruta.write_bytes(f.getbuffer())
+                    rutas_hist.append(ruta)
+
+            col_cob, col_cal = st.columns(2)
+            with col_cob:
+                if st.button("Calcular cobertura", disabled=not rutas_hist, key="cache_cobertura_btn"):
+                    with st.spinner("Leyendo direcciones…"):
+                        cob = informe_cobertura(rutas_hist, delegacion)
+                    st.metric("Cobertura actual", f"{cob['cobertura_pct']} %")
+                    st.write(
+                        f"{cob['direcciones']} direcciones · {cob['vigentes']} en caché · "
+                        f"{cob['negativas']} sin resultado · {cob['caducadas']} caducadas · "
+                        f"{cob['pendientes']} irían a la API"
+                    )
+            with col_cal:
+                if st.button("Precalentar", disabled=not rutas_hist or not API_KEY, key="cache_calentar_btn"):
+                    with st.spinner("Geocodificando direcciones pendientes…"):
+                        res = calentar(rutas_hist, delegacion, API_KEY)
+                    st.success(
+                        f"Cobertura {res['antes']['cobertura_pct']} % → {res['despues']['cobertura_pct']} % "
+                        f"({res['consultas_api']} consultas, {res['nuevas']} nuevas)"
+                    )
+                    if res["errores"]:
+                        st.warning(f"{len(res['errores'])} direcciones con error; se reintentarán en el próximo uso")
+
+        with st.expander("Exportar / importar", expanded=False):
+            if st.button("Preparar exportación", key="cache_exportar_btn"):
+                ruta_exp = workdir / "geocache.csv.gz"
+                n = exportar_cache(ruta_exp)
+                st.session_state.cache_exportada = ruta_exp.read_bytes()
+                st.info(f"{n} entradas exportadas")
+            if st.session_state.get("cache_exportada"):
+                st.download_button(
+                    "⬇️ Descargar geocache.csv.gz",
+                    data=st.session_state.cache_exportada,
+                    file_name="geocache.csv.gz",
+                    mime="application/gzip",
+                    key="cache_descargar_btn"
+                )
+
+            fichero_imp = st.file_uploader("Importar geocache.csv.gz", type=["gz"], key="cache_importar")
+            if fichero_imp is not None and st.button("Importar", key="cache_importar_btn"):
+                ruta_imp = workdir / "geocache_importada.csv.gz"
+                ruta_imp.write_bytes(fichero_imp.getbuffer())
+                res = importar_cache(ruta_imp)
+                vaciar_cache_resultados()
+                pool_fase1().reiniciar()
+                st.success(f"{res['importadas']} entradas importadas · {res['omitidas']} ya estaban al día")
+
+        # ── Caché de resultados ──────────────────────────────
+        st.markdown("---")
+        st.subheader("Caché de resultados")
+        st.caption("Fase 1 y Fase 3 con los mismos ficheros y parámetros devuelven el resultado guardado. "
+                   "Solo guarda ejecuciones sin errores ni aproximaciones de geocodificación o de rutas, "
+                   "y deja de usarse al cambiar la caché de geocodificación.")
+        tam_res = tamano_cache_resultados()
+        r1, r2 = st.columns(2)
+        r1.metric("Resultados guardados", tam_res["entradas"])
+        r2.metric("Tamaño", f"{tam_res['bytes'] / 1_048_576:.1f} MB")
+        if st.button("Vaciar caché de resultados", key="resultados_vaciar_btn"):
+            st.success(f"{vaciar_cache_resultados()} resultados borrados")
@@ -15,16 +15,15 @@ ATRASOS · PENDIENTES (determinista)
 
 from __future__ import annotations
 
-import csv
 import os
 from datetime import datetime, date, time, timedelta
 
 import numpy as np
 import pandas as pd
-from pandas.errors import ParserError
-from openpyxl import Workbook
 from openpyxl.utils import get_column_letter
-from openpyxl.styles import Font, PatternFill, Alignment
+
+from lector_csv import avisar_descartadas, leer_csv
+from salida_excel import HojaSalida, nuevo_libro
 
 
 REQUIRED_COLS = [
@@ -40,48 +39,13 @@ REQUIRED_COLS = [
 
 def read_csv_robusto(path: str) -> pd.DataFrame:
     """
-    Lectura robusta y determinista:
-    1) Intenta autodetectar separador (engine=python) con UTF-8-SIG.
-    2) Si hay ParserError por comillas rotas, fuerza sep=';' y desactiva quoting.
-    3) Repite lo anterior con latin-1 si falla por encoding.
+    Lectura robusta y determinista (lector_csv): una sola lectura del fichero,
+    separador autodetectado, UTF-8 o latin-1, y sin comillas solo si están rotas.
+    Las líneas mal formadas se descartan y se informan.
     """
-    # Intento 1: autodetección
-    try:
-        return pd.read_csv(path, dtype=str, sep=None, engine="python", encoding="utf-8-sig")
-    except UnicodeDecodeError:
-        pass
-    except ParserError:
-        pass
-
-    # Intento 2: fuerza ';' y desactiva quoting (típico en exports con comillas mal cerradas)
-    try:
-        return pd.read_csv(
-            path,
-            dtype=str,
-            sep=";",
-            engine="python",
-            encoding="utf-8-sig",
-            quoting=csv.QUOTE_NONE,
-            escapechar="\\",
-        )
-    except UnicodeDecodeError:
-        pass
-    except ParserError:
-        pass
-
-    # Intento 3: latin-1 (último recurso)
-    try:
-        return pd.read_csv(path, dtype=str, sep=None, engine="python", encoding="latin-1")
-    except ParserError:
-        return pd.read_csv(
-            path,
-            dtype=str,
-            sep=";",
-            engine="python",
-            encoding="latin-1",
-            quoting=csv.QUOTE_NONE,
-            escapechar="\\",
-        )
+    df = leer_csv(path)
+    avisar_descartadas(df, os.path.basename(path))
+    return df
 
 
 def compute_cutoff_end_of_yesterday() -> datetime:
@@ -102,50 +66,18 @@ def tramo_from_hours(h: float) -> str:
 
 
 def build_excel(out_path: str, cutoff: datetime, out_df: pd.DataFrame) -> None:
-    wb = Workbook()
+    wb = nuevo_libro()
 
     # PARAM
-    ws_param = wb.active
-    ws_param.title = "PARAM"
-    ws_param["A1"] = "Corte (cierre de ayer)"
-    ws_param["B1"] = cutoff
-    ws_param["A1"].font = Font(bold=True)
-    ws_param["B1"].number_format = "dd/mm/yyyy hh:mm:ss"
-    ws_param.column_dimensions["A"].width = 28
-    ws_param.column_dimensions["B"].width = 22
+    ws_param = HojaSalida(wb, "PARAM", anchos={"A": 28, "B": 22})
+    ws_param.fila([
+        ws_param.celda("Corte (cierre de ayer)", "negrita"),
+        ws_param.celda(cutoff, formato="dd/mm/yyyy hh:mm:ss"),
+    ])
 
     # PENDIENTES
-    ws = wb.create_sheet("PENDIENTES")
     headers = list(out_df.columns)
 
-    header_fill = PatternFill("solid", fgColor="D9E1F2")
-    header_font = Font(bold=True)
-    header_align = Alignment(horizontal="center", vertical="center", wrap_text=True)
-
-    ws.append(headers)
-    for j, h in enumerate(headers, start=1):
-        c = ws.cell(row=1, column=j)
-        c.fill = header_fill
-        c.font = header_font
-        c.alignment = header_align
-
-    ws.freeze_panes = "A2"
-    ws.auto_filter.ref = f"A1:{get_column_letter(len(headers))}1"
-    ws.row_dimensions[1].height = 28
-
-    # Volcado (con conversión NA->None para no romper openpyxl)
-    for _, r in out_df.iterrows():
-        row = []
-        for h in headers:
-            v = r[h]
-            if pd.isna(v):
-                row.append(None)
-            elif h == "F.Llegada":
-                row.append(v.to_pydatetime() if hasattr(v, "to_pydatetime") else v)
-            else:
-                row.append(v)
-        ws.append(row)
-
     # Formatos y anchos
     widths = {
         "Exp": 12,
@@ -158,15 +90,28 @@ def build_excel(out_path: str, cutoff: datetime, out_df: pd.DataFrame) -> None:
         "Días de atraso": 14,
         "Tramo": 10,
     }
+    formatos = {"F.Llegada": "dd/mm/yyyy hh:mm", "Días de atraso": "0"}
+
+    ws = HojaSalida(
+        wb, "PENDIENTES",
+        anchos={j: widths.get(h, 14) for j, h in enumerate(headers, start=1)},
+        congelar="A2",
+        autofiltro=f"A1:{get_column_letter(len(headers))}1",
+    )
+    ws.fila([ws.celda(h, "cabecera_atrasos") for h in headers], alto=28)
 
-    for j, h in enumerate(headers, start=1):
-        ws.column_dimensions[get_column_letter(j)].width = widths.get(h, 14)
-        if h == "F.Llegada":
-            for i in range(2, ws.max_row + 1):
-                ws.cell(i, j).number_format = "dd/mm/yyyy hh:mm"
-        if h == "Días de atraso":
-            for i in range(2, ws.max_row + 1):
-                ws.cell(i, j).number_format = "0"
+    # Volcado (con conversión NA->None para no romper openpyxl)
+    por_columna = [formatos.get(h) for h in headers]
+    for valores in out_df.itertuples(index=False, name=None):
+        row = []
+        for h, v in zip(headers, valores):
+            if pd.isna(v):
+                row.append(None)
+            elif h == "F.Llegada":
+                row.append(v.to_pydatetime() if hasattr(v, "to_pydatetime") else v)
+            else:
+                row.append(v)
+        ws.fila(row, formatos=por_columna)
 
     wb.save(out_path)
 
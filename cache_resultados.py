@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+cache_resultados.py — Caché de resultados de la Fase 1 y la Fase 3 por contenido de las entradas
+- Clave: SHA-256 de la fase, los bytes de cada fichero de entrada (CSV, reglas, coordenadas…), los parámetros
+  y el código del proyecto (version_codigo): una entrada no sobrevive a un cambio de normalización o reglas
+- Cada entrada es una carpeta con los ficheros generados y datos.json con lo que devolvió la fase
+- Una petición idéntica copia esos ficheros a su carpeta de salida y devuelve los mismos datos, sin recalcular
+- Expulsión LRU por presupuesto de disco: el último uso es la fecha de datos.json
+- guardar_objeto/recuperar_objeto: entradas con un objeto Python (hojas ya ordenadas de la Fase 3)
+- Las fases ponen en la clave la generación de la caché de geocodificación (cambia al invalidarla,
+  podarla, importarla, vaciarla o precalentarla) y solo guardan resultados definitivos: sin errores
+  de la API, aproximaciones locales ni rutas de respaldo
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from functools import cache
+from pathlib import Path
+
+# Cambiar si cambia el formato de las entradas o lo que generan las fases: invalida las guardadas
+VERSION_CACHE = 1
+
+RAIZ = Path(__file__).resolve().parent
+CARPETA_CACHE = RAIZ / "cache_resultados"
+PRESUPUESTO_BYTES = 1024 * 1024 * 1024
+
+# Carpetas temporales de guardados interrumpidos
+CADUCIDAD_TEMPORALES = 3600
+
+# Fichero de las entradas de guardar_objeto
+FICHERO_OBJETO = "objeto.pkl"
+
+
+# -------------------------
+# CLAVE
+# -------------------------
+
+@cache
+def version_codigo() -> str:
+    """
+    SHA-256 de los módulos .py del proyecto (normalización, reglas, geocodificación,
+    rutas…). Se calcula una vez por proceso: los procesos se arrancan de nuevo al
+    desplegar otra versión.
+    """
+    h = hashlib.sha256()
+    for ruta in sorted(RAIZ.glob("*.py")):
+        h.update(f"\0{ruta.name}\0".encode("utf-8"))
+        h.update(ruta.read_bytes())
+    return h.hexdigest()
+
+
+def clave_resultado(fase: str, ficheros: dict, parametros: dict) -> str:
+    """
+    Huella de una petición: `ficheros` {nombre: ruta o None} se resumen por
+    contenido (no por ruta ni fecha); `parametros` debe ser serializable a
+    JSON (lo que no lo es se toma como texto). Incluye version_codigo().
+    """
+    h = hashlib.sha256()
+    cabecera = {"version": VERSION_CACHE, "codigo": version_codigo(), "fase": fase, "parametros": parametros}
+    h.update(json.dumps(cabecera, sort_keys=True, default=str).encode("utf-8"))
+    for nombre, ruta in sorted(ficheros.items()):
+        h.update(f"\0{nombre}\0".encode("utf-8"))
+        if ruta is None:
+            h.update(b"-")
+        else:
+            with open(ruta, "rb") as f:
+                h.update(hashlib.file_digest(f, "sha256").digest())
+    return h.hexdigest()
+
+
+# -------------------------
+# ENTRADAS
+# -------------------------
+
+def recuperar(clave: str, carpeta_destino: Path, carpeta: Path = CARPETA_CACHE) -> dict | None:
+    """Copia los ficheros de la entrada a `carpeta_destino` y devuelve sus datos; None si no está."""
+    entrada = Path(carpeta) / clave
+    try:
+        guardado = json.loads((entrada / "datos.json").read_text(encoding="utf-8"))
+        for nombre in guardado["ficheros"]:
+            destino = Path(carpeta_destino) / nombre
+            destino.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(entrada / nombre, destino)
+        os.utime(entrada / "datos.json")
+        return guardado["datos"]
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Aviso: entrada de la caché de resultados ilegible, se recalcula: {e}")
+        return None
+
+
+def guardar(clave: str, carpeta_origen: Path, ficheros: list, datos: dict,
+            carpeta: Path = CARPETA_CACHE, presupuesto: int = PRESUPUESTO_BYTES):
+    """
+    Guarda `ficheros` (rutas relativas a `carpeta_origen`) y `datos` (JSON)
+    bajo la clave y expulsa las entradas menos usadas si se pasa del presupuesto.
+    """
+    carpeta = Path(carpeta)
+    tmp = None
+    try:
+        carpeta.mkdir(parents=True, exist_ok=True)
+        tmp = Path(tempfile.mkdtemp(dir=carpeta, prefix=".tmp_"))
+        for nombre in ficheros:
+            destino = tmp / nombre
+            destino.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(Path(carpeta_origen) / nombre, destino)
+        guardado = {"clave": clave, "ficheros": [str(nombre) for nombre in ficheros], "datos": datos}
+        (tmp / "datos.json").write_text(json.dumps(guardado, ensure_ascii=False), encoding="utf-8")
+        try:
+            os.rename(tmp, carpeta / clave)
+        except OSError:
+            # Ya la guardó otra ejecución con la misma petición
+            shutil.rmtree(tmp, ignore_errors=True)
+        podar(presupuesto, carpeta)
+    except OSError as e:
+        print(f"Aviso: no se pudo guardar el resultado en la caché: {e}")
+        if tmp is not None:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def recuperar_objeto(clave: str, carpeta: Path = CARPETA_CACHE):
+    """Objeto guardado con guardar_objeto; None si no está."""
+    entrada = Path(carpeta) / clave
+    try:
+        with open(entrada / FICHERO_OBJETO, "rb") as f:
+            objeto = pickle.load(f)
+        os.utime(entrada / "datos.json")
+        return objeto
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Aviso: entrada de la caché de resultados ilegible, se recalcula: {e}")
+        return None
+
+
+def guardar_objeto(clave: str, objeto, carpeta: Path = CARPETA_CACHE,
+                   presupuesto: int = PRESUPUESTO_BYTES):
+    """guardar() de un objeto Python (pickle) en lugar de ficheros generados."""
+    try:
+        with tempfile.TemporaryDirectory() as origen:
+            with open(Path(origen) / FICHERO_OBJETO, "wb") as f:
+                pickle.dump(objeto, f, protocol=pickle.HIGHEST_PROTOCOL)
+            guardar(clave, origen, [FICHERO_OBJETO], {}, carpeta, presupuesto)
+    except (OSError, pickle.PicklingError) as e:
+        print(f"Aviso: no se pudo guardar el resultado en la caché: {e}")
+
+
+# -------------------------
+# MANTENIMIENTO
+# -------------------------
+
+def _entradas(carpeta: Path) -> list:
+    """[(último uso, bytes, carpeta)] de las entradas, de la menos usada a la más usada."""
+    entradas = []
+    if not carpeta.exists():
+        return entradas
+    for entrada in carpeta.iterdir():
+        if not entrada.is_dir():
+            continue
+        if entrada.name.startswith(".tmp_"):
+            if time.time() - entrada.stat().st_mtime > CADUCIDAD_TEMPORALES:
+                shutil.rmtree(entrada, ignore_errors=True)
+            continue
+        try:
+            uso = (entrada / "datos.json").stat().st_mtime
+        except OSError:
+            uso = 0.0
+        tamano = sum(f.stat().st_size for f in entrada.rglob("*") if f.is_file())
+        entradas.append((uso, tamano, entrada))
+    entradas.sort(key=lambda e: e[0])
+    return entradas
+
+
+def podar(presupuesto: int = PRESUPUESTO_BYTES, carpeta: Path = CARPETA_CACHE) -> int:
+    """Expulsa las entradas usadas hace más tiempo hasta caber en `presupuesto`. Devuelve cuántas."""
+    entradas = _entradas(Path(carpeta))
+    total = sum(tamano for _, tamano, _ in entradas)
+    expulsadas = 0
+    for _, tamano, entrada in entradas:
+        if total <= presupuesto:
+            break
+        shutil.rmtree(entrada, ignore_errors=True)
+        total -= tamano
+        expulsadas += 1
+    return expulsadas
+
+
+def tamano_cache(carpeta: Path = CARPETA_CACHE) -> dict:
+    entradas = _entradas(Path(carpeta))
+    return {"entradas": len(entradas), "bytes": sum(tamano for _, tamano, _ in entradas)}
+
+
+def vaciar_cache(carpeta: Path = CARPETA_CACHE) -> int:
+    """Borra todas las entradas. Devuelve cuántas había."""
+    return podar(-1, carpeta)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+calentar_cache.py — Precalentado, exportación e importación de la caché de geocodificación
+- cobertura: cuánto de unos CSV de llegadas históricos resolvería ya la caché
+- calentar:  geocodifica por lotes las direcciones que faltan
+- exportar / importar: volcado compacto (.csv.gz) para copiar la caché entre equipos
+
+Uso:
+    python calentar_cache.py cobertura --csv llegadas_*.csv --delegacion castellon
+    python calentar_cache.py calentar  --csv llegadas_*.csv --delegacion castellon --api_key KEY
+    python calentar_cache.py exportar  --fichero geocache.csv.gz
+    python calentar_cache.py importar  --fichero geocache.csv.gz
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+from geocodificador import (
+    cobertura_cache,
+    estadisticas_ultimo_lote,
+    exportar_cache,
+    geocodificar_lote,
+    importar_cache,
+    nueva_generacion,
+)
+from reparto_gpt import direcciones_geocodificables, leer_llegadas, limpiar_direcciones
+
+# Direcciones por llamada a geocodificar_lote
+TAMANO_LOTE = 2000
+
+
+def direcciones_historicas(rutas_csv, delegacion: str) -> list:
+    """Direcciones completas únicas de varios CSV de llegadas, en orden de aparición."""
+    vistas = {}
+    for ruta in rutas_csv:
+        df = limpiar_direcciones(leer_llegadas(Path(ruta)), delegacion)
+        for d in direcciones_geocodificables(df, delegacion).values():
+            vistas.setdefault(d, None)
+    return list(vistas)
+
+
+def informe_cobertura(rutas_csv, delegacion: str) -> dict:
+    """Cobertura de la caché para las direcciones de los CSV (sin la lista de pendientes)."""
+    cobertura = cobertura_cache(direcciones_historicas(rutas_csv, delegacion))
+    cobertura["pendientes"] = len(cobertura["pendientes"])
+    return cobertura
+
+
+def calentar(rutas_csv, delegacion: str, api_key: str, tamano_lote: int = TAMANO_LOTE) -> dict:
+    """
+    Geocodifica con la API las direcciones de los CSV que la caché no cubre.
+    Devuelve {"antes": cobertura, "despues": cobertura, "consultas_api", "nuevas", "errores"}.
+    """
+    if not api_key:
+        raise ValueError("Se necesita api_key para precalentar la caché")
+
+    direcciones = direcciones_historicas(rutas_csv, delegacion)
+    antes = cobertura_cache(direcciones)
+    pendientes = antes["pendientes"]
+
+    consultas, nuevas, errores = 0, 0, {}
+    for i in range(0, len(pendientes), tamano_lote):
+        geocodificar_lote(pendientes[i:i + tamano_lote], api_key)
+        est = estadisticas_ultimo_lote()
+        consultas += est["consultas_api"]
+        nuevas += est["nuevas"]
+        errores.update(est["errores"])
+        print(f"Precalentado: {min(i + tamano_lote, len(pendientes))}/{len(pendientes)} direcciones")
+
+    if nuevas:
+        # Los resultados de la Fase 1 y 3 guardados con la caché anterior dejan de valer
+        nueva_generacion()
+    despues = cobertura_cache(direcciones)
+    antes["pendientes"] = len(antes["pendientes"])
+    despues["pendientes"] = len(despues["pendientes"])
+    return {"antes": antes, "despues": despues, "consultas_api": consultas, "nuevas": nuevas, "errores": errores}
+
+
+# -------------------------
+# MAIN
+# -------------------------
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("accion", choices=["cobertura", "calentar", "exportar", "importar"])
+    parser.add_argument("--csv", nargs="*", default=[])
+    parser.add_argument("--delegacion", default="castellon")
+    parser.add_argument("--api_key", default="")
+    parser.add_argument("--fichero", default="geocache.csv.gz")
+
+    args = parser.parse_args()
+
+    if args.accion in ("cobertura", "calentar") and not args.csv:
+        parser.error("--csv es obligatorio para cobertura y calentar")
+
+    if args.accion == "cobertura":
+        resultado = informe_cobertura(args.csv, args.delegacion)
+    elif args.accion == "calentar":
+        resultado = calentar(args.csv, args.delegacion, args.api_key)
+    elif args.accion == "exportar":
+        resultado = {"filas": exportar_cache(args.fichero), "fichero": args.fichero}
+    else:
+        resultado = importar_cache(args.fichero)
+
+    print(json.dumps(resultado, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
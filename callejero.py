@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+callejero.py — Corrección de nombres de calle contra el callejero de cada delegación
+- Un callejero por delegación, cargado la primera vez que se usa, con las calles por municipio
+- Municipio por población y, si no coincide, entre los del C.P.; índice por municipio agrupado por tipo de vía
+- Candidatos por q-gramas y longitud; decisión con la misma razón de difflib (corte 0.85)
+- Memoización por (población, dirección, C.P., delegación)
+
+Formato de callejeros/<delegacion>.csv (una fila por calle y C.P.):
+    municipio,cp,tipo,nombre
+    VALENCIA,46001,CALLE,SAN VICENTE MARTIR
+    TORRENT,46900,AVINGUDA,AL VEDAT
+`cp` y `tipo` pueden ir vacíos; sin `tipo` se toma del principio del nombre si es un tipo de vía.
+"""
+
+import difflib
+import math
+import re
+import threading
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+
+import pandas as pd
+
+from normalizacion import separar_tipo_via, texto_clave, tipo_via
+
+RAIZ = Path(__file__).resolve().parent
+
+DIR_CALLEJEROS = RAIZ / "callejeros"
+
+# Callejeros antiguos de ancho fijo, sin municipio ni C.P.: fichero y texto
+# de la población a la que se aplican (como hasta ahora, las que contienen CASTELL)
+CALLEJEROS_ANTIGUOS = {
+    "castellon": (RAIZ / "calles_castellon.csv", "CASTELL"),
+}
+
+CORTE_SIMILITUD = 0.85
+
+# Longitud mínima de un municipio para aceptarlo por estar contenido en la población o al revés
+_LONGITUD_MINIMA_MUNICIPIO = 4
+
+# Bigramas para nombres cortos y trigramas a partir de esta longitud
+_LONGITUD_TRIGRAMAS = 9
+
+_NUMERO_RE = re.compile(r"(.*?)[,\s]+(\d+.*)")
+_PREFIJO_RE = re.compile(r"^([^\s/.]+[/.]?)\s*(.*)$")
+_ARTICULO_RE = re.compile(r"^(.*?)\s*\(([^)]*)\)\s*$")
+
+
+# -------------------------
+# CARGA DEL CALLEJERO
+# -------------------------
+
+def reparar_nombre(tipo: str, nombre: str) -> tuple:
+    """
+    El CSV viene de un listado de ancho fijo cortado en la columna 6: `tipo`
+    lleva 5 caracteres de tipo de vía y la primera letra del nombre
+    ('CARREF' + 'ONT (DE LA)' → ('CARRE', 'FONT (DE LA)')).
+    """
+    tipo = str(tipo)
+    nombre = "" if pd.isna(nombre) else str(nombre)
+    inicial = tipo[5:].strip()
+    # '8' + 'DE MARÇ': la inicial numérica era una palabra aparte
+    separador = " " if inicial.isdigit() and nombre[:1].isalpha() else ""
+    return tipo[:5].strip(), f"{inicial}{separador}{nombre}".strip()
+
+
+def nombre_visible(nombre: str) -> str:
+    """Coloca delante el artículo entre paréntesis: 'FONT (DE LA)' → 'DE LA FONT'."""
+    m = _ARTICULO_RE.match(nombre)
+    if not m:
+        return nombre
+    base, articulo = m.group(1).strip(), m.group(2).strip()
+    # Solo si lo de dentro son artículos ('DE LA', "L'"), no otro texto
+    if not articulo or separar_tipo_via(articulo)[1]:
+        return nombre
+    union = "" if articulo.endswith("'") else " "
+    return f"{articulo}{union}{base}"
+
+
+def _qgramas(s: str, q: int) -> set:
+    return {s[i:i + q] for i in range(len(s) - q + 1)}
+
+
+def _minimo_compartidos(n: int, n_qgramas: int, lb: int, q: int) -> int:
+    """
+    Cota inferior de q-gramas distintos que comparten dos cadenas de longitud
+    n y lb con razón de difflib >= CORTE_SIMILITUD. Con M caracteres emparejados,
+    cada carácter sin pareja de la consulta anula como mucho q ventanas y cada
+    hueco solo en el candidato q - 1; el resto de ventanas caen dentro de un
+    bloque emparejado y están en las dos cadenas.
+    """
+    m = math.ceil(CORTE_SIMILITUD * (n + lb) / 2 - 1e-9)
+    return n_qgramas - q * (n - m) - (q - 1) * max(0, lb - m)
+
+
+class IndiceCallejero:
+    """Nombres normalizados del callejero por tipo de vía, con índices de bigramas y trigramas."""
+
+    def __init__(self, entradas):
+        # entradas: [(tipo_canónico, nombre_normalizado, nombre_visible)]
+        self.grupos = {}
+        for tipo, clave, visible in entradas:
+            if not clave:
+                continue
+            grupo = self.grupos.setdefault(tipo, {"nombres": {}, "por_longitud": {}, 2: {}, 3: {}})
+            if clave in grupo["nombres"]:
+                continue
+            grupo["nombres"][clave] = visible
+            grupo["por_longitud"].setdefault(len(clave), []).append(clave)
+            for q in (2, 3):
+                for g in _qgramas(clave, q):
+                    grupo[q].setdefault(g, []).append(clave)
+
+    def _candidatos(self, grupo: dict, clave: str):
+        n = len(clave)
+        longitudes = range(
+            math.ceil(n * CORTE_SIMILITUD / (2 - CORTE_SIMILITUD) - 1e-9),
+            math.floor(n * (2 - CORTE_SIMILITUD) / CORTE_SIMILITUD + 1e-9) + 1,
+        )
+        q = 3 if n >= _LONGITUD_TRIGRAMAS else 2
+        qgramas = _qgramas(clave, q)
+        cotas = {lb: _minimo_compartidos(n, len(qgramas), lb, q) for lb in longitudes}
+
+        # Si alguna longitud admite candidatos sin q-gramas en común se recorre entera
+        candidatos = []
+        for lb in [lb for lb, cota in cotas.items() if cota <= 0]:
+            candidatos.extend(grupo["por_longitud"].get(lb, ()))
+        compartidos = Counter()
+        for g in qgramas:
+            compartidos.update(grupo[q].get(g, ()))
+        candidatos.extend(
+            c for c, k in compartidos.items()
+            if 0 < cotas.get(len(c), n + 1) <= k
+        )
+        return candidatos
+
+    def buscar(self, tipo: str | None, clave: str):
+        """
+        (nombre_normalizado, nombre_visible) más parecido con razón >= CORTE_SIMILITUD
+        dentro del grupo del tipo de vía (o en todos si no hay tipo), o None.
+        Desempata como difflib.get_close_matches.
+        """
+        if not clave:
+            return None
+        grupos = [self.grupos[tipo]] if tipo in self.grupos else (
+            [] if tipo is not None else list(self.grupos.values())
+        )
+        mejor = None
+        s = difflib.SequenceMatcher()
+        s.set_seq2(clave)
+        for grupo in grupos:
+            for candidato in self._candidatos(grupo, clave):
+                s.set_seq1(candidato)
+                if (s.real_quick_ratio() >= CORTE_SIMILITUD
+                        and s.quick_ratio() >= CORTE_SIMILITUD):
+                    r = s.ratio()
+                    if r >= CORTE_SIMILITUD and (mejor is None or (r, candidato) > mejor[:2]):
+                        mejor = (r, candidato, grupo["nombres"][candidato])
+        return None if mejor is None else mejor[1:]
+
+
+def _entrada(tipo: str, nombre: str) -> tuple:
+    """(tipo_canónico, nombre_normalizado, nombre_visible) de una calle del callejero."""
+    nombre = nombre.upper()
+    if not tipo:
+        p = _PREFIJO_RE.match(nombre)
+        if p and tipo_via(texto_clave(p.group(1))):
+            tipo, nombre = p.group(1), p.group(2)
+    tipo_norm = texto_clave(tipo)
+    canonico = tipo_via(tipo_norm) or tipo_norm
+    return canonico, separar_tipo_via(nombre)[1], nombre_visible(nombre)
+
+
+def _cp(cp) -> str:
+    if cp is None or pd.isna(cp):
+        return ""
+    digitos = re.sub(r"\D", "", str(cp).strip().split(".")[0])
+    return digitos.zfill(5) if digitos else ""
+
+
+class Callejero:
+    """
+    Callejero de una delegación: calles por municipio y municipios por C.P.
+    El índice de cada municipio se construye la primera vez que se consulta.
+    """
+
+    def __init__(self):
+        self.calles = {}  # municipio → [(tipo_canónico, nombre_normalizado, nombre_visible)]
+        self.cps = {}  # cp → {municipio}
+        self.con_cp = set()  # municipios con alguna calle con C.P.
+        self._indices = {}
+        self._lock = threading.Lock()
+
+    def anadir(self, municipio: str, cp: str, tipo: str, nombre: str):
+        municipio = texto_clave(municipio)
+        if not municipio or not nombre:
+            return
+        self.calles.setdefault(municipio, []).append(_entrada(tipo, nombre))
+        cp = _cp(cp)
+        if cp:
+            self.cps.setdefault(cp, set()).add(municipio)
+            self.con_cp.add(municipio)
+
+    def municipio(self, poblacion: str, cp: str = "") -> str | None:
+        """
+        Municipio del callejero para la población: exacto; si no, entre los del
+        C.P., uno contenido en la población o al revés (el más largo); si no, el
+        único municipio del C.P. Los municipios sin ningún C.P. (callejeros
+        antiguos) valen si están contenidos en la población. Si no, None: un
+        parecido con el municipio de otro C.P. no basta.
+        """
+        poblacion = texto_clave(poblacion)
+        if poblacion in self.calles:
+            return poblacion
+        del_cp = self.cps.get(_cp(cp), set())
+        if len(poblacion) >= _LONGITUD_MINIMA_MUNICIPIO:
+            parecidos = [
+                m for m in del_cp
+                if len(m) >= _LONGITUD_MINIMA_MUNICIPIO and (m in poblacion or poblacion in m)
+            ]
+            if not parecidos:
+                parecidos = [
+                    m for m in self.calles
+                    if m not in self.con_cp and len(m) >= _LONGITUD_MINIMA_MUNICIPIO and m in poblacion
+                ]
+            if parecidos:
+                return max(parecidos, key=len)
+        if len(del_cp) == 1:
+            return next(iter(del_cp))
+        return None
+
+    def indice(self, municipio: str) -> IndiceCallejero:
+        indice = self._indices.get(municipio)
+        if indice is None:
+            with self._lock:
+                indice = self._indices.get(municipio)
+                if indice is None:
+                    indice = self._indices[municipio] = IndiceCallejero(self.calles[municipio])
+        return indice
+
+
+def cargar_callejero(delegacion: str) -> Callejero:
+    """Lee callejeros/<delegacion>.csv y, si lo hay, el callejero antiguo de la delegación."""
+    callejero = Callejero()
+
+    ruta = DIR_CALLEJEROS / f"{delegacion}.csv"
+    if ruta.exists():
+        df = pd.read_csv(ruta, dtype=str, keep_default_na=False)
+        df.columns = df.columns.str.strip().str.lower()
+        faltan = {"municipio", "nombre"} - set(df.columns)
+        if faltan:
+            raise ValueError(f"{ruta.name}: faltan columnas {', '.join(sorted(faltan))}")
+        cps = df["cp"] if "cp" in df.columns else [""] * len(df)
+        tipos = df["tipo"] if "tipo" in df.columns else [""] * len(df)
+        for municipio, cp, tipo, nombre in zip(df["municipio"], cps, tipos, df["nombre"]):
+            callejero.anadir(municipio, cp, tipo.strip(), nombre.strip())
+
+    if delegacion in CALLEJEROS_ANTIGUOS:
+        ruta, municipio = CALLEJEROS_ANTIGUOS[delegacion]
+        if ruta.exists():
+            df = pd.read_csv(ruta, dtype=str)
+            for tipo_raw, nombre_raw in zip(df["tipo"], df["nombre"]):
+                callejero.anadir(municipio, "", *reparar_nombre(tipo_raw, nombre_raw))
+
+    return callejero
+
+
+_CALLEJEROS = {}
+_LOCK = threading.Lock()
+
+
+def callejero_delegacion(delegacion: str) -> Callejero | None:
+    """Callejero de la delegación; se carga la primera vez que se usa. None si no hay."""
+    callejero = _CALLEJEROS.get(delegacion)
+    if callejero is None:
+        with _LOCK:
+            callejero = _CALLEJEROS.get(delegacion)
+            if callejero is None:
+                try:
+                    callejero = cargar_callejero(delegacion)
+                except Exception as e:
+                    print(f"Aviso: no se pudo cargar el callejero de {delegacion}: {e}")
+                    callejero = Callejero()
+                _CALLEJEROS[delegacion] = callejero
+    return callejero if callejero.calles else None
+
+
+# -------------------------
+# CORRECCIÓN
+# -------------------------
+
+@lru_cache(maxsize=65536)
+def corregir_calle(poblacion: str, direccion: str, cp: str = "", delegacion: str = "castellon") -> str:
+    """
+    Sustituye el nombre de la calle por el más parecido del callejero del
+    municipio. Conserva el tipo de vía tal como venía y el número; el nombre
+    sale como en el callejero, con el artículo delante ('C/ FONTT DE LA, 3' →
+    'C/ DE LA FONT 3'), y la coma antes del número pasa a espacio.
+    """
+    if not direccion:
+        return direccion
+
+    callejero = callejero_delegacion(delegacion)
+    if callejero is None:
+        return direccion
+
+    municipio = callejero.municipio(poblacion, cp)
+    if municipio is None:
+        return direccion
+    indice = callejero.indice(municipio)
+
+    # separar calle y número
+    m = _NUMERO_RE.match(direccion)
+    if m:
+        calle = m.group(1)
+        numero = m.group(2)
+    else:
+        calle = direccion
+        numero = ""
+
+    tipo, clave = separar_tipo_via(calle)
+    encontrado = indice.buscar(tipo, clave)
+    if encontrado is None:
+        return direccion
+
+    # Si el nombre ya era el del callejero se respeta tal como venía
+    if encontrado[0] != clave:
+        prefijo = ""
+        if tipo is not None:
+            p = _PREFIJO_RE.match(calle.strip())
+            if p and tipo_via(texto_clave(p.group(1))) == tipo:
+                prefijo = p.group(1)
+        calle = f"{prefijo} {encontrado[1]}".strip()
+
+    if numero:
+        return f"{calle} {numero}"
+
+    return calle
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+estres_geocache.py — Prueba de carga de la caché de geocodificación compartida
+- Lanza N procesos que ejecutan reparto_gpt.run a la vez contra la misma geocache.db
+- Informa de tiempos, fallos (p. ej. 'database is locked') y del estado final de la caché
+
+Uso:
+    python estres_geocache.py --csv llegadas.csv --reglas Reglas_hospitales.xlsx \\
+        --procesos 4 --rondas 3 [--api_key KEY] [--db copia_geocache.db]
+"""
+
+import argparse
+import multiprocessing as mp
+import sqlite3
+import tempfile
+import time
+import traceback
+from pathlib import Path
+
+
+def _trabajador(args: tuple) -> dict:
+    n, ronda, csv_path, reglas_path, coord_path, delegacion, api_key, db_path, dir_salida = args
+    import geocodificador
+    if db_path:
+        geocodificador.DB_PATH = Path(db_path)
+    import reparto_gpt
+
+    out_path = Path(dir_salida) / f"estres_{ronda}_{n}.xlsx"
+    inicio = time.perf_counter()
+    try:
+        reparto_gpt.run(Path(csv_path), Path(reglas_path), out_path, "LLEGADAS", delegacion,
+                        api_key=api_key, ruta_coordenadas=Path(coord_path) if coord_path else None)
+        geocodificador.vaciar_escrituras()
+        error = None
+    except Exception:
+        error = traceback.format_exc(limit=3)
+    return {"proceso": n, "ronda": ronda, "segundos": time.perf_counter() - inicio, "error": error}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--csv", required=True)
+    parser.add_argument("--reglas", required=True)
+    parser.add_argument("--coordenadas", default=None)
+    parser.add_argument("--delegacion", default="castellon")
+    parser.add_argument("--api_key", default="",
+                        help="sin clave se geocodifica solo con la caché y el resolutor local")
+    parser.add_argument("--db", default=None, help="geocache.db a usar (por defecto la del proyecto)")
+    parser.add_argument("--procesos", type=int, default=4)
+    parser.add_argument("--rondas", type=int, default=1)
+    args = parser.parse_args()
+
+    import geocodificador
+    db_path = Path(args.db) if args.db else geocodificador.DB_PATH
+
+    ctx = mp.get_context("spawn")
+    resultados = []
+    with tempfile.TemporaryDirectory() as dir_salida:
+        tareas = [
+            (n, ronda, args.csv, args.reglas, args.coordenadas, args.delegacion,
+             args.api_key, str(db_path), dir_salida)
+            for ronda in range(args.rondas) for n in range(args.procesos)
+        ]
+        inicio = time.perf_counter()
+        with ctx.Pool(args.procesos) as pool:
+            for r in pool.imap_unordered(_trabajador, tareas):
+                estado = "OK" if r["error"] is None else "ERROR"
+                print(f"ronda {r['ronda']} proceso {r['proceso']}: {estado} en {r['segundos']:.1f}s")
+                resultados.append(r)
+        total = time.perf_counter() - inicio
+
+    fallidos = [r for r in resultados if r["error"] is not None]
+    bloqueos = sum("database is locked" in r["error"] for r in fallidos)
+    tiempos = sorted(r["segundos"] for r in resultados)
+
+    print("\n--- RESUMEN ---")
+    print(f"ejecuciones: {len(resultados)}  fallidas: {len(fallidos)}  'database is locked': {bloqueos}")
+    print(f"tiempo total: {total:.1f}s  mediana: {tiempos[len(tiempos) // 2]:.1f}s  máximo: {tiempos[-1]:.1f}s")
+
+    conn = sqlite3.connect(db_path)
+    try:
+        integridad = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        modo = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        filas, aciertos = conn.execute("SELECT COUNT(*), COALESCE(SUM(aciertos), 0) FROM geocache").fetchone()
+    finally:
+        conn.close()
+    print(f"caché: {filas} entradas, {aciertos} aciertos acumulados, journal_mode={modo}, integridad={integridad}")
+
+    for r in fallidos:
+        print(f"\n[ronda {r['ronda']} proceso {r['proceso']}]\n{r['error']}")
+
+    raise SystemExit(1 if fallidos else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,67 +1,1025 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import atexit
+import csv
+import datetime as _dt
+import fnmatch
+import gzip
+import queue
+import re
 import sqlite3
-import googlemaps
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import googlemaps
+from googlemaps import exceptions as gmaps_exc
+
+from normalizacion import calle_canonica_vigente, clave_canonica, partes_clave, texto_clave
+from resolutor_local import IndiceLocal, rango_precision
+
 DB_PATH = Path(__file__).parent / "geocache.db"
 
+# SQLite admite como mínimo 999 parámetros por sentencia
+_MAX_PARAMS_SQL = 900
+
+# Clientes de Google Maps reutilizables durante toda la vida del proceso
+_CLIENTES = {}
+
+# Resolución concurrente de fallos de caché
+GEOCODE_HILOS = 8            # peticiones simultáneas como máximo
+GEOCODE_QPS = 20.0           # peticiones por segundo (cubo de fichas)
+GEOCODE_REINTENTOS = 4       # reintentos por dirección tras el primer intento
+GEOCODE_ESPERA_BASE = 0.5    # segundos; se duplica en cada reintento
+GEOCODE_TIMEOUT = 10         # segundos por petición HTTP
+
+_ultimas_estadisticas = {}
+
+# Resolutor local (centroides de calle, C.P. y municipio) antes de la API:
+# solo se evita la API si alcanza PRECISION_MINIMA; sin API o si esta falla
+# se devuelve el mejor resultado local disponible
+PRECISION_MINIMA = "exacta"
+_INDICE_LOCAL = None
+
+# Reutilización de portales vecinos de la misma calle antes de la API, por
+# delegación. Para agrupar paradas basta ~100 m (UMBRAL de reordenar_rutas).
+#   activa: aceptar la interpolación sin consultar la API
+#   confianza_minima: 0-1 (resolutor_local.IndiceLocal.interpolar)
+#   max_salto: números de portal a partir de los cuales la confianza es 0
+INTERPOLACION = {
+    "castellon": {"activa": True, "confianza_minima": 0.7, "max_salto": 20},
+    "valencia":  {"activa": True, "confianza_minima": 0.7, "max_salto": 20},
+}
+_INTERPOLACION_DEFECTO = {"activa": False, "confianza_minima": 1.0, "max_salto": 20}
+
+# Caché de dos niveles: LRU en memoria delante de una conexión SQLite persistente
+LRU_MAX = 50_000
+_LRU = OrderedDict()  # clave → (lat, lon, negativo, creado)
+_CONTADORES = {"lru_aciertos": 0, "lru_fallos": 0, "sqlite_aciertos": 0, "sqlite_fallos": 0,
+               "no_exactas": 0}
+_LOCK = threading.RLock()
+_CONN = None
+_CONN_PATH = None
+
+# Varios procesos (Streamlit y los subprocesos de reparto_gpt) comparten el
+# fichero: modo WAL, espera ante bloqueos y un único hilo escritor por proceso
+# que agrupa las escrituras en transacciones periódicas. Solo se espera al
+# commit (vaciar_escrituras) al final de cada fase, al salir y antes de leer
+# SQLite directamente (cobertura, exportación, poda…); el LRU del proceso ya
+# tiene lo geocodificado
+BUSY_TIMEOUT_S = 30          # segundos de espera si otro proceso tiene el bloqueo
+ESCRITURA_INTERVALO = 0.5    # segundos que el escritor acumula operaciones
+ESCRITURA_MAX_OPS = 500      # operaciones por transacción como máximo
+ESCRITURA_REINTENTOS = 5
+_COLA_ESCRITURA = queue.Queue()
+_ESCRITOR = None
+_CONN_ESCRITOR = None
+_VACIAR = object()  # marca en la cola: confirmar ya lo acumulado
+
+# Tamaños fijos de la consulta IN: el texto SQL se repite y sqlite3 reutiliza
+# la sentencia preparada de su caché
+_BLOQUES_SQL = (1, 8, 64, 512)
+
+
+# Versión del esquema guardada en PRAGMA user_version
+#   1: claves canónicas (normalizacion.clave_canonica)
+#   2: procedencia, marcas de tiempo, contador de aciertos y caché negativa
+#   3: claves con el nombre de la vía en su orden y sin piso ni puerta
+ESQUEMA_VERSION = 3
+
+# Caducidad de las entradas; None = no caducan
+TTL_DIAS = 365
+TTL_NEGATIVO_DIAS = 7
+
+_FORMATO_FECHA = "%Y-%m-%d %H:%M:%S"
+
+# Poda: al abrir la caché, si supera CACHE_MAX_FILAS se eliminan primero las
+# entradas sin uso en PODA_SIN_USO_DIAS con menos de PODA_MIN_ACIERTOS aciertos
+# y después las de menor (aciertos, último uso) hasta quedar en el límite
+CACHE_MAX_FILAS = 200_000
+PODA_SIN_USO_DIAS = 180
+PODA_MIN_ACIERTOS = 2
+
+_COLUMNAS_V2 = [
+    ("fuente",        "TEXT"),
+    ("location_type", "TEXT"),
+    ("creado",        "TEXT"),
+    ("ultimo_uso",    "TEXT"),
+    ("aciertos",      "INTEGER NOT NULL DEFAULT 0"),
+    ("negativo",      "INTEGER NOT NULL DEFAULT 0"),
+]
+
+
+def _ahora() -> str:
+    return _dt.datetime.now().strftime(_FORMATO_FECHA)
+
+
+def _hace_dias(dias) -> str:
+    if dias is None:
+        return ""
+    return (_dt.datetime.now() - _dt.timedelta(days=dias)).strftime(_FORMATO_FECHA)
+
+
+def _abrir(ruta):
+    conn = sqlite3.connect(ruta, timeout=BUSY_TIMEOUT_S, check_same_thread=False)
+    conn.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT_S * 1000)}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    # En WAL, NORMAL solo sincroniza el disco en los checkpoints
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+
 def _get_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS geocache (
-            direccion TEXT PRIMARY KEY,
-            latitud   REAL,
-            longitud  REAL
-        )
-    """)
-    conn.commit()
+    conn = _abrir(DB_PATH)
+    existe = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'geocache'"
+    ).fetchone()
+    if not existe:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS geocache (
+                direccion     TEXT PRIMARY KEY,
+                latitud       REAL,
+                longitud      REAL,
+                fuente        TEXT,
+                location_type TEXT,
+                creado        TEXT,
+                ultimo_uso    TEXT,
+                aciertos      INTEGER NOT NULL DEFAULT 0,
+                negativo      INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        conn.execute(f"PRAGMA user_version = {ESQUEMA_VERSION}")
+        conn.commit()
+    elif conn.execute("PRAGMA user_version").fetchone()[0] < ESQUEMA_VERSION:
+        _migrar(conn)
+    if not conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'generacion'"
+    ).fetchone():
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS generacion (valor INTEGER NOT NULL)")
+            conn.execute("INSERT INTO generacion SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM generacion)")
     return conn
 
-def geocodificar(direccion: str, api_key: str) -> tuple:
-    
-    if not direccion or str(direccion).strip().upper() in ("NAN", "NONE", ""):
+
+def _migrar(conn):
+    """Actualiza en el sitio el esquema de la caché hasta ESQUEMA_VERSION."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Otro proceso puede haber migrado mientras se esperaba el bloqueo
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= ESQUEMA_VERSION:
+            conn.rollback()
+            return
+        if version < 1:
+            migrar_claves_canonicas(conn)
+        if version < 2:
+            existentes = {r[1] for r in conn.execute("PRAGMA table_info(geocache)")}
+            for nombre, tipo in _COLUMNAS_V2:
+                if nombre not in existentes:
+                    conn.execute(f"ALTER TABLE geocache ADD COLUMN {nombre} {tipo}")
+            conn.execute(
+                "UPDATE geocache SET fuente = COALESCE(fuente, 'google'), creado = COALESCE(creado, ?)",
+                (_ahora(),)
+            )
+        if 1 <= version < 3:
+            depurar_claves_v3(conn)
+        conn.execute(f"PRAGMA user_version = {ESQUEMA_VERSION}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _conexion():
+    """Conexión persistente del proceso; usar siempre bajo _LOCK."""
+    global _CONN, _CONN_PATH
+    if _CONN is None or _CONN_PATH != DB_PATH:
+        if _CONN is not None:
+            _CONN.close()
+        _CONN = _get_connection()
+        _CONN_PATH = DB_PATH
+        _LRU.clear()
+        _reiniciar_indice_local()
+        if CACHE_MAX_FILAS and _CONN.execute("SELECT COUNT(*) FROM geocache").fetchone()[0] > CACHE_MAX_FILAS:
+            _podar(_CONN, CACHE_MAX_FILAS, PODA_SIN_USO_DIAS, PODA_MIN_ACIERTOS)
+    return _CONN
+
+
+def _reiniciar_indice_local():
+    global _INDICE_LOCAL
+    _INDICE_LOCAL = None
+
+
+def _indice_local(conn) -> IndiceLocal:
+    """Índice local del proceso; se construye la primera vez con la caché positiva. Usar bajo _LOCK."""
+    global _INDICE_LOCAL
+    if _INDICE_LOCAL is None:
+        try:
+            indice = IndiceLocal.desde_referencias()
+        except Exception as e:
+            print(f"Aviso: no se pudieron cargar las referencias del resolutor local: {e}")
+            indice = IndiceLocal()
+        filas = conn.execute(
+            "SELECT direccion, latitud, longitud FROM geocache "
+            "WHERE negativo = 0 AND latitud IS NOT NULL AND longitud IS NOT NULL"
+        )
+        for clave, lat, lon in filas:
+            indice.anadir(clave, lat, lon)
+        _INDICE_LOCAL = indice
+    return _INDICE_LOCAL
+
+
+def generacion_cache() -> int:
+    """
+    Contador guardado en la caché que sube cada vez que se borran o sustituyen
+    entradas (invalidar, podar, importar, vaciar) o se precalienta: forma
+    parte de la clave de cache_resultados.
+    """
+    with _LOCK:
+        return _conexion().execute("SELECT valor FROM generacion").fetchone()[0]
+
+
+def _nueva_generacion(conn):
+    """Usar bajo _LOCK y dentro de una transacción de `conn`."""
+    conn.execute("UPDATE generacion SET valor = valor + 1")
+
+
+def nueva_generacion():
+    """Marca la caché como cambiada (p. ej. tras precalentarla)."""
+    vaciar_escrituras()
+    with _LOCK:
+        conn = _conexion()
+        with conn:
+            _nueva_generacion(conn)
+
+
+def resultados_degradados() -> int:
+    """
+    Direcciones que desde que arrancó el proceso no tuvieron resultado exacto
+    ni negativo (error de la API, sin clave, solo resultado local): si cambia
+    durante una fase, su resultado no es definitivo.
+    """
+    with _LOCK:
+        return _CONTADORES["no_exactas"]
+
+
+def preparar_indices():
+    """Abre la caché y construye el índice local sin esperar a la primera geocodificación."""
+    with _LOCK:
+        _indice_local(_conexion())
+
+
+# -------------------------
+# ESCRITOR ÚNICO
+# -------------------------
+
+def _encolar(sql: str, filas: list):
+    """Encola una escritura (executemany) para el hilo escritor; no espera al commit."""
+    global _ESCRITOR
+    if not filas:
+        return
+    with _LOCK:
+        if _ESCRITOR is None or not _ESCRITOR.is_alive():
+            _ESCRITOR = threading.Thread(target=_bucle_escritor, name="geocache-escritor", daemon=True)
+            _ESCRITOR.start()
+    _COLA_ESCRITURA.put((DB_PATH, sql, filas))
+
+
+def _bucle_escritor():
+    global _CONN_ESCRITOR
+    ruta_conn = None
+    while True:
+        ops = [_COLA_ESCRITURA.get()]
+        limite = time.monotonic() + ESCRITURA_INTERVALO
+        while ops[-1] is not _VACIAR and len(ops) < ESCRITURA_MAX_OPS:
+            try:
+                ops.append(_COLA_ESCRITURA.get(timeout=max(0.0, limite - time.monotonic())))
+            except queue.Empty:
+                break
+
+        try:
+            # Una transacción por fichero, respetando el orden de llegada
+            grupos = []
+            for op in ops:
+                if op is _VACIAR:
+                    continue
+                ruta, sql, filas = op
+                if grupos and grupos[-1][0] == ruta:
+                    grupos[-1][1].append((sql, filas))
+                else:
+                    grupos.append((ruta, [(sql, filas)]))
+
+            for ruta, sentencias in grupos:
+                try:
+                    if _CONN_ESCRITOR is None or ruta_conn != ruta:
+                        if _CONN_ESCRITOR is not None:
+                            conn, _CONN_ESCRITOR, ruta_conn = _CONN_ESCRITOR, None, None
+                            conn.close()
+                        _CONN_ESCRITOR = _abrir(ruta)
+                        ruta_conn = ruta
+                    _escribir(_CONN_ESCRITOR, sentencias)
+                except Exception as e:
+                    # El hilo sigue vivo: un lote que no se puede escribir se pierde, no bloquea la cola
+                    filas = sum(len(f) for _, f in sentencias)
+                    print(f"Caché de geocodificación: se descartan {filas} filas en {ruta} "
+                          f"({type(e).__name__}: {e})")
+        finally:
+            # Siempre, para que vaciar_escrituras() no espere para siempre en join()
+            for _ in ops:
+                _COLA_ESCRITURA.task_done()
+
+
+def _escribir(conn, sentencias: list):
+    """Una transacción con las sentencias; reintenta si la base de datos está bloqueada."""
+    for intento in range(ESCRITURA_REINTENTOS + 1):
+        try:
+            with conn:
+                for sql, filas in sentencias:
+                    conn.executemany(sql, filas)
+            return
+        except sqlite3.OperationalError:
+            if intento >= ESCRITURA_REINTENTOS:
+                raise
+            time.sleep(GEOCODE_ESPERA_BASE * (2 ** intento))
+
+
+def vaciar_escrituras():
+    """Espera a que el escritor confirme todas las escrituras encoladas."""
+    if _ESCRITOR is not None and _ESCRITOR.is_alive():
+        _COLA_ESCRITURA.put(_VACIAR)
+        _COLA_ESCRITURA.join()
+
+
+def _cerrar():
+    # Al cerrar la última conexión SQLite integra el WAL en la base de datos
+    vaciar_escrituras()
+    with _LOCK:
+        for conn in (_CONN, _CONN_ESCRITOR):
+            if conn is not None:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+
+
+atexit.register(_cerrar)
+
+
+def _lru_guardar(clave: str, valor: tuple):
+    _LRU[clave] = valor
+    _LRU.move_to_end(clave)
+    while len(_LRU) > LRU_MAX:
+        _LRU.popitem(last=False)
+
+
+def _consultar_sqlite(conn, claves: list) -> list:
+    """Filas (direccion, lat, lon, negativo, creado) de las claves, en bloques de tamaño fijo."""
+    filas = []
+    i = 0
+    while i < len(claves):
+        restantes = len(claves) - i
+        tam = next((t for t in _BLOQUES_SQL if t >= restantes), _BLOQUES_SQL[-1])
+        bloque = claves[i:i + tam]
+        bloque = bloque + [bloque[-1]] * (tam - len(bloque))
+        marcas = ",".join("?" * tam)
+        filas.extend(conn.execute(
+            "SELECT direccion, latitud, longitud, negativo, creado "
+            f"FROM geocache WHERE direccion IN ({marcas})",
+            bloque
+        ))
+        i += tam
+    return filas
+
+
+def migrar_claves_canonicas(conn) -> int:
+    """
+    Vuelve a indexar la tabla geocache (esquema 0) con claves canónicas y
+    fusiona los duplicados (se conserva la primera entrada de cada clave).
+    Devuelve el número de filas fusionadas. No hace commit.
+    """
+    filas = conn.execute(
+        "SELECT direccion, latitud, longitud FROM geocache ORDER BY rowid"
+    ).fetchall()
+    conn.execute("DELETE FROM geocache")
+    fusionadas = 0
+    vistas = set()
+    for direccion, lat, lon in filas:
+        clave = clave_canonica(direccion)
+        if not clave or clave in vistas:
+            fusionadas += 1
+            continue
+        vistas.add(clave)
+        conn.execute(
+            "INSERT INTO geocache (direccion, latitud, longitud) VALUES (?, ?, ?)",
+            (clave, lat, lon)
+        )
+    return fusionadas
+
+
+def _clave_vigente(clave: str) -> bool:
+    return calle_canonica_vigente(clave.split("|", 1)[0])
+
+
+def depurar_claves_v3(conn) -> int:
+    """
+    Borra las claves de los esquemas 1 y 2 cuya calle el formato actual
+    escribe distinto (números del nombre reordenados, piso o puerta en la
+    clave): ya no se consultarían y el resolutor local las mezclaría con
+    otras calles. Se volverán a geocodificar. Devuelve las borradas. No hace commit.
+    """
+    borrar = [
+        (clave,) for (clave,) in conn.execute("SELECT direccion FROM geocache")
+        if not _clave_vigente(clave)
+    ]
+    conn.executemany("DELETE FROM geocache WHERE direccion = ?", borrar)
+    return len(borrar)
+
+
+def _get_cliente(api_key: str):
+    cliente = _CLIENTES.get(api_key)
+    if cliente is None:
+        # Los reintentos por OVER_QUERY_LIMIT los gestiona _consultar_api
+        cliente = googlemaps.Client(
+            key=api_key,
+            timeout=GEOCODE_TIMEOUT,
+            retry_timeout=GEOCODE_TIMEOUT,
+            retry_over_query_limit=False,
+        )
+        _CLIENTES[api_key] = cliente
+    return cliente
+
+
+# -------------------------
+# LIMITADOR DE PETICIONES
+# -------------------------
+
+class _CuboFichas:
+    """Cubo de fichas compartido por los hilos: como máximo `qps` peticiones por segundo."""
+
+    def __init__(self, qps: float):
+        self.qps = max(float(qps), 0.1)
+        self.capacidad = max(self.qps, 1.0)
+        self.fichas = self.capacidad
+        self.ultimo = time.monotonic()
+        self.lock = threading.Lock()
+
+    def esperar(self):
+        while True:
+            with self.lock:
+                ahora = time.monotonic()
+                self.fichas = min(self.capacidad, self.fichas + (ahora - self.ultimo) * self.qps)
+                self.ultimo = ahora
+                if self.fichas >= 1:
+                    self.fichas -= 1
+                    return
+                espera = (1 - self.fichas) / self.qps
+            time.sleep(espera)
+
+
+def _es_reintentable(e: Exception) -> bool:
+    if isinstance(e, (gmaps_exc.Timeout, gmaps_exc.TransportError)):
+        return True
+    if isinstance(e, gmaps_exc.ApiError):
+        return e.status in ("OVER_QUERY_LIMIT", "UNKNOWN_ERROR")
+    return False
+
+
+def _consultar_api(gmaps, direccion: str, limitador: _CuboFichas, reintentos: int) -> tuple:
+    """
+    Geocodifica una dirección con reintentos y espera exponencial.
+    Devuelve ((lat, lon, location_type) o None si no hay resultados,
+    reintentos_usados, error o None).
+    """
+    intento = 0
+    while True:
+        limitador.esperar()
+        try:
+            result = gmaps.geocode(direccion, region="es", language="es")
+            if result:
+                geometria = result[0]["geometry"]
+                loc = geometria["location"]
+                return (loc["lat"], loc["lng"], geometria.get("location_type")), intento, None
+            return None, intento, None
+        except Exception as e:
+            if not _es_reintentable(e) or intento >= reintentos:
+                return None, intento, e
+            time.sleep(GEOCODE_ESPERA_BASE * (2 ** intento))
+            intento += 1
+
+
+def _es_vacio(valor) -> bool:
+    return valor is None or str(valor).strip().upper() in ("NAN", "NONE", "")
+
+
+def direccion_completa(direccion, cp, poblacion, provincia: str) -> str | None:
+    """Compone la dirección que se envía al geocodificador o None si falta calle o población."""
+    if _es_vacio(direccion) or _es_vacio(poblacion):
+        return None
+    dir_limpia = str(direccion).strip()
+    pob_limpia = str(poblacion).strip()
+    if not _es_vacio(cp):
+        return f"{dir_limpia}, {str(cp).strip()} {pob_limpia}, {provincia}, ESPAÑA"
+    return f"{dir_limpia}, {pob_limpia}, {provincia}, ESPAÑA"
+
+
+def geocodificar(direccion: str, api_key: str, delegacion: str | None = None) -> tuple:
+    if _es_vacio(direccion):
         return (None, None)
+    return geocodificar_lote([direccion], api_key, delegacion=delegacion)[direccion]
 
-    direccion_norm = direccion.strip().upper()
 
-    # Consultar caché
-    conn = _get_connection()
-    row = conn.execute(
-        "SELECT latitud, longitud FROM geocache WHERE direccion = ?",
-        (direccion_norm,)
-    ).fetchone()
+def geocodificar_lote(direcciones, api_key: str, hilos: int | None = None,
+                      qps: float | None = None, reintentos: int | None = None,
+                      precision_minima: str | None = None, con_precision: bool = False,
+                      delegacion: str | None = None) -> dict:
+    """
+    Geocodifica un conjunto de direcciones de una sola vez.
+    Deduplica por clave canónica, resuelve los aciertos de caché con una consulta por bloque,
+    después prueba la interpolación entre portales vecinos (según
+    INTERPOLACION[delegacion]) y el resolutor local y solo si no alcanzan
+    `precision_minima` resuelve los fallos en paralelo con un único cliente (limitado a `qps`
+    peticiones por segundo y con reintentos exponenciales) y guarda los
+    resultados nuevos a través del escritor único. Sin api_key, o si la API
+    falla, se usa el mejor resultado local; las direcciones negativas (la API
+    no las encontró o su resultado se rechazó) se quedan sin resolver.
+    Devuelve {direccion_original: (lat, lon)} o, con `con_precision`,
+    {direccion_original: (lat, lon, precision)} con precision None si no se resolvió.
+    """
+    hilos = GEOCODE_HILOS if hilos is None else hilos
+    qps = GEOCODE_QPS if qps is None else qps
+    reintentos = GEOCODE_REINTENTOS if reintentos is None else reintentos
+    rango_minimo = rango_precision(PRECISION_MINIMA if precision_minima is None else precision_minima)
+    interpolacion = INTERPOLACION.get(delegacion, _INTERPOLACION_DEFECTO)
 
-    if row:
-        conn.close()
-        return (row[0], row[1])
+    originales = {}
+    consultas = {}  # clave canónica → texto que se envía a la API
+    for d in direcciones:
+        if d in originales:
+            continue
+        clave = None if _es_vacio(d) else (clave_canonica(d) or None)
+        originales[d] = clave
+        if clave is not None and clave not in consultas:
+            consultas[clave] = str(d).strip().upper()
 
-    # Llamar a la API
-    try:
-        gmaps = googlemaps.Client(key=api_key)
-        result = gmaps.geocode(direccion_norm, region="es", language="es")
+    pendientes = sorted(consultas)
+    encontrados = {}
+    negativas = set()
+    aciertos = []
+    limite_pos = _hace_dias(TTL_DIAS)
+    limite_neg = _hace_dias(TTL_NEGATIVO_DIAS)
 
-        if result:
-            lat = result[0]["geometry"]["location"]["lat"]
-            lon = result[0]["geometry"]["location"]["lng"]
+    def _clasificar(clave, lat, lon, negativo, creado):
+        # Las entradas caducadas cuentan como fallo
+        creado = creado or ""
+        if negativo:
+            if creado >= limite_neg:
+                negativas.add(clave)
+                aciertos.append(clave)
+        elif lat is not None and lon is not None and creado >= limite_pos:
+            encontrados[clave] = (lat, lon)
+            aciertos.append(clave)
 
-            conn.execute(
-                "INSERT INTO geocache (direccion, latitud, longitud) VALUES (?, ?, ?)",
-                (direccion_norm, lat, lon)
+    with _LOCK:
+        conn = _conexion()
+
+        # Nivel 1: LRU en memoria
+        sin_lru = []
+        for clave in pendientes:
+            valor = _LRU.get(clave)
+            if valor is None:
+                sin_lru.append(clave)
+                continue
+            _LRU.move_to_end(clave)
+            _clasificar(clave, *valor)
+        _CONTADORES["lru_aciertos"] += len(pendientes) - len(sin_lru)
+        _CONTADORES["lru_fallos"] += len(sin_lru)
+
+        # Nivel 2: SQLite
+        leidas = 0
+        for clave, lat, lon, negativo, creado in _consultar_sqlite(conn, sin_lru):
+            leidas += 1
+            _lru_guardar(clave, (lat, lon, negativo, creado))
+            _clasificar(clave, lat, lon, negativo, creado)
+        _CONTADORES["sqlite_aciertos"] += leidas
+        _CONTADORES["sqlite_fallos"] += len(sin_lru) - leidas
+
+        # Nivel 3: portales vecinos y resolutor local (no se guardan en la caché)
+        sin_resolver = [d for d in pendientes if d not in encontrados]
+        locales = {}
+        confianzas = {}
+        if sin_resolver:
+            indice = _indice_local(conn)
+            for clave in sin_resolver:
+                vecino = indice.interpolar(clave, interpolacion["max_salto"])
+                if vecino is not None:
+                    locales[clave] = (vecino[0], vecino[1], "vecino")
+                    confianzas[clave] = vecino[2]
+                    continue
+                res = indice.resolver(clave)
+                if res is not None:
+                    locales[clave] = res
+
+    precisiones = {clave: "exacta" for clave in encontrados}
+    for clave, (lat, lon, precision) in locales.items():
+        if clave in negativas:
+            continue
+        aceptada = rango_precision(precision) <= rango_minimo
+        if precision == "vecino" and interpolacion["activa"]:
+            aceptada = aceptada or confianzas[clave] >= interpolacion["confianza_minima"]
+        if aceptada:
+            encontrados[clave] = (lat, lon)
+            precisiones[clave] = precision
+
+    # Llamar a la API solo para los fallos
+    fallos = [d for d in pendientes if d not in encontrados and d not in negativas]
+    nuevos = []
+    reintentos_por_dir = {}
+    errores = {}
+    if fallos and api_key:
+        gmaps = _get_cliente(api_key)
+        limitador = _CuboFichas(qps)
+        ahora = _ahora()
+        with ThreadPoolExecutor(max_workers=max(1, min(hilos, len(fallos)))) as pool:
+            resultados = pool.map(
+                lambda c: _consultar_api(gmaps, consultas[c], limitador, reintentos), fallos
+            )
+            for clave, (res, usados, error) in zip(fallos, resultados):
+                if usados:
+                    reintentos_por_dir[consultas[clave]] = usados
+                if error is not None:
+                    # Los errores no se guardan: pueden ser transitorios
+                    errores[consultas[clave]] = f"{type(error).__name__}: {error}"
+                    print(f"Error geocodificando '{consultas[clave]}' tras {usados + 1} intentos: {errores[consultas[clave]]}")
+                elif res is None:
+                    negativas.add(clave)
+                    nuevos.append((clave, None, None, "google", None, ahora, 1))
+                else:
+                    lat, lon, location_type = res
+                    encontrados[clave] = (lat, lon)
+                    precisiones[clave] = "exacta"
+                    nuevos.append((clave, lat, lon, "google", location_type, ahora, 0))
+
+    # Sin API o con errores: el mejor resultado local. Las negativas (sin
+    # resultado o rechazadas) no, sus vecinos suelen ser el mismo error
+    for clave, (lat, lon, precision) in locales.items():
+        if clave not in encontrados and clave not in negativas:
+            encontrados[clave] = (lat, lon)
+            precisiones[clave] = precision
+
+    # El LRU se actualiza al momento; SQLite a través del escritor único
+    if nuevos or aciertos:
+        with _LOCK:
+            for clave, lat, lon, _fuente, _tipo, creado, negativo in nuevos:
+                _lru_guardar(clave, (lat, lon, negativo, creado))
+                if not negativo and _INDICE_LOCAL is not None:
+                    _INDICE_LOCAL.anadir(clave, lat, lon)
+        _encolar(
+            "INSERT OR REPLACE INTO geocache "
+            "(direccion, latitud, longitud, fuente, location_type, creado, negativo) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            nuevos
+        )
+        ahora = _ahora()
+        _encolar(
+            "UPDATE geocache SET aciertos = aciertos + 1, ultimo_uso = ? WHERE direccion = ?",
+            [(ahora, c) for c in aciertos]
+        )
+
+    with _LOCK:
+        _CONTADORES["no_exactas"] += sum(
+            1 for c in pendientes if precisiones.get(c) != "exacta" and c not in negativas
+        )
+
+    _ultimas_estadisticas.clear()
+    _ultimas_estadisticas.update({
+        "direcciones": len(pendientes),
+        "aciertos_cache": len(aciertos),
+        "consultas_api": len(fallos) if api_key else 0,
+        "nuevas": len(nuevos),
+        "negativas": len(negativas),
+        "locales": sum(1 for p in precisiones.values() if p != "exacta"),
+        "interpoladas": sum(1 for p in precisiones.values() if p == "vecino"),
+        "por_precision": dict(Counter(precisiones.values())),
+        "reintentos": reintentos_por_dir,
+        "errores": errores,
+    })
+
+    if con_precision:
+        return {
+            orig: (*encontrados[clave], precisiones[clave]) if clave in encontrados else (None, None, None)
+            for orig, clave in originales.items()
+        }
+    return {
+        orig: encontrados.get(clave, (None, None)) if clave is not None else (None, None)
+        for orig, clave in originales.items()
+    }
+
+
+def registrar_rechazos(direcciones, motivo: str = "municipio") -> int:
+    """
+    Marca como negativas las direcciones cuyo resultado se descartó (p. ej. por
+    quedar lejos del municipio) para no volver a pedirlas hasta que caduquen.
+    Devuelve el número de claves marcadas.
+    """
+    claves = {clave_canonica(d) for d in direcciones if not _es_vacio(d)}
+    claves.discard("")
+    if not claves:
+        return 0
+    ahora = _ahora()
+    with _LOCK:
+        conn = _conexion()
+        coordenadas = {clave: _LRU[clave][:2] for clave in claves if clave in _LRU}
+        sin_lru = [clave for clave in claves if clave not in coordenadas]
+        coordenadas.update({c: (lat, lon) for c, lat, lon, _neg, _creado in _consultar_sqlite(conn, sin_lru)})
+        for clave in claves:
+            lat, lon = coordenadas.get(clave, (None, None))
+            _lru_guardar(clave, (lat, lon, 1, ahora))
+            # Fuera del índice local: no debe servir de vecino ni de centroide de calle
+            if _INDICE_LOCAL is not None and lat is not None and lon is not None:
+                _INDICE_LOCAL.quitar(clave, lat, lon)
+    _encolar(
+        "INSERT INTO geocache (direccion, fuente, creado, negativo) VALUES (?, ?, ?, 1) "
+        "ON CONFLICT(direccion) DO UPDATE SET "
+        "negativo = 1, fuente = excluded.fuente, creado = excluded.creado",
+        [(c, f"rechazo_{motivo}", ahora) for c in claves]
+    )
+    return len(claves)
+
+
+def estadisticas_ultimo_lote() -> dict:
+    """Contadores de la última llamada a geocodificar_lote (aciertos, consultas, reintentos, errores)."""
+    return dict(_ultimas_estadisticas)
+
+
+def estadisticas_cache() -> dict:
+    """Aciertos y fallos acumulados de cada nivel de la caché desde que arrancó el proceso."""
+    with _LOCK:
+        return {**_CONTADORES, "lru_entradas": len(_LRU), "lru_max": LRU_MAX}
+
+
+# -------------------------
+# COBERTURA, EXPORTACIÓN E IMPORTACIÓN
+# -------------------------
+
+_COLUMNAS_EXPORTACION = [
+    "direccion", "latitud", "longitud", "fuente", "location_type",
+    "creado", "ultimo_uso", "aciertos", "negativo",
+]
+
+
+def cobertura_cache(direcciones) -> dict:
+    """
+    Cuánto de un conjunto de direcciones resolvería hoy la caché, sin tocar
+    contadores ni el LRU: vigentes, negativas vigentes, caducadas y ausentes.
+    'pendientes' son las direcciones originales que irían a la API.
+    """
+    claves = {}
+    for d in direcciones:
+        clave = None if _es_vacio(d) else (clave_canonica(d) or None)
+        if clave is not None:
+            claves.setdefault(clave, d)
+
+    limite_pos = _hace_dias(TTL_DIAS)
+    limite_neg = _hace_dias(TTL_NEGATIVO_DIAS)
+    vigentes, negativas, caducadas = set(), set(), set()
+    vaciar_escrituras()
+    with _LOCK:
+        conn = _conexion()
+        for clave, lat, lon, negativo, creado in _consultar_sqlite(conn, sorted(claves)):
+            creado = creado or ""
+            if negativo:
+                (negativas if creado >= limite_neg else caducadas).add(clave)
+            elif lat is not None and lon is not None and creado >= limite_pos:
+                vigentes.add(clave)
+            else:
+                caducadas.add(clave)
+
+    pendientes = [d for c, d in claves.items() if c not in vigentes and c not in negativas]
+    total = len(claves)
+    return {
+        "direcciones": total,
+        "vigentes": len(vigentes),
+        "negativas": len(negativas),
+        "caducadas": len(caducadas),
+        "ausentes": total - len(vigentes) - len(negativas) - len(caducadas),
+        "cobertura_pct": round(100 * (len(vigentes) + len(negativas)) / total, 1) if total else 100.0,
+        "pendientes": pendientes,
+    }
+
+
+def exportar_cache(ruta) -> int:
+    """Vuelca la caché a un CSV comprimido (.csv.gz). Devuelve el número de filas."""
+    vaciar_escrituras()
+    with _LOCK:
+        filas = _conexion().execute(
+            f"SELECT {', '.join(_COLUMNAS_EXPORTACION)} FROM geocache ORDER BY direccion"
+        ).fetchall()
+    with gzip.open(ruta, "wt", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(_COLUMNAS_EXPORTACION + ["esquema"])
+        w.writerows(fila + (ESQUEMA_VERSION,) for fila in filas)
+    return len(filas)
+
+
+def importar_cache(ruta) -> dict:
+    """
+    Fusiona en la caché un fichero de exportar_cache. Si la clave ya existe
+    se conserva la entrada más reciente (columna creado). Las direcciones sin
+    formato de clave (volcados antiguos) se convierten con clave_canonica;
+    las claves de volcados anteriores al esquema 3 se depuran como en la
+    migración (depurar_claves_v3).
+    """
+    def _num(v, tipo):
+        return tipo(v) if v not in ("", None) else None
+
+    filas = []
+    leidas = 0
+    with gzip.open(ruta, "rt", encoding="utf-8", newline="") as f:
+        for r in csv.DictReader(f):
+            leidas += 1
+            clave = r.get("direccion") or ""
+            if "|" not in clave:
+                clave = clave_canonica(clave)
+            elif (_num(r.get("esquema"), int) or 1) < 3 and not _clave_vigente(clave):
+                continue
+            if not clave:
+                continue
+            filas.append((
+                clave,
+                _num(r.get("latitud"), float),
+                _num(r.get("longitud"), float),
+                r.get("fuente") or "importado",
+                r.get("location_type") or None,
+                r.get("creado") or _ahora(),
+                r.get("ultimo_uso") or None,
+                _num(r.get("aciertos"), int) or 0,
+                _num(r.get("negativo"), int) or 0,
+            ))
+
+    vaciar_escrituras()
+    with _LOCK:
+        conn = _conexion()
+        antes = conn.total_changes
+        with conn:
+            conn.executemany(
+                f"INSERT INTO geocache ({', '.join(_COLUMNAS_EXPORTACION)}) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(direccion) DO UPDATE SET "
+                "latitud = excluded.latitud, longitud = excluded.longitud, "
+                "fuente = excluded.fuente, location_type = excluded.location_type, "
+                "creado = excluded.creado, negativo = excluded.negativo "
+                "WHERE excluded.creado > COALESCE(geocache.creado, '')",
+                filas
             )
-            conn.commit()
-            conn.close()
-            return (lat, lon)
+            importadas = conn.total_changes - antes
+            if importadas:
+                _nueva_generacion(conn)
+        _LRU.clear()
+        _reiniciar_indice_local()
+    return {"leidas": leidas, "importadas": importadas, "omitidas": leidas - importadas}
+
+
+# -------------------------
+# INVALIDACIÓN, PODA Y MANTENIMIENTO
+# -------------------------
+
+def _borrar_claves(conn, claves: list) -> int:
+    """Borra las claves de SQLite, del LRU y reinicia el índice local. Usar bajo _LOCK."""
+    if claves:
+        with conn:
+            conn.executemany("DELETE FROM geocache WHERE direccion = ?", [(c,) for c in claves])
+            _nueva_generacion(conn)
+        for clave in claves:
+            _LRU.pop(clave, None)
+        _reiniciar_indice_local()
+    return len(claves)
+
+
+def invalidar_cache(municipio: str = "", cp: str = "", patron: str = "",
+                    dias: int | None = None, solo_negativas: bool = False,
+                    simular: bool = False) -> int:
+    """
+    Borra las entradas que cumplen todos los filtros indicados:
+    municipio y C.P. de la clave, patrón de calle (subcadena, o comodines
+    * y ? de fnmatch), antigüedad mayor de `dias` y solo negativas.
+    Con `simular` solo cuenta. Devuelve el número de entradas afectadas.
+    """
+    municipio = texto_clave(municipio)
+    cp = str(cp or "").strip()
+    comodin = "*" in patron or "?" in patron
+    if comodin:
+        patron = "".join(p if p in ("*", "?") else texto_clave(p) for p in re.split(r"([*?])", patron))
+    else:
+        # Misma forma que la calle de la clave ('C/ Mayor' → 'CALLE MAYOR')
+        patron = partes_clave(clave_canonica(patron))[0]
+    if not (municipio or cp or patron or dias is not None or solo_negativas):
+        raise ValueError("Indica al menos un filtro; para vaciar la caché usa limpiar_cache()")
+
+    condiciones, params = [], []
+    if dias is not None:
+        condiciones.append("COALESCE(creado, '') < ?")
+        params.append(_hace_dias(dias))
+    if solo_negativas:
+        condiciones.append("negativo = 1")
+    where = f" WHERE {' AND '.join(condiciones)}" if condiciones else ""
+
+    vaciar_escrituras()
+    with _LOCK:
+        conn = _conexion()
+        claves = []
+        for (clave,) in conn.execute(f"SELECT direccion FROM geocache{where}", params):
+            calle, cp_clave, mun_clave, _prov = partes_clave(clave)
+            if municipio and mun_clave != municipio:
+                continue
+            if cp and cp_clave != cp:
+                continue
+            if patron and not (fnmatch.fnmatchcase(calle, patron) if comodin else patron in calle):
+                continue
+            claves.append(clave)
+        if simular:
+            return len(claves)
+        return _borrar_claves(conn, claves)
 
-    except Exception as e:
-        print(f"Error geocodificando '{direccion}': {e}")
 
-    conn.close()
-    return (None, None)
+def _podar(conn, max_filas, sin_uso_dias, min_aciertos) -> int:
+    ultimo = "COALESCE(ultimo_uso, creado, '')"
+    claves = [c for (c,) in conn.execute(
+        f"SELECT direccion FROM geocache WHERE {ultimo} < ? AND aciertos < ?",
+        (_hace_dias(sin_uso_dias), min_aciertos)
+    )] if sin_uso_dias is not None else []
+    if max_filas is not None:
+        total = conn.execute("SELECT COUNT(*) FROM geocache").fetchone()[0]
+        sobrantes = total - len(claves) - max_filas
+        if sobrantes > 0:
+            ya = set(claves)
+            for (c,) in conn.execute(f"SELECT direccion FROM geocache ORDER BY aciertos, {ultimo}"):
+                if sobrantes <= 0:
+                    break
+                if c not in ya:
+                    claves.append(c)
+                    sobrantes -= 1
+    return _borrar_claves(conn, claves)
+
+
+def podar_cache(max_filas: int | None = None, sin_uso_dias: int | None = None,
+                min_aciertos: int | None = None) -> int:
+    """
+    Expulsa entradas poco útiles: las que llevan `sin_uso_dias` sin acierto
+    con menos de `min_aciertos` aciertos y, si aún se supera `max_filas`, las de
+    menor (aciertos, último uso). Por defecto, los valores CACHE_MAX_FILAS,
+    PODA_SIN_USO_DIAS y PODA_MIN_ACIERTOS. Devuelve el número de entradas borradas.
+    """
+    vaciar_escrituras()
+    with _LOCK:
+        return _podar(
+            _conexion(),
+            CACHE_MAX_FILAS if max_filas is None else max_filas,
+            PODA_SIN_USO_DIAS if sin_uso_dias is None else sin_uso_dias,
+            PODA_MIN_ACIERTOS if min_aciertos is None else min_aciertos,
+        )
+
+
+def tamano_cache() -> dict:
+    """Entradas (positivas y negativas) y tamaño en disco de la caché, incluido el WAL."""
+    vaciar_escrituras()
+    with _LOCK:
+        conn = _conexion()
+        filas, negativas = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(negativo), 0) FROM geocache"
+        ).fetchone()
+        pagina = conn.execute("PRAGMA page_size").fetchone()[0]
+        paginas = conn.execute("PRAGMA page_count").fetchone()[0]
+        libres = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    wal = Path(f"{DB_PATH}-wal")
+    return {
+        "filas": filas,
+        "positivas": filas - negativas,
+        "negativas": negativas,
+        "bytes": paginas * pagina,
+        "bytes_libres": libres * pagina,
+        "bytes_wal": wal.stat().st_size if wal.exists() else 0,
+    }
+
+
+def compactar_cache() -> dict:
+    """VACUUM y checkpoint del WAL. Devuelve el tamaño antes y después."""
+    antes = tamano_cache()
+    with _LOCK:
+        conn = _conexion()
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return {"antes": antes, "despues": tamano_cache()}
+
 
 def limpiar_cache():
-    conn = _get_connection()
-    conn.execute("DELETE FROM geocache")
-    conn.commit()
-    conn.close()
+    vaciar_escrituras()
+    with _LOCK:
+        conn = _conexion()
+        with conn:
+            conn.execute("DELETE FROM geocache")
+            _nueva_generacion(conn)
+        _LRU.clear()
+        _reiniciar_indice_local()
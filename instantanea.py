@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+instantanea.py — Copia binaria de los valores de cada Excel que genera la aplicación
+- guardar_libro: guarda el libro y, en instantaneas/<sha256>.pkl junto a él, los valores de todas sus hojas
+- leer_libro: al subir el Excel en la fase siguiente usa la instantánea si la huella del fichero
+  coincide; si no, lee el Excel (solo lectura) y deja la instantánea para las siguientes lecturas
+- Valores como los lee openpyxl con data_only: fórmulas vacías, float enteros como int
+- fila_cabecera: detección única de la cabecera (fila "← RESUMEN", filas de navegación, columna Exp)
+- tabla_leida: la tabla que daba pd.read_excel(header=None) cortada por la cabecera
+"""
+
+import hashlib
+import os
+import pickle
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+from openpyxl import load_workbook
+from pandas.errors import EmptyDataError
+from pandas.io.parsers import TextParser
+
+from salida_excel import valor_leido
+
+# Cambiar si cambia el formato de las instantáneas: invalida las guardadas
+VERSION_INSTANTANEA = 1
+
+CARPETA_INSTANTANEAS = "instantaneas"
+MAX_INSTANTANEAS = 20
+TRAMO_FILAS = 5000
+
+# Primera fila de las hojas resumidas (add_resumen_unico)
+VOLVER_RESUMEN = "← RESUMEN"
+
+
+# -------------------------
+# CABECERA
+# -------------------------
+
+def fila_cabecera(filas) -> int:
+    """
+    Índice de la fila de cabecera: la primera con la columna Exp (por delante
+    pueden ir la fila "← RESUMEN" y las de navegación de la Fase 3); en hojas
+    sin Exp, la primera que no es la fila "← RESUMEN".
+    """
+    for i, fila in enumerate(filas):
+        if "Exp" in fila:
+            return i
+    for i, fila in enumerate(filas):
+        primera = fila[0] if len(fila) else None
+        if primera is None or str(primera).strip() != VOLVER_RESUMEN:
+            return i
+    return 0
+
+
+def filas_hoja(hoja: pd.DataFrame) -> list:
+    """Filas de la hoja como las da openpyxl (values_only): tuplas con None en las celdas vacías."""
+    return list(hoja.itertuples(index=False, name=None))
+
+
+def tabla_valores(filas) -> pd.DataFrame:
+    """DataFrame con la fila de cabecera como columnas y los valores tal cual."""
+    filas = list(filas)
+    if not filas:
+        return pd.DataFrame()
+    h = fila_cabecera(filas)
+    return pd.DataFrame(filas[h + 1:], columns=filas[h])
+
+
+def _celda_read_excel(v):
+    # pandas (lector openpyxl): celda vacía → "", números enteros → int
+    if v is None:
+        return ""
+    if isinstance(v, (int, float)) and not isinstance(v, bool):
+        entero = int(v)
+        return entero if entero == v else float(v)
+    return v
+
+
+def tabla_leida(hoja: pd.DataFrame) -> pd.DataFrame:
+    """
+    Lo que daba pd.read_excel(header=None) de la hoja, con la fila de
+    cabecera (fila_cabecera) como columnas y los datos a continuación.
+    """
+    filas = filas_hoja(hoja)
+    datos = []
+    ultima = -1
+    for i, fila in enumerate(filas):
+        convertida = [_celda_read_excel(v) for v in fila]
+        while convertida and convertida[-1] == "":
+            convertida.pop()
+        if convertida:
+            ultima = i
+        datos.append(convertida)
+    datos = datos[:ultima + 1]
+    if not datos:
+        return pd.DataFrame()
+    ancho = max(len(fila) for fila in datos)
+    datos = [fila + [""] * (ancho - len(fila)) for fila in datos]
+    try:
+        df = TextParser(datos, header=None, skip_blank_lines=False).read()
+    except EmptyDataError:
+        return pd.DataFrame()
+    h = min(fila_cabecera(filas), len(df) - 1)
+    df.columns = df.iloc[h]
+    return df.iloc[h + 1:].reset_index(drop=True)
+
+
+# -------------------------
+# INSTANTÁNEAS EN DISCO
+# -------------------------
+
+def huella_fichero(ruta: Path) -> str:
+    return hashlib.sha256(Path(ruta).read_bytes()).hexdigest()
+
+
+def ruta_instantanea(ruta_excel: Path, huella: str) -> Path:
+    return Path(ruta_excel).parent / CARPETA_INSTANTANEAS / f"{huella}.pkl"
+
+
+def instantanea_de(ruta_excel: Path) -> Path | None:
+    """Instantánea guardada del fichero tal como está ahora, si la hay."""
+    ruta = ruta_instantanea(ruta_excel, huella_fichero(ruta_excel))
+    return ruta if ruta.exists() else None
+
+
+def _tabla(filas: list) -> pd.DataFrame:
+    """Filas de una hoja → DataFrame object, una fila por fila y None en las celdas vacías."""
+    ancho = max((len(fila) for fila in filas), default=0)
+    return pd.DataFrame(
+        [tuple(fila) + (None,) * (ancho - len(fila)) for fila in filas],
+        columns=range(ancho), dtype=object,
+    )
+
+
+def _unir(tramos: list) -> pd.DataFrame:
+    if not tramos:
+        return pd.DataFrame()
+    if len(tramos) == 1:
+        return tramos[0]
+    ancho = max(t.shape[1] for t in tramos)
+    for tramo in tramos:
+        for j in range(tramo.shape[1], ancho):
+            tramo[j] = None
+    return pd.concat(tramos, ignore_index=True)
+
+
+def _podar(carpeta: Path):
+    # Solo las más recientes: cada guardado de un libro deja una nueva
+    antiguas = sorted(carpeta.glob("*.pkl"), key=lambda p: p.stat().st_mtime, reverse=True)
+    for ruta in antiguas[MAX_INSTANTANEAS:]:
+        ruta.unlink(missing_ok=True)
+
+
+class Registro:
+    """
+    Instantánea de un libro write_only (salida_excel.nuevo_libro(registro=...)):
+    recibe las hojas y filas según se escriben y las vuelca al fichero por
+    tramos de TRAMO_FILAS, así la memoria no crece con el libro. El fichero
+    toma su nombre definitivo (huella del Excel) en guardar_libro.
+
+    Formato: {"version"}, ("hoja", nombre, DataFrame) por tramo y ("fin", huella, hojas).
+    """
+
+    def __init__(self, ruta_excel: Path):
+        self.carpeta = Path(ruta_excel).parent / CARPETA_INSTANTANEAS
+        self.hojas = []
+        self._filas = {}
+        self._f = self._tmp = None
+        try:
+            self.carpeta.mkdir(parents=True, exist_ok=True)
+            fd, self._tmp = tempfile.mkstemp(dir=self.carpeta, suffix=".tmp")
+            self._f = os.fdopen(fd, "wb")
+            self._volcar({"version": VERSION_INSTANTANEA})
+        except OSError as e:
+            self._fallo(e)
+
+    def _volcar(self, registro):
+        if self._f is not None:
+            try:
+                pickle.dump(registro, self._f, protocol=pickle.HIGHEST_PROTOCOL)
+            except OSError as e:
+                self._fallo(e)
+
+    def _fallo(self, e: OSError):
+        print(f"Aviso: no se pudo guardar la instantánea: {e}")
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+        if self._tmp is not None:
+            Path(self._tmp).unlink(missing_ok=True)
+
+    def _tramo(self, titulo: str):
+        if self._filas[titulo]:
+            self._volcar(("hoja", titulo, _tabla(self._filas[titulo])))
+            self._filas[titulo] = []
+
+    def hoja(self, titulo: str):
+        self.hojas.append(titulo)
+        self._filas[titulo] = []
+
+    def fila(self, titulo: str, valores: tuple):
+        self._filas[titulo].append(valores)
+        if len(self._filas[titulo]) >= TRAMO_FILAS:
+            self._tramo(titulo)
+
+    def cerrar(self, ruta_excel: Path, huella: str | None = None):
+        """Último tramo de cada hoja y nombre definitivo con la huella del Excel ya guardado."""
+        for titulo in self.hojas:
+            self._tramo(titulo)
+        if self._f is None:
+            return
+        huella = huella or huella_fichero(ruta_excel)
+        self._volcar(("fin", huella, self.hojas))
+        if self._f is None:
+            return
+        try:
+            self._f.close()
+            self._f = None
+            os.replace(self._tmp, ruta_instantanea(ruta_excel, huella))
+            self._tmp = None
+            _podar(self.carpeta)
+        except OSError as e:
+            self._fallo(e)
+
+
+def _guardar(ruta_excel: Path, huella: str, tablas: dict):
+    registro = Registro(ruta_excel)
+    for nombre, tabla in tablas.items():
+        registro.hoja(nombre)
+        registro._volcar(("hoja", nombre, tabla))
+    registro.cerrar(ruta_excel, huella)
+
+
+def _cargar(ruta_excel: Path, huella: str) -> dict | None:
+    try:
+        with open(ruta_instantanea(ruta_excel, huella), "rb") as f:
+            if pickle.load(f).get("version") != VERSION_INSTANTANEA:
+                return None
+            tramos = {}
+            registro = pickle.load(f)
+            while registro[0] == "hoja":
+                tramos.setdefault(registro[1], []).append(registro[2])
+                registro = pickle.load(f)
+        _, huella_guardada, hojas = registro
+        if huella_guardada == huella:
+            return {nombre: _unir(tramos.get(nombre, [])) for nombre in hojas}
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Aviso: instantánea ilegible, se lee el Excel: {e}")
+    return None
+
+
+def _leer_excel(ruta_excel: Path) -> dict:
+    wb = load_workbook(ruta_excel, read_only=True, data_only=True)
+    try:
+        return {ws.title: list(ws.iter_rows(values_only=True)) for ws in wb.worksheets}
+    finally:
+        wb.close()
+
+
+def guardar_libro(wb, ruta_excel: Path):
+    """
+    wb.save(ruta_excel) y la instantánea del fichero guardado: la de su
+    Registro si es un libro write_only, si no los valores de sus hojas.
+    """
+    wb.save(ruta_excel)
+    registro = getattr(wb, "registro", None)
+    if isinstance(registro, Registro):
+        registro.cerrar(ruta_excel)
+    elif not wb.write_only:
+        tablas = {
+            ws.title: _tabla([tuple(valor_leido(v) for v in fila) for fila in ws.iter_rows(values_only=True)])
+            for ws in wb.worksheets
+        }
+        _guardar(ruta_excel, huella_fichero(ruta_excel), tablas)
+
+
+def leer_libro(ruta_excel: Path) -> dict:
+    """
+    {hoja: DataFrame con las filas de la hoja} en el orden del libro. De la
+    instantánea si coincide con el fichero; si no, del Excel.
+    """
+    ruta_excel = Path(ruta_excel)
+    huella = huella_fichero(ruta_excel)
+    tablas = _cargar(ruta_excel, huella)
+    if tablas is None:
+        tablas = {nombre: _tabla(filas) for nombre, filas in _leer_excel(ruta_excel).items()}
+        _guardar(ruta_excel, huella, tablas)
+    return tablas
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+lector_csv.py — Lectura de los CSV exportados (llegadas, pendientes) en una sola pasada
+- El fichero se lee una vez; la codificación (UTF-8 con o sin BOM / latin-1) se decide sobre esos bytes
+- Separador detectado con los primeros KB (; , tabulador |)
+- Motor C de pandas; las líneas mal formadas se apartan y se informan sin volver a leer el fichero
+- Comillas sin cerrar (con las reglas del motor C) → el fichero se lee sin comillas (QUOTE_NONE)
+- Las líneas descartadas llevan el número y el texto del registro que cuenta el motor C
+  (terminadores \r, \n y \r\n; un campo entre comillas con saltos de línea es un solo registro)
+- leer_csv_por_bloques: lo mismo por bloques de filas, con memoria acotada y el mismo resultado
+"""
+
+import codecs
+import csv
+import io
+import re
+import warnings
+from itertools import islice
+from pathlib import Path
+
+import pandas as pd
+from pandas.errors import EmptyDataError, ParserError, ParserWarning
+
+# Bytes usados para detectar el separador
+MUESTRA_BYTES = 64 * 1024
+
+# Trozo de lectura al examinar un fichero grande sin cargarlo entero
+_TROZO_BYTES = 1024 * 1024
+
+SEPARADORES = ";,\t|"
+
+_LINEA_DESCARTADA_RE = re.compile(r"Skipping line (\d+): ([^\n]*)")
+
+_OPCIONES_SIN_COMILLAS = {"quoting": csv.QUOTE_NONE, "escapechar": "\\"}
+
+
+def detectar_codificacion(datos: bytes) -> str:
+    """'utf-8-sig' si el contenido es UTF-8 válido (con o sin BOM); si no, 'latin-1'."""
+    try:
+        datos.decode("utf-8")
+    except UnicodeDecodeError:
+        return "latin-1"
+    return "utf-8-sig"
+
+
+def detectar_separador(muestra: str, por_defecto: str = ";") -> str:
+    """Separador más probable de las primeras líneas completas de la muestra."""
+    lineas = muestra.splitlines()
+    if len(lineas) > 1:
+        lineas = lineas[:-1]  # la última puede estar cortada
+    try:
+        return csv.Sniffer().sniff("\n".join(lineas[:50]), delimiters=SEPARADORES).delimiter
+    except csv.Error:
+        cabecera = lineas[0] if lineas else ""
+        cuentas = {s: cabecera.count(s) for s in SEPARADORES}
+        mejor = max(cuentas, key=cuentas.get)
+        return mejor if cuentas[mejor] else por_defecto
+
+
+# -------------------------
+# REGISTROS COMO LOS CUENTA EL MOTOR C
+# -------------------------
+
+def _lineas(f, codificacion: str):
+    """Líneas de un fichero binario cortadas solo en \r, \n y \r\n (no en \x0b, \x0c, \x1c-\x1e ni \x85)."""
+    return io.TextIOWrapper(f, encoding=codificacion, newline="")
+
+
+def _sigue_entre_comillas(linea: str, sep: str, en_comillas: bool) -> bool:
+    """
+    Si al acabar la línea se sigue dentro de un campo entre comillas. Como el
+    motor C: una comilla abre el campo solo al principio de este, dentro '""'
+    es una comilla y otra sola lo cierra; en el resto del campo es un carácter más.
+    """
+    i = 0
+    while True:
+        j = linea.find('"', i)
+        if j < 0:
+            return en_comillas
+        if en_comillas:
+            if linea.startswith('"', j + 1):
+                i = j + 2
+                continue
+            en_comillas = False
+        elif j == 0 or linea[j - 1] == sep:
+            en_comillas = True
+        i = j + 1
+
+
+def _comillas_rotas(lineas, sep: str) -> bool:
+    """True si el fichero acaba dentro de un campo entre comillas: el motor C no lo leería."""
+    en_comillas = False
+    for linea in lineas:
+        en_comillas = _sigue_entre_comillas(linea, sep, en_comillas)
+    return en_comillas
+
+
+def _registros(lineas, sep: str, sin_comillas: bool):
+    """
+    (número, texto) de cada registro, numerados como en los avisos del motor C:
+    las líneas en blanco cuentan y un salto de línea dentro de comillas (o
+    escapado con \\ al leer sin comillas) no empieza otro registro.
+    """
+    n = 0
+    actual = []
+    en_comillas = False
+    for linea in lineas:
+        actual.append(linea)
+        if sin_comillas:
+            contenido = linea.rstrip("\r\n")
+            if (len(contenido) - len(contenido.rstrip("\\"))) % 2:
+                continue
+        else:
+            en_comillas = _sigue_entre_comillas(linea, sep, en_comillas)
+            if en_comillas:
+                continue
+        n += 1
+        yield n, "".join(actual).rstrip("\r\n")
+        actual = []
+    if actual:
+        yield n + 1, "".join(actual)
+
+
+def _descartadas(avisos, registros, desplazamiento: int = 0) -> list:
+    """
+    [{"linea", "motivo", "texto"}] de los ParserWarning. `registros` (de
+    _registros) se consume en orden; `desplazamiento` se suma a la línea del aviso.
+    """
+    descartadas = []
+    for aviso in avisos:
+        if not issubclass(aviso.category, ParserWarning):
+            continue
+        for n, motivo in _LINEA_DESCARTADA_RE.findall(str(aviso.message)):
+            n = int(n) + desplazamiento
+            texto = ""
+            for numero, registro in registros:
+                if numero == n:
+                    texto = registro
+                    break
+            descartadas.append({"linea": n, "motivo": motivo, "texto": texto})
+    return descartadas
+
+
+# -------------------------
+# LECTURA
+# -------------------------
+
+def _leer(datos: bytes, codificacion: str, sep: str, **opciones) -> tuple:
+    """DataFrame y avisos del motor C."""
+    with warnings.catch_warnings(record=True) as avisos:
+        warnings.simplefilter("always", ParserWarning)
+        df = pd.read_csv(
+            io.BytesIO(datos),
+            sep=sep,
+            encoding=codificacion,
+            dtype=str,
+            engine="c",
+            on_bad_lines="warn",
+            **opciones,
+        )
+    return df, avisos
+
+
+def leer_csv(ruta, sep: str | None = None) -> pd.DataFrame:
+    """
+    Lee un CSV como texto (dtype=str). `sep=None` lo detecta.
+    En df.attrs["lectura"] deja codificación, separador, si se leyó sin
+    comillas y las líneas descartadas [{"linea", "motivo", "texto"}].
+    """
+    datos = Path(ruta).read_bytes()
+    codificacion = detectar_codificacion(datos)
+    if sep is None:
+        sep = detectar_separador(datos[:MUESTRA_BYTES].decode(codificacion, errors="replace"))
+
+    # Comillas sin cerrar (típico de algunos exports): todo el fichero sin comillas
+    sin_comillas = _comillas_rotas(_lineas(io.BytesIO(datos), codificacion), sep)
+    try:
+        df, avisos = _leer(datos, codificacion, sep, **(_OPCIONES_SIN_COMILLAS if sin_comillas else {}))
+    except ParserError:
+        if sin_comillas:
+            raise
+        sin_comillas = True
+        df, avisos = _leer(datos, codificacion, sep, **_OPCIONES_SIN_COMILLAS)
+
+    registros = _registros(_lineas(io.BytesIO(datos), codificacion), sep, sin_comillas)
+    df.attrs["lectura"] = {
+        "codificacion": codificacion,
+        "separador": sep,
+        "sin_comillas": sin_comillas,
+        "descartadas": _descartadas(avisos, registros),
+    }
+    return df
+
+
+def _examinar(ruta: Path) -> tuple:
+    """(codificación, muestra) recorriendo el fichero por trozos: UTF-8 si todo el fichero lo es."""
+    decodificador = codecs.getincrementaldecoder("utf-8")()
+    codificacion = "utf-8-sig"
+    muestra = b""
+    with open(ruta, "rb") as f:
+        while True:
+            trozo = f.read(_TROZO_BYTES)
+            if len(muestra) < MUESTRA_BYTES:
+                muestra += trozo[:MUESTRA_BYTES - len(muestra)]
+            if codificacion != "latin-1":
+                try:
+                    decodificador.decode(trozo, final=not trozo)
+                except UnicodeDecodeError:
+                    codificacion = "latin-1"
+            if not trozo:
+                break
+    return codificacion, muestra
+
+
+def leer_csv_por_bloques(ruta, filas: int, sep: str | None = None):
+    """
+    Como leer_csv, pero devuelve DataFrames de como mucho `filas` filas sin
+    cargar el fichero; las filas, avisos y líneas descartadas son las mismas.
+    Las comillas se comprueban antes de leer (_comillas_rotas), como en
+    leer_csv. Cada bloque son registros enteros (_registros) que se leen como
+    un fichero con la cabecera: con chunksize, el motor C no comprueba el
+    número de campos de la primera fila de cada trozo y le quita los que sobran
+    sin avisar. Si el motor C falla en un bloque, se avisa con ValueError.
+    """
+    ruta = Path(ruta)
+    codificacion, muestra = _examinar(ruta)
+    if sep is None:
+        sep = detectar_separador(muestra.decode(codificacion, errors="replace"))
+    with open(ruta, "rb") as f:
+        sin_comillas = _comillas_rotas(_lineas(f, codificacion), sep)
+    opciones = _OPCIONES_SIN_COMILLAS if sin_comillas else {}
+
+    with open(ruta, "rb") as f:
+        registros = _registros(_lineas(f, codificacion), sep, sin_comillas)
+        cabecera = next(registros, None)
+        if cabecera is None:
+            raise EmptyDataError("No columns to parse from file")
+        inicio = 0
+        primero = True
+        while True:
+            bloque = list(islice(registros, filas))
+            if not bloque and not primero:
+                return
+            # Tras el primer bloque, la cabecera repetida como primera fila: el
+            # motor C no comprueba los campos de la primera fila de datos
+            previas = [] if primero else [cabecera[1]]
+            texto = "\n".join([cabecera[1], *previas, *(t for _, t in bloque)]) + "\n"
+            with warnings.catch_warnings(record=True) as avisos:
+                warnings.simplefilter("always", ParserWarning)
+                try:
+                    df = pd.read_csv(io.StringIO(texto), sep=sep, dtype=str, engine="c",
+                                     on_bad_lines="warn", **opciones)
+                except ParserError as e:
+                    raise ValueError(f"{ruta.name}: formato no válido para la lectura por bloques: {e}") from e
+            df = df.iloc[len(previas):]
+            df.index = pd.RangeIndex(inicio, inicio + len(df))
+            # Línea del aviso en el texto del bloque → número de registro en el fichero
+            desplazamiento = bloque[0][0] - 2 - len(previas) if bloque else 0
+            df.attrs["lectura"] = {
+                "codificacion": codificacion,
+                "separador": sep,
+                "sin_comillas": sin_comillas,
+                "descartadas": _descartadas(avisos, iter(bloque), desplazamiento),
+            }
+            # Sin filas solo el primero (lleva las columnas) o si hay líneas descartadas
+            if len(df) or primero or df.attrs["lectura"]["descartadas"]:
+                yield df
+            inicio += len(df)
+            primero = False
+
+
+def avisar_descartadas(df: pd.DataFrame, nombre: str = "CSV"):
+    """Imprime las líneas que no se pudieron leer, si las hay."""
+    descartadas = df.attrs.get("lectura", {}).get("descartadas", [])
+    if not descartadas:
+        return
+    print(f"Aviso: {len(descartadas)} líneas de {nombre} descartadas por formato incorrecto")
+    for d in descartadas[:20]:
+        texto = f" → {d['texto'][:120]}" if d["texto"] else ""
+        print(f"  línea {d['linea']}: {d['motivo']}{texto}")
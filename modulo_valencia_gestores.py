@@ -1,9 +1,12 @@
 from datetime import datetime
 from pathlib import Path
 import pandas as pd
-from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
 import re
 
+from add_resumen_unico import VOLVER_RESUMEN
+from salida_excel import HojaSalida, filas_df, nuevo_libro
+
 
 # -------------------------------------------------
 # NORMALIZACIÓN
@@ -32,14 +35,44 @@ def validar_zonas_excel_vs_gestores(zonas_excel, zonas_gestores):
 
 
 # -------------------------------------------------
-# FUNCIÓN PRINCIPAL
+# ASIGNACIÓN DE GESTORES
 # -------------------------------------------------
 
-def generar_libros_gestores(
-    ruta_excel_final: str,
-    ruta_asignacion: str,
-    carpeta_salida: str
-) -> dict:
+def leer_asignacion(ruta_asignacion: str, resultado: dict):
+    """{zona normalizada: gestor} de gestor_zonas.xlsx, o None con el error en `resultado`."""
+
+    df_asignacion = pd.read_excel(ruta_asignacion)
+
+    if not {"ZONA_REP", "GESTOR"}.issubset(df_asignacion.columns):
+        resultado["errores"].append(
+            "El archivo gestor_zonas.xlsx debe contener columnas ZONA_REP y GESTOR."
+        )
+        return None
+
+    df_asignacion["ZONA_REP"] = df_asignacion["ZONA_REP"].apply(_normalizar)
+    df_asignacion["GESTOR"] = df_asignacion["GESTOR"].astype(str).str.strip()
+
+    duplicadas = df_asignacion["ZONA_REP"][df_asignacion["ZONA_REP"].duplicated()]
+
+    if not duplicadas.empty:
+        resultado["errores"].append(
+            f"Zonas duplicadas en gestor_zonas.xlsx: {list(duplicadas)}"
+        )
+        return None
+
+    return dict(zip(df_asignacion["ZONA_REP"], df_asignacion["GESTOR"]))
+
+
+# -------------------------------------------------
+# ESCRITURA DE LOS LIBROS
+# -------------------------------------------------
+
+def escribir_libros_gestores(zonas: dict, ruta_asignacion: str, carpeta_salida: str) -> dict:
+    """
+    Un libro por gestor con RESUMEN_UNICO, sus hojas ZREP_* y TODO.
+    `zonas`: {hoja ZREP_*: (columnas, filas)}, con `filas()` devolviendo las
+    filas de la hoja (listas de valores); se llama una vez para la hoja y otra para TODO.
+    """
 
     resultado = {
         "ok": False,
@@ -49,78 +82,36 @@ def generar_libros_gestores(
 
     try:
 
-        # -------------------------------------------------
-        # VALIDACIONES BÁSICAS
-        # -------------------------------------------------
-
-        if not Path(ruta_excel_final).exists():
-            resultado["errores"].append("No existe el Excel final validado.")
-            return resultado
-
         if not Path(ruta_asignacion).exists():
             resultado["errores"].append("No existe el archivo gestor_zonas.xlsx.")
             return resultado
 
-        Path(carpeta_salida).mkdir(parents=True, exist_ok=True)
-
-        fecha_hoy = datetime.today().strftime("%Y-%m-%d")
-
-        # -------------------------------------------------
-        # DETECTAR HOJAS TERRITORIALES
-        # -------------------------------------------------
-
-        xls = pd.ExcelFile(ruta_excel_final)
-
-        hojas_libro = xls.sheet_names
-        zonas_libro_raw = [h for h in hojas_libro if h.startswith("ZREP_")]
-
-        if not zonas_libro_raw:
+        if not zonas:
             resultado["errores"].append(
                 "No se han encontrado hojas territoriales (ZREP_*) en el libro final."
             )
             return resultado
 
-        mapa_hojas = {_normalizar(z): z for z in zonas_libro_raw}
-        zonas_libro_set = set(mapa_hojas.keys())
-
-        # -------------------------------------------------
-        # LEER ASIGNACIÓN DE GESTORES
-        # -------------------------------------------------
-
-        df_asignacion = pd.read_excel(ruta_asignacion)
+        Path(carpeta_salida).mkdir(parents=True, exist_ok=True)
 
-        if not {"ZONA_REP", "GESTOR"}.issubset(df_asignacion.columns):
-            resultado["errores"].append(
-                "El archivo gestor_zonas.xlsx debe contener columnas ZONA_REP y GESTOR."
-            )
-            return resultado
+        fecha_hoy = datetime.today().strftime("%Y-%m-%d")
 
-        df_asignacion["ZONA_REP"] = df_asignacion["ZONA_REP"].apply(_normalizar)
-        df_asignacion["GESTOR"] = df_asignacion["GESTOR"].astype(str).str.strip()
+        mapa_hojas = {_normalizar(z): z for z in zonas}
 
-        duplicadas = df_asignacion["ZONA_REP"][df_asignacion["ZONA_REP"].duplicated()]
+        mapa_zona_gestor = leer_asignacion(ruta_asignacion, resultado)
 
-        if not duplicadas.empty:
-            resultado["errores"].append(
-                f"Zonas duplicadas en gestor_zonas.xlsx: {list(duplicadas)}"
-            )
+        if mapa_zona_gestor is None:
             return resultado
 
-        zonas_asignadas = set(df_asignacion["ZONA_REP"])
-
-        mapa_zona_gestor = dict(
-            zip(df_asignacion["ZONA_REP"], df_asignacion["GESTOR"])
-        )
-
-        gestores_detectados = sorted(df_asignacion["GESTOR"].unique())
+        gestores_detectados = sorted(set(mapa_zona_gestor.values()))
 
         # -------------------------------------------------
         # VALIDACIÓN CENTRALIZADA
         # -------------------------------------------------
 
         validar_zonas_excel_vs_gestores(
-            zonas_libro_set,
-            zonas_asignadas
+            set(mapa_hojas),
+            set(mapa_zona_gestor)
         )
 
         # -------------------------------------------------
@@ -129,98 +120,105 @@ def generar_libros_gestores(
 
         for gestor in gestores_detectados:
 
-            zonas_gestor_norm = [
-                z for z in zonas_libro_set if mapa_zona_gestor[z] == gestor
+            zonas_gestor = [
+                zona_real for zona_norm, zona_real in mapa_hojas.items()
+                if mapa_zona_gestor[zona_norm] == gestor
             ]
 
-            if not zonas_gestor_norm:
+            if not zonas_gestor:
                 continue
 
-            wb = Workbook()
-            wb.remove(wb.active)
+            # Columnas de TODO: las de todas las zonas, en orden de aparición, y ZONA
+            columnas_todo = []
+            for zona_real in zonas_gestor:
+                for c in zonas[zona_real][0]:
+                    if c not in columnas_todo:
+                        columnas_todo.append(c)
+            columnas_todo.append("ZONA")
 
-            dfs_todo = []
+            # El libro se escribe por filas y en orden: RESUMEN_UNICO, zonas, TODO
 
-            for zona_norm in zonas_gestor_norm:
+            wb = nuevo_libro()
 
-                zona_real = mapa_hojas[zona_norm]
+            # -------------------------------------------------
+            # RESUMEN
+            # -------------------------------------------------
 
-                df_zona = pd.read_excel(
-                    ruta_excel_final,
-                    sheet_name=zona_real
-                )
+            ws_resumen = HojaSalida(wb, "RESUMEN_UNICO")
 
-                ws = wb.create_sheet(title=zona_real)
+            ws_resumen.fila(["Total expediciones", "=COUNTA(TODO!A:A)-1"])
 
-                ws.append(list(df_zona.columns))
+            if "Kgs" in columnas_todo:
 
-                for fila in df_zona.itertuples(index=False):
-                    ws.append(list(fila))
+                col_kgs_letter = get_column_letter(columnas_todo.index("Kgs") + 1)
 
-                df_zona["ZONA"] = zona_real
+                ws_resumen.fila(["Total Kgs", f"=SUM(TODO!{col_kgs_letter}:{col_kgs_letter})"])
 
-                dfs_todo.append(df_zona)
+            else:
 
-            df_todo = pd.concat(dfs_todo, ignore_index=True)
+                ws_resumen.fila([])
 
-            # -------------------------------------------------
-            # HOJA TODO
-            # -------------------------------------------------
+            ws_resumen.fila([])
+
+            ws_resumen.fila(["Zona", "Expediciones", "Kgs"])
+
+            col_zona_letter = get_column_letter(columnas_todo.index("ZONA") + 1)
+
+            for zona in sorted(zonas_gestor):
+
+                fila = [
+                    zona,
+                    f'=COUNTIF(TODO!{col_zona_letter}:{col_zona_letter},"{zona}")'
+                ]
 
-            ws_todo = wb.create_sheet("TODO")
+                if "Kgs" in columnas_todo:
 
-            ws_todo.append(list(df_todo.columns))
+                    fila.append(
+                        f'=SUMIF(TODO!{col_zona_letter}:{col_zona_letter},"{zona}",'
+                        f'TODO!{col_kgs_letter}:{col_kgs_letter})'
+                    )
 
-            for fila in df_todo.itertuples(index=False):
-                ws_todo.append(list(fila))
+                ws_resumen.fila(fila)
 
             # -------------------------------------------------
-            # RESUMEN
+            # HOJAS DE ZONA
             # -------------------------------------------------
 
-            ws_resumen = wb.create_sheet("RESUMEN_UNICO")
+            for zona_real in zonas_gestor:
 
-            wb._sheets.remove(ws_resumen)
-            wb._sheets.insert(0, ws_resumen)
+                columnas, filas = zonas[zona_real]
 
-            ws_resumen["A1"] = "Total expediciones"
-            ws_resumen["B1"] = "=COUNTA(TODO!A:A)-1"
+                ws = HojaSalida(wb, zona_real)
 
-            if "Kgs" in df_todo.columns:
+                ws.fila(columnas)
 
-                col_kgs = df_todo.columns.get_loc("Kgs") + 1
-                col_kgs_letter = ws_todo.cell(row=1, column=col_kgs).column_letter
+                for fila in filas():
+                    ws.fila(fila)
 
-                ws_resumen["A2"] = "Total Kgs"
-                ws_resumen["B2"] = f"=SUM(TODO!{col_kgs_letter}:{col_kgs_letter})"
+            # -------------------------------------------------
+            # HOJA TODO
+            # -------------------------------------------------
 
-            ws_resumen["A4"] = "Zona"
-            ws_resumen["B4"] = "Expediciones"
-            ws_resumen["C4"] = "Kgs"
+            ws_todo = HojaSalida(wb, "TODO")
 
-            col_zona = df_todo.columns.get_loc("ZONA") + 1
-            col_zona_letter = ws_todo.cell(row=1, column=col_zona).column_letter
+            ws_todo.fila(columnas_todo)
 
-            zonas_unicas = sorted(df_todo["ZONA"].unique())
+            for zona_real in zonas_gestor:
 
-            fila_inicio = 5
+                columnas, filas = zonas[zona_real]
 
-            for i, zona in enumerate(zonas_unicas):
+                posiciones = [columnas_todo.index(c) for c in columnas]
 
-                fila = fila_inicio + i
+                for fila in filas():
 
-                ws_resumen[f"A{fila}"] = zona
+                    fila_todo = [None] * len(columnas_todo)
 
-                ws_resumen[f"B{fila}"] = (
-                    f'=COUNTIF(TODO!{col_zona_letter}:{col_zona_letter},"{zona}")'
-                )
+                    for j, v in zip(posiciones, fila):
+                        fila_todo[j] = v
 
-                if "Kgs" in df_todo.columns:
+                    fila_todo[-1] = zona_real
 
-                    ws_resumen[f"C{fila}"] = (
-                        f'=SUMIF(TODO!{col_zona_letter}:{col_zona_letter},"{zona}",'
-                        f'TODO!{col_kgs_letter}:{col_kgs_letter})'
-                    )
+                    ws_todo.fila(fila_todo)
 
             # -------------------------------------------------
             # GUARDAR
@@ -241,3 +239,48 @@ def generar_libros_gestores(
 
         resultado["errores"].append(str(e))
         return resultado
+
+
+# -------------------------------------------------
+# FUNCIÓN PRINCIPAL
+# -------------------------------------------------
+
+def _leer_zona(xls: pd.ExcelFile, hoja: str) -> pd.DataFrame:
+    """Hoja ZREP_* con su cabecera real (tras la fila "← RESUMEN" si la tiene)."""
+    df = xls.parse(hoja)
+    if len(df.columns) and str(df.columns[0]).strip() == VOLVER_RESUMEN:
+        df = xls.parse(hoja, header=1)
+    return df
+
+
+def generar_libros_gestores(
+    ruta_excel_final: str,
+    ruta_asignacion: str,
+    carpeta_salida: str
+) -> dict:
+    """Libros por gestor a partir del Excel final ya guardado (escribir_libros_gestores)."""
+
+    if not Path(ruta_excel_final).exists():
+        return {
+            "ok": False,
+            "errores": ["No existe el Excel final validado."],
+            "archivos_generados": {}
+        }
+
+    try:
+        xls = pd.ExcelFile(ruta_excel_final)
+    except Exception as e:
+        return {"ok": False, "errores": [str(e)], "archivos_generados": {}}
+
+    zonas = {}
+
+    for hoja in xls.sheet_names:
+
+        if not hoja.startswith("ZREP_"):
+            continue
+
+        df_zona = _leer_zona(xls, hoja)
+
+        zonas[hoja] = (list(df_zona.columns), lambda df=df_zona: filas_df(df))
+
+    return escribir_libros_gestores(zonas, ruta_asignacion, carpeta_salida)
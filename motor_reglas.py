@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+motor_reglas.py — Clasificación de expediciones con las reglas de Reglas_hospitales.xlsx
+- Reglas agrupadas por población normalizada, con un autómata Aho–Corasick de patrones por grupo
+- Gana la primera regla de la hoja que encaja (como match_rules), con su etiqueta
+- Clasifica todas las filas de una vez y memoriza (LRU acotado) los grupos aplicables a cada población
+- Regla aplicada a cada fila y aciertos por regla para la traza de clasificación
+- Reglas compiladas guardadas junto al Excel (<nombre>.reglas.pkl) por huella SHA-256 del Excel
+  y de la normalización (norm sobre una muestra fija): un cambio en norm las recompila
+
+Uso (precompilar tras editar las reglas):
+    python motor_reglas.py Reglas_hospitales.xlsx
+"""
+
+import argparse
+import hashlib
+import io
+import os
+import pickle
+import tempfile
+from collections import OrderedDict, deque
+from pathlib import Path
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from normalizacion import norm
+
+# Cambiar si cambia el formato de MotorReglas/Automata: invalida los .reglas.pkl
+VERSION_COMPILADO = 3
+
+# Poblaciones distintas cuyos grupos aplicables se memorizan por motor
+APLICABLES_MAX = 4096
+
+# Textos con lo que toca norm (tildes, ç, ñ, ordinales, apóstrofos, puntuación,
+# espacios raros, mayúsculas): su salida forma parte de la huella del compilado
+_MUESTRA_NORM = (
+    "Castelló de la Plana", "L'Alcora", "Vila-real", "Benicàssim / Benicasim", "Almassora",
+    "Avda. Rey D. Jaime, 1º 2ª", "C/ Nº 5 S/N", "Peñíscola", "Onda\u00a0(Castellón)", "  hospital  general ",
+    "ÀÈÌÒÙ áéíóú ÄËÏÖÜ äëïöü Çç Ññ", "Plaça d’Espanya", "camí «vell»", "1.234,5", "",
+)
+
+# motor → (hoja, columna de etiqueta)
+HOJAS_REGLAS = {
+    "hospitales": ("REGLAS_HOSPITALES", "Hospital_final"),
+    "federacion": ("REGLAS_FEDERACION", None),
+}
+
+
+# -------------------------
+# LECTURA DE REGLAS
+# -------------------------
+
+def sheet_to_df(wb, name: str) -> pd.DataFrame:
+    if name not in wb.sheetnames:
+        return pd.DataFrame()
+    ws = wb[name]
+    data = list(ws.values)
+    if not data:
+        return pd.DataFrame()
+    headers = list(data[0])
+    rows = data[1:]
+    return pd.DataFrame(rows, columns=headers)
+
+
+def prepare_rules(df_rules: pd.DataFrame, pob_col: str, pat_col: str) -> pd.DataFrame:
+    if df_rules.empty:
+        return df_rules
+    d = df_rules.copy()
+    d["Pob_norm"] = d[pob_col].astype(str).apply(norm)
+    d["Pat_norm"] = d[pat_col].astype(str).apply(norm)
+    d = d[d["Pat_norm"].ne("")]
+    return d
+
+
+def match_rules(pob_norm: str, dir_norm: str, rules_df: pd.DataFrame, tag_field: str | None = None):
+    """Regla a regla, para una sola fila (referencia de MotorReglas)."""
+    for _, r in rules_df.iterrows():
+        if r["Pob_norm"] and r["Pob_norm"] not in pob_norm:
+            continue
+        if r["Pat_norm"] and r["Pat_norm"] in dir_norm:
+            if tag_field:
+                return True, str(r.get(tag_field, "") or "")
+            return True, ""
+    return False, ""
+
+
+# -------------------------
+# MOTOR
+# -------------------------
+
+class Automata:
+    """
+    Autómata Aho–Corasick sobre una lista de patrones. Cada patrón lleva un
+    orden; `primero(texto)` da el menor orden de los patrones contenidos en
+    el texto (o None).
+    """
+
+    def __init__(self, patrones):
+        # patrones: [(patrón, orden)]
+        self._hijos = [{}]
+        self._fallo = [0]
+        self._minimo = [None]
+
+        for patron, orden in patrones:
+            nodo = 0
+            for c in patron:
+                siguiente = self._hijos[nodo].get(c)
+                if siguiente is None:
+                    siguiente = len(self._hijos)
+                    self._hijos[nodo][c] = siguiente
+                    self._hijos.append({})
+                    self._fallo.append(0)
+                    self._minimo.append(None)
+                nodo = siguiente
+            if self._minimo[nodo] is None or orden < self._minimo[nodo]:
+                self._minimo[nodo] = orden
+
+        # Enlaces de fallo en anchura; cada nodo hereda el mínimo de su enlace
+        cola = deque(self._hijos[0].values())
+        while cola:
+            nodo = cola.popleft()
+            heredado = self._minimo[self._fallo[nodo]]
+            if heredado is not None and (self._minimo[nodo] is None or heredado < self._minimo[nodo]):
+                self._minimo[nodo] = heredado
+            for c, hijo in self._hijos[nodo].items():
+                f = self._fallo[nodo]
+                while f and c not in self._hijos[f]:
+                    f = self._fallo[f]
+                destino = self._hijos[f].get(c)
+                self._fallo[hijo] = destino if destino is not None and destino != hijo else 0
+                cola.append(hijo)
+
+    def primero(self, texto: str):
+        hijos, fallo, minimo = self._hijos, self._fallo, self._minimo
+        nodo = 0
+        mejor = None
+        for c in texto:
+            while nodo and c not in hijos[nodo]:
+                nodo = fallo[nodo]
+            nodo = hijos[nodo].get(c, 0)
+            m = minimo[nodo]
+            if m is not None and (mejor is None or m < mejor):
+                mejor = m
+        return mejor
+
+
+def _id_regla(v) -> str:
+    if v is None or (isinstance(v, float) and pd.isna(v)):
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return str(v).strip()
+
+
+class MotorReglas:
+    """
+    Reglas ya preparadas (prepare_rules) compiladas por Pob_norm. Una regla
+    encaja si su Pob_norm está vacío o contenido en la población y su
+    Pat_norm está contenido en la dirección. Cada regla se identifica por
+    su posición en la hoja; `ids` y `filas` guardan ID_Regla y fila del Excel.
+    """
+
+    def __init__(self, rules_df: pd.DataFrame, tag_field: str | None = None):
+        self.etiquetas = []
+        self.ids = []
+        self.filas = []
+        self.poblaciones = []
+        self.patrones = []
+        grupos = {}
+        if not rules_df.empty:
+            tags = rules_df[tag_field] if tag_field and tag_field in rules_df.columns else [""] * len(rules_df)
+            ids = rules_df["ID_Regla"] if "ID_Regla" in rules_df.columns else [None] * len(rules_df)
+            filas = zip(rules_df.index, ids, rules_df["Pob_norm"], rules_df["Pat_norm"], tags)
+            for orden, (i, rid, pob, pat, tag) in enumerate(filas):
+                self.etiquetas.append(str(tag or "") if tag_field else "")
+                self.ids.append(_id_regla(rid))
+                # sheet_to_df deja la fila 2 del Excel en el índice 0
+                self.filas.append(int(i) + 2)
+                self.poblaciones.append(pob)
+                self.patrones.append(pat)
+                grupos.setdefault(pob, []).append((pat, orden))
+        self.grupos = {pob: Automata(patrones) for pob, patrones in grupos.items()}
+        self._aplicables = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.etiquetas)
+
+    def _grupos_de(self, pob_norm: str) -> list:
+        grupos = self._aplicables.get(pob_norm)
+        if grupos is None:
+            grupos = [a for pob, a in self.grupos.items() if not pob or pob in pob_norm]
+            self._aplicables[pob_norm] = grupos
+            while len(self._aplicables) > APLICABLES_MAX:
+                self._aplicables.popitem(last=False)
+        else:
+            self._aplicables.move_to_end(pob_norm)
+        return grupos
+
+    def __getstate__(self):
+        # Lo memorizado no se guarda en el compilado
+        return {**self.__dict__, "_aplicables": OrderedDict()}
+
+    def primera_regla(self, pob_norm: str, dir_norm: str):
+        """Posición de la primera regla que encaja o None."""
+        mejor = None
+        for automata in self._grupos_de(pob_norm):
+            orden = automata.primero(dir_norm)
+            if orden is not None and (mejor is None or orden < mejor):
+                mejor = orden
+        return mejor
+
+    def clasificar(self, pob_norm: pd.Series, dir_norm: pd.Series) -> tuple:
+        """(encaja, etiqueta, regla): Series alineadas con las de entrada; regla es la posición o <NA>."""
+        ordenes = [self.primera_regla(p, d) for p, d in zip(pob_norm, dir_norm)]
+        encaja = pd.Series([o is not None for o in ordenes], index=pob_norm.index, dtype=bool)
+        etiqueta = pd.Series(
+            ["" if o is None else self.etiquetas[o] for o in ordenes], index=pob_norm.index, dtype=object
+        )
+        regla = pd.Series(ordenes, index=pob_norm.index, dtype="Int64")
+        return encaja, etiqueta, regla
+
+    def nombre_regla(self, orden: int) -> str:
+        """'ID_Regla (fila N)', o solo la fila si la regla no tiene ID."""
+        if self.ids[orden]:
+            return f"{self.ids[orden]} (fila {self.filas[orden]})"
+        return f"fila {self.filas[orden]}"
+
+    def aciertos(self, regla: pd.Series) -> list:
+        """Una entrada por regla, en el orden de la hoja, con las filas que clasificó."""
+        cuenta = regla.dropna().value_counts()
+        return [
+            {
+                "id": self.ids[i],
+                "fila": self.filas[i],
+                "poblacion": self.poblaciones[i],
+                "patron": self.patrones[i],
+                "etiqueta": self.etiquetas[i],
+                "aciertos": int(cuenta.get(i, 0)),
+            }
+            for i in range(len(self))
+        ]
+
+
+# -------------------------
+# COMPILADO EN DISCO
+# -------------------------
+
+def ruta_compilado(reglas_path: Path) -> Path:
+    reglas_path = Path(reglas_path)
+    return reglas_path.with_name(f"{reglas_path.stem}.reglas.pkl")
+
+
+def huella_normalizacion() -> str:
+    """SHA-256 de norm sobre _MUESTRA_NORM: cambia si cambia la normalización de reglas y filas."""
+    return hashlib.sha256("\0".join(norm(t) for t in _MUESTRA_NORM).encode("utf-8")).hexdigest()
+
+
+def _compilar(contenido: bytes) -> dict:
+    wb = load_workbook(io.BytesIO(contenido), data_only=True)
+    motores = {}
+    for nombre, (hoja, etiqueta) in HOJAS_REGLAS.items():
+        reglas = prepare_rules(sheet_to_df(wb, hoja), "Población", "Patrón_dirección")
+        motores[nombre] = MotorReglas(reglas, etiqueta)
+    return motores
+
+
+def compilar_reglas(reglas_path: Path) -> dict:
+    """Compila el Excel de reglas y guarda el resultado junto a él. Devuelve los motores."""
+    reglas_path = Path(reglas_path)
+    contenido = reglas_path.read_bytes()
+    motores = _compilar(contenido)
+    datos = {
+        "version": VERSION_COMPILADO,
+        "huella": hashlib.sha256(contenido).hexdigest(),
+        "normalizacion": huella_normalizacion(),
+        "motores": motores,
+    }
+    destino = ruta_compilado(reglas_path)
+    try:
+        fd, tmp = tempfile.mkstemp(dir=destino.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(datos, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, destino)
+    except OSError as e:
+        print(f"Aviso: no se pudieron guardar las reglas compiladas: {e}")
+    return motores
+
+
+def cargar_reglas(reglas_path: Path) -> dict:
+    """
+    {"hospitales": MotorReglas, "federacion": MotorReglas}. Usa el compilado
+    guardado si su huella coincide con la del Excel y se compiló con la misma
+    normalización (huella_normalizacion); si no, lo recompila.
+    """
+    reglas_path = Path(reglas_path)
+    huella = hashlib.sha256(reglas_path.read_bytes()).hexdigest()
+    try:
+        with open(ruta_compilado(reglas_path), "rb") as f:
+            datos = pickle.load(f)
+        if (datos.get("version") == VERSION_COMPILADO and datos.get("huella") == huella
+                and datos.get("normalizacion") == huella_normalizacion()):
+            return datos["motores"]
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Aviso: reglas compiladas ilegibles, se recompilan: {e}")
+    return compilar_reglas(reglas_path)
+
+
+# -------------------------
+# MAIN
+# -------------------------
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("reglas", nargs="?", default="Reglas_hospitales.xlsx")
+    args = parser.parse_args()
+
+    motores = compilar_reglas(Path(args.reglas))
+    for nombre, motor in motores.items():
+        print(f"{nombre}: {len(motor)} reglas, {len(motor.grupos)} poblaciones")
+    print(f"Guardado en {ruta_compilado(Path(args.reglas))}")
+
+
+if __name__ == "__main__":
+    main()
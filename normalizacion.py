@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+normalizacion.py — Normalización de texto compartida por el reparto y la geocodificación
+- clean_text / norm: limpieza y normalización usadas por las reglas y el callejero
+- clean_text_serie / norm_serie: lo mismo sobre columnas enteras, una vez por valor distinto
+- clave_canonica: clave de la caché de geocodificación
+- partes_clave / calle_base / numero_portal: descomposición de la clave para el resolutor local
+- separar_tipo_via: tipo de vía canónico y nombre sin artículos (callejero)
+"""
+
+import re
+
+import pandas as pd
+
+
+# -------------------------
+# TEXTO
+# -------------------------
+
+TRANS_ACENTOS = str.maketrans({
+    "Á": "A", "É": "E", "Í": "I", "Ó": "O", "Ú": "U", "Ü": "U", "Ñ": "N", "Ç": "C",
+})
+
+# La clave de caché pliega además las tildes graves y diéresis del valenciano
+# y separa los ordinales ('Nº5' → 'N 5')
+_TRANS_ACENTOS_CLAVE = str.maketrans({
+    "Á": "A", "É": "E", "Í": "I", "Ó": "O", "Ú": "U", "Ü": "U", "Ñ": "N", "Ç": "C",
+    "À": "A", "È": "E", "Ì": "I", "Ò": "O", "Ù": "U", "Ï": "I", "º": " ", "ª": " ",
+})
+
+_ESPACIOS_RE = re.compile(r"\s+")
+_NO_PALABRA_RE = re.compile(r"[^\w\s]")
+
+
+def clean_text(x) -> str:
+    if pd.isna(x):
+        return ""
+    return _ESPACIOS_RE.sub(" ", str(x).strip())
+
+
+def norm(s: str) -> str:
+    s = clean_text(s).upper()
+    s = s.translate(TRANS_ACENTOS)
+    s = _NO_PALABRA_RE.sub(" ", s)
+    s = _ESPACIOS_RE.sub(" ", s).strip()
+    return s
+
+
+def como_texto(serie: pd.Series) -> pd.Series:
+    """Serie de str de Python (dtype object) con '' en los nulos."""
+    return serie.where(serie.notna(), "").astype(str).astype(object)
+
+
+def por_valores_distintos(serie: pd.Series, transformar) -> pd.Series:
+    """
+    Aplica `transformar` (de Serie de texto a Serie) una sola vez por valor
+    distinto de la columna y reparte el resultado a todas las filas.
+    Poblaciones, bultos y buena parte de las direcciones se repiten mucho.
+    """
+    codigos, distintos = pd.factorize(como_texto(serie))
+    resultado = transformar(pd.Series(distintos, dtype=object))
+    return pd.Series(resultado.to_numpy()[codigos], index=serie.index, dtype=resultado.dtype)
+
+
+def _clean_text_distintos(s: pd.Series) -> pd.Series:
+    return s.str.strip().str.replace(_ESPACIOS_RE, " ", regex=True)
+
+
+def _norm_distintos(s: pd.Series) -> pd.Series:
+    s = _clean_text_distintos(s).str.upper().str.translate(TRANS_ACENTOS)
+    s = s.str.replace(_NO_PALABRA_RE, " ", regex=True)
+    return s.str.replace(_ESPACIOS_RE, " ", regex=True).str.strip()
+
+
+def clean_text_serie(serie: pd.Series) -> pd.Series:
+    """clean_text sobre toda una columna."""
+    return por_valores_distintos(serie, _clean_text_distintos)
+
+
+def norm_serie(serie: pd.Series) -> pd.Series:
+    """norm sobre toda una columna."""
+    return por_valores_distintos(serie, _norm_distintos)
+
+
+# -------------------------
+# CLAVE CANÓNICA DE DIRECCIÓN
+# -------------------------
+
+TIPOS_VIA = {
+    "CALLE": ("C", "CL", "CLL", "CALL", "CALLE", "CARRER", "CARR"),
+    "AVENIDA": ("AV", "AVD", "AVDA", "AVGDA", "AVNDA", "AVENIDA", "AVINGUDA"),
+    "PLAZA": ("PL", "PZ", "PZA", "PLZ", "PLZA", "PLAZA", "PLACA"),
+    "PASEO": ("PS", "PSO", "PSG", "PASEO", "PASSEIG"),
+    "CARRETERA": ("CTRA", "CRTA", "CARRETERA"),
+    "CAMINO": ("CM", "CMNO", "CAMI", "CAMINO"),
+    "PARTIDA": ("PDA", "PTDA", "PARTIDA"),
+    "TRAVESIA": ("TRV", "TRVA", "TRAV", "TRAVESIA", "TRAVESSIA"),
+    "RONDA": ("RD", "RDA", "RONDA"),
+    "POLIGONO": ("POL", "POLIG", "PLG", "POLIGONO"),
+    "URBANIZACION": ("URB", "URBANIZACION", "URBANITZACIO"),
+    "GLORIETA": ("GTA", "GLORIETA"),
+    "PASAJE": ("PJE", "PSAJE", "PTGE", "PASAJE", "PASSATGE"),
+}
+_TIPO_CANONICO = {abrev: tipo for tipo, abrevs in TIPOS_VIA.items() for abrev in abrevs}
+
+_ARTICULOS = {"DE", "DEL", "LA", "LAS", "EL", "LOS", "L", "D", "LES", "ELS", "DELS"}
+_MARCAS_NUMERO = {"N", "NO", "NUM", "NUMERO", "NRO"}
+_NUMERO_RE = re.compile(r"^\d+[A-Z]?$")
+_CP_RE = re.compile(r"\b([0-5]\d{4})\b")
+
+# Piso y puerta tras el número de portal: no forman parte de la clave
+_PISO_PUERTA = {
+    "PISO", "PLANTA", "PL", "PTA", "PUERTA", "PT", "ESC", "ESCALERA", "BAJO", "BAJOS", "BJ",
+    "IZQ", "IZDA", "IZQUIERDA", "DCHA", "DRCHA", "DER", "DERECHA", "ENTLO", "ENTRESUELO",
+    "ATICO", "LOCAL", "BIS", "BLOQUE", "BLQ", "APTO",
+}
+# Ordinal detrás del portal: '5 2º B' y '5, 1ª' son piso y puerta
+_PISO_RE = re.compile(r"(\d+[A-Z]?)\s*,?\s*(\d+)\s*[ºª°]")
+
+
+def texto_clave(s: str) -> str:
+    """Texto en el formato de las partes de la clave: mayúsculas, sin tildes ni puntuación."""
+    s = clean_text(s).upper().translate(_TRANS_ACENTOS_CLAVE)
+    s = _NO_PALABRA_RE.sub(" ", s)
+    return _ESPACIOS_RE.sub(" ", s).strip()
+
+
+def tipo_via(token: str) -> str | None:
+    """Tipo de vía canónico de una abreviatura ya normalizada ('AVDA' → 'AVENIDA') o None."""
+    return _TIPO_CANONICO.get(token)
+
+
+def _es_numero(token: str) -> bool:
+    return bool(_NUMERO_RE.match(token))
+
+
+def _tras_portal(token: str) -> bool:
+    """Lo que puede seguir al número de portal: piso, puerta, escalera…"""
+    return _es_numero(token) or (len(token) == 1 and token.isalpha()) or token in _PISO_PUERTA
+
+
+def _calle_canonica(calle: str) -> str:
+    """
+    Nombre de la vía en su orden (tipo expandido, sin artículos) y, al final,
+    el número de portal; piso y puerta fuera. El portal es el primer número
+    tras el nombre al que solo siguen piso o puerta ('AV 9 D'OCTUBRE 14' →
+    'AVENIDA 9 OCTUBRE 14', 'C/ MAYOR 5 2º B' → 'CALLE MAYOR 5'). Si tras él
+    viene otro número sin marca de piso ('CALLE 1 5') no se sabe cuál es el
+    portal: se conservan los dos y numero_portal no da ninguno.
+    """
+    tokens = texto_clave(_PISO_RE.sub(r"\1 PISO \2", clean_text(calle).upper())).split()
+    if not tokens:
+        return ""
+
+    # Portal delante del tipo de vía: '49 CL MAYOR' → 'CL MAYOR 49'
+    if len(tokens) > 1 and _es_numero(tokens[0]) and tokens[1] in _TIPO_CANONICO:
+        tokens = tokens[1:] + tokens[:1]
+
+    if tokens[0] in _TIPO_CANONICO:
+        tokens[0] = _TIPO_CANONICO[tokens[0]]
+
+    # S/N → SN; sin marcas de número ('Nº 5' → '5')
+    limpios = []
+    i = 0
+    while i < len(tokens):
+        if tokens[i] == "S" and i + 1 < len(tokens) and tokens[i + 1] == "N":
+            limpios.append("SN")
+            i += 2
+            continue
+        if tokens[i] in _MARCAS_NUMERO and i + 1 < len(tokens) and _es_numero(tokens[i + 1]):
+            i += 1
+            continue
+        limpios.append(tokens[i])
+        i += 1
+
+    portal = next(
+        (h for h in range(1, len(limpios))
+         if (_es_numero(limpios[h]) or limpios[h] == "SN") and all(_tras_portal(t) for t in limpios[h + 1:])),
+        None,
+    )
+    nombre = limpios if portal is None else limpios[:portal]
+    nombre = [t for j, t in enumerate(nombre) if not (j > 0 and t in _ARTICULOS)]
+    if portal is None:
+        return " ".join(nombre)
+
+    numeros = [limpios[portal]]
+    resto = limpios[portal + 1:]
+    if resto and _es_numero(resto[0]):
+        numeros += [t for t in resto if _es_numero(t)]
+    return " ".join(nombre + [n if n == "SN" else (n.lstrip("0") or "0") for n in numeros])
+
+
+def clave_canonica(direccion) -> str:
+    """
+    Clave de caché de una dirección: 'CALLE|CP|MUNICIPIO|PROVINCIA'.
+    Entiende el formato de direccion_completa ('DIR, [CP ]POB, PROV, ESPAÑA');
+    cualquier otro texto se trata entero como calle. Expande el tipo de vía,
+    quita tildes y puntuación, descarta artículos, marcas de número, piso y
+    puerta, deja el nombre en su orden con el portal al final (_calle_canonica)
+    y el C.P. siempre en la misma posición.
+    """
+    if direccion is None or pd.isna(direccion):
+        return ""
+    partes = [p.strip() for p in str(direccion).split(",")]
+
+    if len(partes) >= 4 and texto_clave(partes[-1]) == "ESPANA":
+        calle = ", ".join(partes[:-3])
+        poblacion = partes[-3]
+        provincia = texto_clave(partes[-2])
+    else:
+        calle = ", ".join(partes)
+        poblacion = ""
+        provincia = ""
+
+    cp = ""
+    m = _CP_RE.search(poblacion)
+    if m:
+        cp = m.group(1)
+        poblacion = poblacion[:m.start()] + poblacion[m.end():]
+    else:
+        m = _CP_RE.search(calle)
+        if m:
+            cp = m.group(1)
+            calle = calle[:m.start()] + calle[m.end():]
+
+    calle = _calle_canonica(calle)
+    if not calle and not poblacion.strip():
+        return ""
+    return f"{calle}|{cp}|{texto_clave(poblacion)}|{provincia}"
+
+
+def partes_clave(clave: str) -> tuple:
+    """(calle, cp, municipio, provincia) de una clave canónica."""
+    partes = (clave or "").split("|")
+    partes += [""] * (4 - len(partes))
+    return tuple(partes[:4])
+
+
+def calle_canonica_vigente(calle: str) -> bool:
+    """
+    Si una calle de una clave anterior al formato actual se puede conservar:
+    el formato anterior pasaba todos los números al final y dejaba piso y
+    puerta, así que solo valen las que no cambian al recalcularlas y tienen
+    como mucho un número y ningún token de piso o puerta.
+    """
+    tokens = calle.split()
+    return (
+        _calle_canonica(calle) == calle
+        and sum(_es_numero(t) for t in tokens) <= 1
+        and not any((len(t) == 1 and t.isalpha()) or t in _PISO_PUERTA for t in tokens)
+    )
+
+
+def calle_base(calle: str) -> str:
+    """Calle canónica sin el número de portal ('CALLE MAYOR 12' → 'CALLE MAYOR')."""
+    tokens = calle.split()
+    if len(tokens) > 1 and (_es_numero(tokens[-1]) or tokens[-1] == "SN"):
+        tokens.pop()
+    return " ".join(tokens)
+
+
+def numero_portal(calle: str) -> int | None:
+    """
+    Número de portal de una calle canónica ('CALLE MAYOR 12B' → 12) o None;
+    también None si el nombre acaba en número ('CALLE 1 5'): no se distingue.
+    """
+    tokens = calle.split()
+    if len(tokens) < 2 or not _es_numero(tokens[-1]) or _es_numero(tokens[-2]):
+        return None
+    return int(tokens[-1].rstrip("ABCDEFGHIJKLMNOPQRSTUVWXYZ"))
+
+
+def separar_tipo_via(calle: str) -> tuple:
+    """
+    (tipo canónico o None, nombre sin artículos) de una calle sin número:
+    'C/ DE LA FONT' → ('CALLE', 'FONT').
+    """
+    tokens = texto_clave(calle).split()
+    tipo = tipo_via(tokens[0]) if tokens else None
+    if tipo is not None:
+        tokens = tokens[1:]
+    return tipo, " ".join(t for t in tokens if t not in _ARTICULOS)
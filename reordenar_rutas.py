@@ -2,8 +2,10 @@
 # -*- coding: utf-8 -*-
 
 from pathlib import Path
-from geocodificador import geocodificar
-from openpyxl.styles import PatternFill
+from geocodificador import (
+    direccion_completa, generacion_cache, geocodificar_lote, registrar_rechazos, resultados_degradados,
+    vaciar_escrituras,
+)
 import pandas as pd
 import re
 import googlemaps
@@ -12,7 +14,17 @@ import datetime
 import barcode
 from barcode.writer import ImageWriter
 from openpyxl.drawing.image import Image as XLImage
+from openpyxl.utils import get_column_letter, quote_sheetname
 import io
+import hashlib
+import json
+import threading
+
+from cache_resultados import (
+    clave_resultado, guardar as guardar_en_cache, guardar_objeto, recuperar as recuperar_de_cache, recuperar_objeto,
+)
+from instantanea import Registro, guardar_libro, huella_fichero, instantanea_de, leer_libro, tabla_leida
+from salida_excel import HojaSalida, escribir_como_to_excel, filas_to_excel, nuevo_libro, valor_leido
 
 #-----------------------------------------------------
 # FUNCION PARA GENERAR CÓDIGO DE BARRAS
@@ -59,6 +71,50 @@ COLUMNAS_OBLIGATORIAS = [
     "N. servicio",
 ]
 
+# -------------------------------------------------
+# TIPOS COMPACTOS
+# -------------------------------------------------
+
+# Columnas de texto muy repetidas: category solo si hay como mucho un valor
+# distinto por cada dos filas (si no, ocupa más que el texto)
+COLUMNAS_CATEGORICAS = [
+    "Población", "Z.Rep", "C.P.", "Cliente", "N. servicio", "Hospital",
+    "Consignatario", "Remitente", "Dirección", "Dir. entrega", "Clave_parada",
+    "Compromiso", "Prio.", "B.Doc", "Btos.", "Obs.", "F.Max.Ent", "F.Teo.Entr.",
+]
+
+COLUMNAS_DECIMALES = ["Latitud", "Longitud", "Kgs"]
+
+
+def tipos_numericos(df):
+    """
+    Pasa a float64 las columnas decimales (en el sitio) y Bultos a int32 si son
+    todo enteros. Una columna con algún valor no numérico se deja como está.
+    """
+    for col in COLUMNAS_DECIMALES:
+        if col not in df.columns or df[col].dtype == "float64":
+            continue
+        valores = pd.to_numeric(df[col], errors="coerce")
+        if valores.notna().sum() == df[col].notna().sum():
+            df[col] = valores.astype("float64")
+
+    if "Bultos" in df.columns and df["Bultos"].dtype != "int32":
+        valores = pd.to_numeric(df["Bultos"], errors="coerce")
+        if valores.notna().all() and (valores % 1 == 0).all() and (valores.abs() < 2 ** 31).all():
+            df["Bultos"] = valores.astype("int32")
+    return df
+
+
+def compactar_tipos(df):
+    """Tipos numéricos (tipos_numericos) y category en las columnas repetitivas, en el sitio."""
+    tipos_numericos(df)
+    for col in COLUMNAS_CATEGORICAS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            if df[col].nunique(dropna=False) * 2 <= len(df):
+                df[col] = df[col].astype("category")
+    return df
+
+
 # -------------------------------------------------
 # NORMALIZAR TEXTO
 # -------------------------------------------------
@@ -310,6 +366,22 @@ def cargar_referencia_cp(delegacion: str) -> dict:
 # ORDENACIÓN CON ROUTES API
 # -------------------------------------------------
 
+# Tramos que no pudo ordenar la Routes API (error o sin resultado) desde que
+# arrancó el proceso: si sube durante una ordenación, no se guarda en la caché
+_RESPALDOS = {"rutas": 0}
+_LOCK_RESPALDOS = threading.Lock()
+
+
+def _respaldo():
+    with _LOCK_RESPALDOS:
+        _RESPALDOS["rutas"] += 1
+
+
+def respaldos_rutas() -> int:
+    with _LOCK_RESPALDOS:
+        return _RESPALDOS["rutas"]
+
+
 def ordenar_segmento_api(origen, waypoints_coords, api_key, circuito_cerrado=True):
     try:
         url = "https://routes.googleapis.com/directions/v2:computeRoutes"
@@ -353,6 +425,7 @@ def ordenar_segmento_api(origen, waypoints_coords, api_key, circuito_cerrado=Tru
             return orden
         else:
             print(f"DEBUG Routes API sin resultado: {data}")
+            _respaldo()
 
     except Exception as e:
         print(f"DEBUG Error Routes API: {e}")
@@ -404,7 +477,7 @@ def ordenar_en_bloques(origen, waypoints, api_key, MAX_WAYPOINTS=25, circuito_ce
             try:
                 return ordenar_segmento_api(origen, waypoints, api_key, circuito_cerrado=circuito_cerrado)
             except Exception:
-                pass
+                _respaldo()
         return ordenar_euclidiano(origen, waypoints)
 
     # Pre-ordenar con euclídeo para agrupar puntos cercanos
@@ -420,6 +493,7 @@ def ordenar_en_bloques(origen, waypoints, api_key, MAX_WAYPOINTS=25, circuito_ce
             try:
                 ord_sub = ordenar_segmento_api(orig_actual, sub, api_key, circuito_cerrado=circuito_cerrado)
             except Exception:
+                _respaldo()
                 ord_sub = ordenar_euclidiano(orig_actual, sub)
         else:
             ord_sub = list(range(len(sub)))
@@ -447,38 +521,44 @@ def ordenar_dataframe_zrep(df, coords, lat_origen, lon_origen, api_key="", deleg
         df["Latitud"] = None
     if "Longitud" not in df.columns:
         df["Longitud"] = None
+    tipos_numericos(df)
 
     # -------------------------------------------------
     # GEOCODIFICACIÓN (solo filas sin coordenadas)
     # -------------------------------------------------
+    provincia = "VALENCIA" if delegacion == "valencia" else "CASTELLON"
+    direcciones = {}
     for idx, row in df.iterrows():
         # Reutilizar coordenadas existentes sin llamar a la API
+        if pd.notna(row["Latitud"]) and pd.notna(row["Longitud"]):
+            continue
+        # Sin api_key se usan la caché y el resolutor local
+        d = direccion_completa(row["Dirección"], row.get("C.P.", ""), row["Población"], provincia)
+        if d is not None:
+            direcciones[idx] = d
+    coords_api = geocodificar_lote(direcciones.values(), api_key, con_precision=True, delegacion=delegacion) if direcciones else {}
+    rechazadas = set()
+
+    for idx, row in df.iterrows():
         if pd.notna(row["Latitud"]) and pd.notna(row["Longitud"]):
             continue
 
         pueblo_norm = normalizar_texto(row["Población"])
-        cp = str(row.get('C.P.', '')).strip()
         lat, lon = (None, None)
 
-        if api_key:
-            dir_limpia = str(row['Dirección']).strip()
-            pob_limpia = str(row['Población']).strip()
-            if dir_limpia.upper() not in ("NAN", "NONE", "") and pob_limpia.upper() not in ("NAN", "NONE", ""):
-                provincia = "VALENCIA" if delegacion == "valencia" else "CASTELLON"
-                if cp.upper() not in ("NAN", "NONE", ""):
-                    direccion_completa = f"{dir_limpia}, {cp} {pob_limpia}, {provincia}, ESPAÑA"
-                else:
-                    direccion_completa = f"{dir_limpia}, {pob_limpia}, {provincia}, ESPAÑA"
-                lat, lon = geocodificar(direccion_completa, api_key)
-
-                # Validar proximidad al municipio esperado
-                if lat is not None and lon is not None:
-                    coords_ref = buscar_coords_referencia(pueblo_norm, coords)
-                    if coords_ref is not None:
-                        lat_ref, lon_ref = coords_ref
-                        distancia_ref = ((lat - lat_ref) ** 2 + (lon - lon_ref) ** 2) ** 0.5
-                        if distancia_ref > 0.1:
-                            lat, lon = None, None
+        if idx in direcciones:
+            lat, lon, precision = coords_api[direcciones[idx]]
+
+            # Validar proximidad al municipio esperado
+            if lat is not None and lon is not None:
+                coords_ref = buscar_coords_referencia(pueblo_norm, coords)
+                if coords_ref is not None:
+                    lat_ref, lon_ref = coords_ref
+                    distancia_ref = ((lat - lat_ref) ** 2 + (lon - lon_ref) ** 2) ** 0.5
+                    if distancia_ref > 0.1:
+                        if precision == "exacta":
+                            rechazadas.add(direcciones[idx])
+                        lat, lon = None, None
 
         # Fallback: coordenadas del municipio
         if (lat is None or lon is None):
@@ -490,6 +570,9 @@ def ordenar_dataframe_zrep(df, coords, lat_origen, lon_origen, api_key="", deleg
             df.at[idx, "Latitud"] = lat
             df.at[idx, "Longitud"] = lon
 
+    if rechazadas:
+        registrar_rechazos(rechazadas)
+
     # -------------------------------------------------
     # SEPARAR FILAS CON Y SIN COORDENADAS
     # -------------------------------------------------
@@ -622,6 +705,163 @@ def ordenar_dataframe_zrep(df, coords, lat_origen, lon_origen, api_key="", deleg
 # FUNCIÓN PRINCIPAL
 # -------------------------------------------------
 
+# -------------------------------------------------
+# EXCEL DE SALIDA
+# -------------------------------------------------
+
+ANCHOS_COLUMNA = {"Exp": 15, "Población": 20, "Dirección": 40, "Consignatario": 35}
+
+
+def escribir_hoja_navegacion(wb, nombre: str, df: pd.DataFrame, datos: dict, codigos: dict | None = None) -> dict:
+    """
+    Hoja ordenada en una sola pasada: filas de navegación (ruta completa y
+    segmentos), cabecera, filas con número impar en la columna B en azul claro
+    y código de barras de cada Exp en la columna siguiente a la última.
+    `codigos` {Exp: PNG} ya generados se reutilizan; devuelve los de la hoja.
+    """
+    codigos = codigos or {}
+    usados = {}
+    segmentos = datos["segmentos"]
+    n_nav = len(segmentos) + 1
+
+    filas = filas_to_excel(df)
+    cabecera, formatos_cabecera = next(filas)
+
+    # Las filas de navegación llegan a la columna P: la hoja ocupa al menos 16 columnas
+    n_cols = max(len(cabecera), 16)
+    col_barcode = n_cols + 1
+    col_exp = cabecera.index("Exp") + 1 if "Exp" in cabecera else None
+
+    anchos = {col_barcode: 16}
+    for j, h in enumerate(cabecera, start=1):
+        if h in ANCHOS_COLUMNA:
+            anchos[j] = ANCHOS_COLUMNA[h]
+    hoja = HojaSalida(wb, nombre, anchos=anchos)
+
+    # Navegación; botón de regreso en la última fila
+    enlaces = [("RUTA COMPLETA", datos["link_completo"])]
+    enlaces += [(f"SEGMENTO {i + 1}", link) for i, link in enumerate(segmentos)]
+    for fila_nav, (texto, link) in enumerate(enlaces, start=1):
+        volver = f"#{quote_sheetname('RESUMEN_UNICO')}!A1" if fila_nav == 1 else None
+        fila = [hoja.celda(texto, enlace=volver), hoja.celda(link, "enlace")]
+        if fila_nav == n_nav:
+            fila.append(hoja.celda(None, "oculto_negrita"))
+        hoja.fila(fila)
+
+    relleno = [None] * (n_cols - len(cabecera))
+    hoja.fila(cabecera + relleno + ["Barcode"], formatos=formatos_cabecera)
+
+    for i, (valores, formatos) in enumerate(filas):
+        valores = valores + relleno
+        formatos = formatos + relleno
+        if i == 0:
+            # Sin la ruta Google Maps de la primera fila
+            valores[14] = None
+
+        estilo = None
+        try:
+            if int(valor_leido(valores[1])) % 2 != 0:
+                estilo = "fila_impar"
+        except (TypeError, ValueError):
+            pass
+
+        img = None
+        exp_val = valor_leido(valores[col_exp - 1]) if col_exp else None
+        if exp_val:
+            try:
+                codigo = str(exp_val)
+                png = codigos.get(codigo)
+                if png is None:
+                    png = generar_barcode_imagen(codigo).getvalue()
+                usados[codigo] = png
+                img = XLImage(io.BytesIO(png))
+                img.width = 120
+                img.height = 35
+            except Exception:
+                img = None
+
+        hoja.fila(valores, estilo, formatos, alto=28 if img else None)
+        if img:
+            hoja.imagen(img, f"{get_column_letter(col_barcode)}{hoja.filas}")
+
+    return usados
+
+
+# -------------------------------------------------
+# HOJAS ORDENADAS
+# -------------------------------------------------
+
+# Umbral (grados) para que dos filas cuenten como la misma parada
+UMBRAL_PARADA = 0.0009
+
+
+def hoja_a_ordenar(nombre: str) -> bool:
+    return nombre.startswith("ZREP_") or nombre in ("HOSPITALES", "FEDERACION")
+
+
+def ordenar_hoja(df, coords, lat_origen, lon_origen, api_key="", delegacion="castellon", hora_salida=None):
+    """Filas de la hoja en orden de ruta, con NAVEGACIÓN y el número de parada en lugar de Hospital."""
+    df_ordenado = ordenar_dataframe_zrep(
+        df,
+        coords,
+        lat_origen,
+        lon_origen,
+        api_key=api_key,
+        delegacion=delegacion,
+        hora_salida=hora_salida,
+    )
+
+    df_ordenado["NAVEGACIÓN"] = ""
+
+    # Asignar número de parada por proximidad
+    numeros_parada = []
+    paradas_unicas = []
+
+    for _, row in df_ordenado.iterrows():
+        lat = row.get("Latitud")
+        lon = row.get("Longitud")
+        if lat is not None and lon is not None and pd.notna(lat) and pd.notna(lon):
+            asignada = False
+            for num, p in enumerate(paradas_unicas, 1):
+                if abs(float(lat) - p[0]) <= UMBRAL_PARADA and abs(float(lon) - p[1]) <= UMBRAL_PARADA:
+                    numeros_parada.append(num)
+                    asignada = True
+                    break
+            if not asignada:
+                paradas_unicas.append((float(lat), float(lon)))
+                numeros_parada.append(len(paradas_unicas))
+        else:
+            numeros_parada.append("")
+
+    df_ordenado = df_ordenado.rename(columns={"Hospital": "Parada"})
+    df_ordenado["Parada"] = numeros_parada
+    return compactar_tipos(df_ordenado)
+
+
+def navegacion_hoja(df, lat_origen, lon_origen) -> dict | None:
+    """Enlaces de Google Maps de la hoja ordenada: ruta completa y segmentos."""
+    if "Latitud" not in df.columns or "Longitud" not in df.columns:
+        return None
+    return {
+        "link_completo": generar_link_pueblos(df, lat_origen, lon_origen),
+        "segmentos": generar_links_segmentos(df, lat_origen, lon_origen),
+    }
+
+
+def _incidencias() -> tuple:
+    """
+    (direcciones sin resultado exacto, tramos sin la Routes API) acumulados en
+    el proceso: si cambian durante una ordenación, su resultado no es definitivo.
+    """
+    return resultados_degradados(), respaldos_rutas()
+
+
+def huella_hoja(df: pd.DataFrame) -> str:
+    """Huella del contenido de una hoja leída: columnas, tipos y valores, en su orden."""
+    contenido = [[str(c) for c in df.columns], [str(t) for t in df.dtypes], df.to_numpy().tolist()]
+    return hashlib.sha256(json.dumps(contenido, ensure_ascii=False, default=repr).encode("utf-8")).hexdigest()
+
+
 def reordenar_excel(
     input_path: Path,
     output_path: Path,
@@ -631,70 +871,75 @@ def reordenar_excel(
     api_key: str = "",
     delegacion: str = "castellon",
     hora_salida=None,
+    cache: bool = False,
 ):
+    """
+    Ordena las hojas ZREP_, HOSPITALES y FEDERACION del Excel y escribe el
+    libro con navegación y códigos de barras. Devuelve las paradas por hoja.
+    Con `cache`, un Excel idéntico con los mismos parámetros y la misma
+    generación de la caché de geocodificación recupera la salida guardada en
+    cache_resultados sin geocodificar ni llamar a la API de rutas (solo se
+    guardan las ejecuciones sin respaldos de geocodificación ni de rutas),
+    y si cambió, solo se ordenan de nuevo las hojas cuyas filas cambiaron
+    (se guardan las hojas que ordenó la Routes API sin respaldos).
+    """
+    output_path = Path(output_path)
+    clave = None
+    if cache:
+        clave = clave_resultado(
+            "fase3",
+            {"entrada": input_path, "coordenadas": ruta_coordenadas},
+            {"salida": output_path.name, "origen": [lat_origen, lon_origen], "api": bool(api_key),
+             "delegacion": delegacion, "hora_salida": hora_salida, "geocache": generacion_cache()},
+        )
+        datos = recuperar_de_cache(clave, output_path.parent)
+        if datos is not None:
+            return datos["paradas_por_hoja"]
 
-    hojas_raw = pd.read_excel(input_path, sheet_name=None, header=None)
-    # La fila de cabecera real puede estar en la fila 0 (sin "← RESUMEN") o en la fila 1
-    # (cuando add_resumen_unico insertó "← RESUMEN" en la fila 1 del Excel)
-    hojas = {}
-    for nombre, df in hojas_raw.items():
-        if df.empty:
-            hojas[nombre] = df
-            continue
-        primera = str(df.iloc[0, 0]).strip() if df.iloc[0, 0] is not None else ""
-        if primera == "← RESUMEN":
-            # Cabeceras reales en la fila 1, datos desde la fila 2
-            df.columns = df.iloc[1]
-            df = df.iloc[2:].reset_index(drop=True)
-        else:
-            # Cabeceras en la fila 0
-            df.columns = df.iloc[0]
-            df = df.iloc[1:].reset_index(drop=True)
-        hojas[nombre] = df
+    incidencias = _incidencias()
+
+    # De la instantánea del Excel si la hay; cabecera tras "← RESUMEN" o las filas de navegación
+    hojas = {nombre: tabla_leida(hoja) for nombre, hoja in leer_libro(input_path).items()}
     coords = cargar_coordenadas(ruta_coordenadas)
     hojas_resultado = {}
 
+    # Con `cache`, cada hoja con las mismas filas que en una ejecución anterior
+    # (p. ej. las que no tocó un ajuste de la Fase 2) recupera su orden,
+    # enlaces y códigos de barras; solo se ordenan de nuevo las que cambiaron
+    base_hoja = None
+    if cache:
+        base_hoja = {"coordenadas": huella_fichero(ruta_coordenadas), "origen": [lat_origen, lon_origen],
+                     "api": bool(api_key), "delegacion": delegacion, "hora_salida": hora_salida,
+                     "geocache": generacion_cache()}
+    guardadas = {}
+    nuevas = {}
+
     for nombre, df in hojas.items():
 
-        if nombre.startswith("ZREP_") or nombre in ("HOSPITALES", "FEDERACION"):
-            df_ordenado = ordenar_dataframe_zrep(
-                df,
-                coords,
-                lat_origen,
-                lon_origen,
-                api_key=api_key,
-                delegacion=delegacion,
-                hora_salida=hora_salida,
-            )
-
-            link = generar_link_pueblos(df_ordenado, lat_origen, lon_origen)
-
-            df_ordenado["NAVEGACIÓN"] = ""
-
-            # Asignar número de parada por proximidad
-            UMBRAL = 0.0009
-            numeros_parada = []
-            paradas_unicas = []
-
-            for _, row in df_ordenado.iterrows():
-                lat = row.get("Latitud")
-                lon = row.get("Longitud")
-                if lat is not None and lon is not None and pd.notna(lat) and pd.notna(lon):
-                    asignada = False
-                    for num, p in enumerate(paradas_unicas, 1):
-                        if abs(float(lat) - p[0]) <= UMBRAL and abs(float(lon) - p[1]) <= UMBRAL:
-                            numeros_parada.append(num)
-                            asignada = True
-                            break
-                    if not asignada:
-                        paradas_unicas.append((float(lat), float(lon)))
-                        numeros_parada.append(len(paradas_unicas))
-                else:
-                    numeros_parada.append("")
-
-            df_ordenado = df_ordenado.rename(columns={"Hospital": "Parada"})
-            df_ordenado["Parada"] = numeros_parada
-            hojas_resultado[nombre] = df_ordenado
+        if hoja_a_ordenar(nombre):
+            clave_hoja = guardada = None
+            if base_hoja is not None:
+                clave_hoja = clave_resultado("fase3_hoja", {}, {**base_hoja, "hoja": huella_hoja(df)})
+                guardada = recuperar_objeto(clave_hoja)
+            if guardada is None:
+                antes = _incidencias()
+                df_ordenado = ordenar_hoja(
+                    df,
+                    coords,
+                    lat_origen,
+                    lon_origen,
+                    api_key=api_key,
+                    delegacion=delegacion,
+                    hora_salida=hora_salida,
+                )
+                guardada = {"df": df_ordenado, "navegacion": navegacion_hoja(df_ordenado, lat_origen, lon_origen),
+                            "codigos": {}}
+                # Solo órdenes de la Routes API sin respaldos: la entrada vale para
+                # cualquier libro posterior con esta hoja y propagaría el fallo
+                if clave_hoja is not None and api_key and _incidencias() == antes:
+                    nuevas[nombre] = clave_hoja
+            guardadas[nombre] = guardada
+            hojas_resultado[nombre] = guardada["df"]
 
         else:
             hojas_resultado[nombre] = df
@@ -708,130 +953,44 @@ def reordenar_excel(
         df_res["Paradas"] = df_res["Clave"].map(paradas_por_hoja).fillna(df_res["Paradas"])
         hojas_resultado["RESUMEN_UNICO"] = df_res
 
-    # Construir enlaces de navegación por hoja
-    hojas_navegacion = {}
-    for nombre, df in hojas_resultado.items():
-        if not nombre.startswith("ZREP_") and nombre not in ("HOSPITALES", "FEDERACION"):
-            continue
-        if "Latitud" not in df.columns or "Longitud" not in df.columns:
-            continue
-        link_completo = generar_link_pueblos(df, lat_origen, lon_origen)
-        segmentos = generar_links_segmentos(df, lat_origen, lon_origen)
-        hojas_navegacion[nombre] = {
-            "link_completo": link_completo,
-            "segmentos": segmentos
-        }
+    # Códigos de barras ya generados: también para las Exp que cambiaron de hoja
+    codigos = {}
+    for guardada in guardadas.values():
+        codigos.update(guardada["codigos"])
 
     ORDEN_COLS = ["Parada", "Exp", "Ref.", "Consignatario", "C.P.", "Dirección", "Población", "Bultos", "Kgs"]
 
-    with pd.ExcelWriter(output_path, engine="openpyxl") as writer:
-        for nombre, df in hojas_resultado.items():
-            cols_ordenadas = [c for c in ORDEN_COLS if c in df.columns]
-            cols_resto = [c for c in df.columns if c not in cols_ordenadas and c != "Barcode"]
-            cols_final = ["Barcode"] if "Barcode" in df.columns else []
-            df = df[cols_ordenadas + cols_resto + cols_final]
-            df.to_excel(writer, sheet_name=nombre, index=False)
-
-    # Añadir filas de navegación al principio de cada hoja
-    from openpyxl import load_workbook
-    from openpyxl.styles import Font
-    from openpyxl.utils import quote_sheetname, get_column_letter
-
-    wb = load_workbook(output_path)
-
-    for nombre, datos in hojas_navegacion.items():
-        if nombre not in wb.sheetnames:
-            continue
-        ws = wb[nombre]
-        ws.insert_rows(1, amount=len(datos["segmentos"]) + 1)
-        ws.cell(row=1, column=1).value = "RUTA COMPLETA"
-        ws.cell(row=1, column=1).hyperlink = f"#{quote_sheetname('RESUMEN_UNICO')}!A1"
-        ws.cell(row=1, column=2).value = datos["link_completo"]
-        ws.cell(row=1, column=2).font = Font(color="0000FF", underline="single")
-        for i, link in enumerate(datos["segmentos"]):
-            ws.cell(row=2 + i, column=1).value = f"SEGMENTO {i + 1}"
-            ws.cell(row=2 + i, column=2).value = link
-            ws.cell(row=2 + i, column=2).font = Font(color="0000FF", underline="single")
-
-        # Botón de regreso en la última fila de navegación
-        ultima_fila_nav = 1 + len(datos["segmentos"])
-        cell_back = ws.cell(row=ultima_fila_nav, column=3)
-        cell_back.font = Font(color="FFFFFF", bold=True)
-
-        # Eliminar hipervínculos en P1 y C2
-        ws["P1"].hyperlink = None
-        ws["C2"].hyperlink = None
-
-        # Eliminar contenido de N4 (ruta Google Maps)
-        ws.cell(row=len(datos["segmentos"]) + 3, column=15).value = None
-
-    azul_claro = PatternFill(start_color="DDEEFF", end_color="DDEEFF", fill_type="solid")
-
-    for nombre in hojas_navegacion.keys():
-        if nombre not in wb.sheetnames:
-            continue
-        ws = wb[nombre]
-        n_nav = len(hojas_navegacion[nombre]["segmentos"]) + 1
-
-        for row in ws.iter_rows(min_row=n_nav + 2):
-            valor_parada = row[1].value
-            try:
-                if int(valor_parada) % 2 != 0:
-                    for cell in row:
-                        cell.fill = azul_claro
-            except (TypeError, ValueError):
-                pass
-
-    # ── Códigos de barras ──
-    for nombre in hojas_navegacion.keys():
-        if nombre not in wb.sheetnames:
-            continue
-        ws = wb[nombre]
-        n_nav = len(hojas_navegacion[nombre]["segmentos"]) + 1
-
-        # Añadir columna Barcode al final
-        col_barcode = ws.max_column + 1
-        ws.cell(row=n_nav + 1, column=col_barcode).value = "Barcode"
-        ws.column_dimensions[get_column_letter(col_barcode)].width = 16
-
-        # Buscar columna "Exp"
-        col_exp = None
-        for cell in ws[n_nav + 1]:
-            if cell.value == "Exp":
-                col_exp = cell.column
-                break
+    wb = nuevo_libro(registro=Registro(output_path))
+    for nombre, df in hojas_resultado.items():
+        cols_ordenadas = [c for c in ORDEN_COLS if c in df.columns]
+        cols_resto = [c for c in df.columns if c not in cols_ordenadas and c != "Barcode"]
+        cols_final = ["Barcode"] if "Barcode" in df.columns else []
+        df = df[cols_ordenadas + cols_resto + cols_final]
+        navegacion = guardadas[nombre]["navegacion"] if nombre in guardadas else None
+        if navegacion is not None:
+            usados = escribir_hoja_navegacion(wb, nombre, df, navegacion, codigos)
+            if nombre in nuevas:
+                guardadas[nombre]["codigos"] = usados
+        else:
+            escribir_como_to_excel(wb, nombre, df)
 
-        if col_exp is None:
-            continue
+    guardar_libro(wb, output_path)
+    # Fin de la fase: lo geocodificado, confirmado para los demás procesos
+    vaciar_escrituras()
 
-        for row_idx in range(n_nav + 2, ws.max_row + 1):
-            exp_val = ws.cell(row=row_idx, column=col_exp).value
-            if not exp_val:
-                continue
-            try:
-                img_buffer = generar_barcode_imagen(str(exp_val))
-                img = XLImage(img_buffer)
-                img.width = 120
-                img.height = 35
-                ws.row_dimensions[row_idx].height = 28
-                from openpyxl.utils import get_column_letter
-                anchor = f"{get_column_letter(col_barcode)}{row_idx}"
-                ws.add_image(img, anchor)
-            except Exception:
-                pass
+    for nombre, clave_hoja in nuevas.items():
+        guardar_objeto(clave_hoja, guardadas[nombre])
 
-    # ── Anchos de columna ──
-    ANCHOS_COLUMNA = {"Exp": 15, "Población": 20, "Dirección": 40, "Consignatario": 35}
-    for nombre in hojas_navegacion.keys():
-        if nombre not in wb.sheetnames:
-            continue
-        ws = wb[nombre]
-        n_nav = len(hojas_navegacion[nombre]["segmentos"]) + 1
-        for cell in ws[n_nav + 1]:
-            if cell.value in ANCHOS_COLUMNA:
-                ws.column_dimensions[get_column_letter(cell.column)].width = ANCHOS_COLUMNA[cell.value]
+    if clave is not None and _incidencias() != incidencias:
+        print("Aviso: hay direcciones sin resultado exacto o rutas sin la Routes API; "
+              "el resultado no se guarda en la caché")
+    elif clave is not None:
+        ficheros = [output_path.name]
+        instantanea = instantanea_de(output_path)
+        if instantanea is not None:
+            ficheros.append(instantanea.relative_to(output_path.parent).as_posix())
+        guardar_en_cache(clave, output_path.parent, ficheros, {"paradas_por_hoja": paradas_por_hoja})
 
-    wb.save(output_path)
     return paradas_por_hoja
 
 
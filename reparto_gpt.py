@@ -6,111 +6,46 @@ from __future__ import annotations
 import argparse
 import os
 import datetime as _dt
+import pickle
 import re
+import tempfile
+import time
+from functools import lru_cache
 from pathlib import Path
 from typing import List
 
 import pandas as pd
-import difflib
 import json
-from geocodificador import geocodificar
-from reordenar_rutas import cargar_coordenadas, buscar_coords_referencia, normalizar_texto
-# -------------------------
-# CALLEJERO CASTELLÓN
-# -------------------------
-
-CALLES_CASTELLON = []
-
-try:
-    calles_path = Path(__file__).parent / "calles_castellon.csv"
-    if calles_path.exists():
-        df_calles = pd.read_csv(calles_path)
-        if "nombre" in df_calles.columns:
-            CALLES_CASTELLON = (
-                df_calles["nombre"]
-                .astype(str)
-                .str.upper()
-                .unique()
-                .tolist()
-            )
-except Exception:
-    CALLES_CASTELLON = []
-
-
-def corregir_calle_castellon(poblacion: str, direccion: str) -> str:
-
-    if not direccion:
-        return direccion
-
-    if "CASTELL" not in norm(poblacion):
-        return direccion
-
-    if not CALLES_CASTELLON:
-        return direccion
-
-    # separar calle y número
-    m = re.match(r"(.*?)[,\s]+(\d+.*)", direccion)
-    if m:
-        calle = m.group(1)
-        numero = m.group(2)
-    else:
-        calle = direccion
-        numero = ""
-
-    calle_norm = norm(calle)
-
-    # crear mapa normalizado → original
-    mapa = {norm(c): c for c in CALLES_CASTELLON}
-
-    match = difflib.get_close_matches(
-        calle_norm,
-        list(mapa.keys()),
-        n=1,
-        cutoff=0.85
-    )
-
-    if match:
-        calle = mapa[match[0]]
-
-    if numero:
-        return f"{calle} {numero}"
-
-    return calle
+from geocodificador import (
+    direccion_completa, generacion_cache, geocodificar_lote, registrar_rechazos, resultados_degradados,
+)
+from normalizacion import clean_text_serie, norm_serie, por_valores_distintos
+from reordenar_rutas import cargar_coordenadas, buscar_coords_referencia, compactar_tipos, normalizar_texto
+from callejero import corregir_calle
+from lector_csv import avisar_descartadas, leer_csv, leer_csv_por_bloques
+from motor_reglas import cargar_reglas
 
-from openpyxl import Workbook, load_workbook
-from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
-from openpyxl.utils import get_column_letter
-from openpyxl.utils.dataframe import dataframe_to_rows
+from add_resumen_unico import escribir_resumen_unico, fila_volver
+from cache_resultados import clave_resultado, guardar as guardar_en_cache, recuperar as recuperar_de_cache
+from instantanea import Registro, guardar_libro, instantanea_de
+from modulo_valencia_gestores import escribir_libros_gestores
+from salida_excel import HojaSalida, escribir_df, filas_df, nuevo_libro, valor_celda as sanitize_cell
 
 
 # -------------------------
 # UTILIDADES
 # -------------------------
 
-def clean_text(x) -> str:
-    if pd.isna(x):
-        return ""
-    return re.sub(r"\s+", " ", str(x).strip())
-
-
-_ILLEGAL_CHARS_RE = re.compile(
-    r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f]"
-)
-
-def sanitize_cell(x):
-    """Elimina caracteres de control ilegales para openpyxl antes de escribir en Excel."""
-    if x is None or (isinstance(x, float) and pd.isna(x)):
-        return None
-    if isinstance(x, str):
-        return _ILLEGAL_CHARS_RE.sub("", x)
-    return x
+_KG_RE = re.compile(r"[^0-9\.\-]")
+_ENTERO_RE = re.compile(r"[^0-9\-]")
+_CALLE_NUMERO_RE = re.compile(r"(.*?)[,\s]+\d+.*$")
 
 
 def parse_kg(x) -> float:
     if pd.isna(x):
         return 0.0
     s = str(x).replace(",", ".")
-    s = re.sub(r"[^0-9\.\-]", "", s)
+    s = _KG_RE.sub("", s)
     try:
         return float(s)
     except:
@@ -120,112 +55,168 @@ def parse_kg(x) -> float:
 def parse_int(x) -> int:
     if pd.isna(x):
         return 0
-    s = re.sub(r"[^0-9\-]", "", str(x))
+    s = _ENTERO_RE.sub("", str(x))
     try:
         return int(s)
     except:
         return 0
 
 
-def norm(s: str) -> str:
-    s = clean_text(s).upper()
-    trans = str.maketrans({
-        "Á":"A","É":"E","Í":"I","Ó":"O","Ú":"U","Ü":"U","Ñ":"N","Ç":"C",
-    })
-    s = s.translate(trans)
-    s = re.sub(r"[^\w\s]", " ", s)
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
-
 def extraer_calle_sin_numero(direccion: str) -> str:
     """Elimina el número final de una dirección para obtener solo la calle."""
-    m = re.match(r"(.*?)[,\s]+\d+.*$", direccion.strip())
+    m = _CALLE_NUMERO_RE.match(direccion.strip())
     if m:
         return m.group(1).strip()
     return direccion.strip()
-    
-def sheet_to_df(wb, name: str) -> pd.DataFrame:
-    if name not in wb.sheetnames:
-        return pd.DataFrame()
-    ws = wb[name]
-    data = list(ws.values)
-    if not data:
-        return pd.DataFrame()
-    headers = list(data[0])
-    rows = data[1:]
-    return pd.DataFrame(rows, columns=headers)
-
-
-def prepare_rules(df_rules: pd.DataFrame, pob_col: str, pat_col: str) -> pd.DataFrame:
-    if df_rules.empty:
-        return df_rules
-    d = df_rules.copy()
-    d["Pob_norm"] = d[pob_col].astype(str).apply(norm)
-    d["Pat_norm"] = d[pat_col].astype(str).apply(norm)
-    d = d[d["Pat_norm"].ne("")]
-    return d
-
-
-def match_rules(pob_norm: str, dir_norm: str, rules_df: pd.DataFrame, tag_field: str | None = None):
-    for _, r in rules_df.iterrows():
-        if r["Pob_norm"] and r["Pob_norm"] not in pob_norm:
-            continue
-        if r["Pat_norm"] and r["Pat_norm"] in dir_norm:
-            if tag_field:
-                return True, str(r.get(tag_field, "") or "")
-            return True, ""
-    return False, ""
 
 
-def style_sheet(ws):
-    thin = Side(style="thin")
-    border = Border(left=thin, right=thin, top=thin, bottom=thin)
-    header_font = Font(bold=True)
+def _kgs_distintos(s: pd.Series) -> pd.Series:
+    s = s.str.replace(",", ".", regex=False).str.replace(_KG_RE, "", regex=True)
+    kgs = pd.to_numeric(s, errors="coerce").astype(float)
+    # to_numeric solo decide qué es número; el valor, con float() como parse_kg
+    # (con muchos decimales puede diferir en el último bit)
+    validos = kgs.notna()
+    kgs[validos] = s[validos].astype(float)
+    return kgs.fillna(0.0)
+
+
+def _enteros_distintos(s: pd.Series) -> pd.Series:
+    s = s.str.replace(_ENTERO_RE, "", regex=True)
+    return pd.to_numeric(s, errors="coerce").fillna(0).astype(int)
+
+
+def _calles_distintas(s: pd.Series) -> pd.Series:
+    s = s.str.strip()
+    calle = s.str.extract(_CALLE_NUMERO_RE, expand=False)
+    return calle.where(calle.notna(), s).str.strip()
 
-    for cell in ws[1]:
-        cell.font = header_font
-        cell.border = border
 
-    for row in ws.iter_rows(min_row=2):
-        for cell in row:
-            cell.border = border
+def parse_kg_serie(serie: pd.Series) -> pd.Series:
+    """parse_kg sobre toda una columna."""
+    return por_valores_distintos(serie, _kgs_distintos)
 
-    ws.freeze_panes = "A2"
+
+def parse_int_serie(serie: pd.Series) -> pd.Series:
+    """parse_int sobre toda una columna."""
+    return por_valores_distintos(serie, _enteros_distintos)
+
+
+def calle_sin_numero_serie(serie: pd.Series) -> pd.Series:
+    """extraer_calle_sin_numero sobre toda una columna."""
+    return por_valores_distintos(serie, _calles_distintas)
 
 
 # -------------------------
-# CORE
+# LECTURA DE LLEGADAS
 # -------------------------
 
-def run(csv_path: Path, reglas_path: Path, out_path: Path, origen: str, delegacion: str,
-        api_key: str = "", ruta_coordenadas: Path | None = None) -> None:
+COL_MAP = {
+    "N.Exp":    "Exp",
+    "Cod.Pos":  "C.P.",
+    "Domicilio": "Dir. entrega",
+}
 
-    try:
-        df = pd.read_csv(
-            csv_path,
-            sep=";",
-            encoding="utf-8-sig",
-            dtype=str,
-            engine="python",
-            on_bad_lines="skip"
-        )
-    except UnicodeDecodeError:
-        df = pd.read_csv(
-            csv_path,
-            sep=";",
-            encoding="latin-1",
-            dtype=str,
-            engine="python",
-            on_bad_lines="skip"
-        )
-
-    COL_MAP = {
-        "N.Exp":    "Exp",
-        "Cod.Pos":  "C.P.",
-        "Domicilio": "Dir. entrega",
-    }
+
+def leer_llegadas(csv_path: Path) -> pd.DataFrame:
+    """Lee el CSV de llegadas (UTF-8 o Latin-1) y unifica los nombres de columna."""
+    df = leer_csv(csv_path, sep=";")
+    avisar_descartadas(df, Path(csv_path).name)
     df.rename(columns={k: v for k, v in COL_MAP.items() if k in df.columns}, inplace=True)
+    return df
+
+
+def leer_llegadas_por_bloques(csv_path: Path, filas: int):
+    """Como leer_llegadas, en DataFrames de como mucho `filas` filas."""
+    for df in leer_csv_por_bloques(csv_path, filas, sep=";"):
+        avisar_descartadas(df, Path(csv_path).name)
+        df.rename(columns={k: v for k, v in COL_MAP.items() if k in df.columns}, inplace=True)
+        yield df
+
+
+def limpiar_direcciones(df: pd.DataFrame, delegacion: str = "castellon") -> pd.DataFrame:
+    """Rellena Población y Dirección y normaliza la dirección con el callejero de la delegación."""
+    df["Población"] = df["Población"].fillna("")
+    df["Dirección"] = df["Dir. entrega"].fillna("")
+
+    df["Dirección"] = clean_text_serie(df["Dirección"]).str.upper()
+
+    # corregir_calle memoriza cada (población, dirección, C.P., delegación)
+    cps = df["C.P."].fillna("").astype(str) if "C.P." in df.columns else [""] * len(df)
+    df["Dirección"] = [
+        corregir_calle(p, d, cp, delegacion)
+        for p, d, cp in zip(df["Población"], df["Dirección"], cps)
+    ]
+    return df
+
+
+@lru_cache(maxsize=4)
+def _coordenadas_municipios(ruta: str, modificado: int) -> dict:
+    return cargar_coordenadas(ruta)
+
+
+def coordenadas_municipios(ruta: Path) -> dict:
+    """cargar_coordenadas, memorizado mientras el fichero no cambie (procesos de larga vida)."""
+    ruta = Path(ruta)
+    return _coordenadas_municipios(str(ruta), ruta.stat().st_mtime_ns)
+
+
+def direcciones_geocodificables(df: pd.DataFrame, delegacion: str) -> dict:
+    """{índice: dirección completa} de las filas con calle y población."""
+    provincia = "VALENCIA" if delegacion == "valencia" else "CASTELLON"
+    direcciones = {}
+    for idx, row in df.iterrows():
+        d = direccion_completa(row["Dirección"], row.get("C.P.", ""), row["Población"], provincia)
+        if d is not None:
+            direcciones[idx] = d
+    return direcciones
+
+
+# -------------------------
+# CORE
+# -------------------------
+
+def traza_reglas(df: pd.DataFrame, motor_h, motor_f, tiempos: dict) -> dict:
+    """Aciertos por regla, regla aplicada a cada expedición y tiempos por fase."""
+    expediciones = []
+    for exp, rh, rf in zip(df["Exp"], df["Regla_hospital"], df["Regla_federacion"]):
+        if pd.isna(rh) and pd.isna(rf):
+            continue
+        expediciones.append({
+            "Exp": exp,
+            "hospitales": None if pd.isna(rh) else motor_h.nombre_regla(int(rh)),
+            "federacion": None if pd.isna(rf) else motor_f.nombre_regla(int(rf)),
+        })
+    return {
+        "tiempos": {nombre: round(t, 3) for nombre, t in tiempos.items()},
+        "hospitales": motor_h.aciertos(df["Regla_hospital"]),
+        "federacion": motor_f.aciertos(df["Regla_federacion"]),
+        "expediciones": expediciones,
+    }
+
 
+def _resumen_reglas(motor, regla: pd.Series) -> list:
+    """Valores de METADATOS: reglas con y sin aciertos y las que más expediciones clasifican."""
+    aciertos = [a["aciertos"] for a in motor.aciertos(regla)]
+    usadas = sum(1 for a in aciertos if a)
+    top = sorted((i for i, a in enumerate(aciertos) if a), key=lambda i: -aciertos[i])[:5]
+    return [
+        f"{len(motor)} ({usadas} con aciertos, {len(motor) - usadas} sin aciertos)",
+        "; ".join(f"{motor.nombre_regla(i)}: {aciertos[i]}" for i in top) or "—",
+    ]
+
+
+COLUMNAS_BASE = [
+    "Exp", "Ref.", "Hospital", "Población", "Dirección",
+    "Consignatario", "Cliente", "Kgs",
+    "Bultos", "Z.Rep", "N. servicio", "C.P.",
+    "Latitud", "Longitud",
+]
+
+COLUMNAS_EXTRA = ["Remitente", "Tel.Contacto", "ObsClt", "F.Max.Ent", "Compromiso", "Prio.", "B.Doc", "F.Teo.Entr.", "Obs.", "AmpFtiI"]
+
+
+def preparar_llegadas(df: pd.DataFrame) -> pd.DataFrame:
+    """Columnas numéricas y vacías que esperan las fases siguientes."""
     df["Exp"] = df["Exp"].astype(str).str.strip()
 
     if "Kgs" not in df.columns and "K.Doc" in df.columns:
@@ -237,51 +228,34 @@ def run(csv_path: Path, reglas_path: Path, out_path: Path, origen: str, delegaci
         if col not in df.columns:
             df[col] = ""
 
-    df["Kgs"] = df["Kgs"].apply(parse_kg)
+    df["Kgs"] = parse_kg_serie(df["Kgs"])
     if "B.Doc" in df.columns:
-        df["Bultos"] = df["B.Doc"].apply(parse_int)
+        df["Bultos"] = parse_int_serie(df["B.Doc"])
     else:
-        df["Bultos"] = df["Btos."].apply(parse_int)
-    df["Población"] = df["Población"].fillna("")
-    df["Dirección"] = df["Dir. entrega"].fillna("")
+        df["Bultos"] = parse_int_serie(df["Btos."])
     df["Z.Rep"] = df["Z.Rep"].fillna("")
     df["Cliente"] = df.get("Cliente", "")
+    return df
 
-    # --- LIMPIEZA DIRECCIONES ---
-    df["Dirección"] = df["Dirección"].apply(clean_text).str.upper()
-    
-    df["Dirección"] = df.apply(
-        lambda r: corregir_calle_castellon(r["Población"], r["Dirección"]),
-        axis=1
-    )
 
-    # -------------------------
-    # GEOCODIFICACIÓN (Fase 1)
-    # -------------------------
-    df["Latitud"] = None
-    df["Longitud"] = None
+def geocodificar_llegadas(df: pd.DataFrame, delegacion: str, api_key: str, coords_municipios: dict):
+    """Rellena Latitud/Longitud: caché, API y, si no cuadra o no hay, centro del municipio."""
+    df["Latitud"] = float("nan")
+    df["Longitud"] = float("nan")
 
-    coords_municipios = {}
-    if ruta_coordenadas is not None:
-        try:
-            coords_municipios = cargar_coordenadas(ruta_coordenadas)
-        except Exception as e:
-            print(f"Aviso: no se pudo cargar coordenadas de municipios: {e}")
+    # Sin api_key se geocodifica igualmente con la caché y el resolutor local
+    direcciones = direcciones_geocodificables(df, delegacion)
+    coords_api = geocodificar_lote(direcciones.values(), api_key, con_precision=True, delegacion=delegacion) if direcciones else {}
+
+    if coords_api or coords_municipios:
+        rechazadas = set()
 
-    if api_key or coords_municipios:
-        provincia = "VALENCIA" if delegacion == "valencia" else "CASTELLON"
         for idx, row in df.iterrows():
-            dir_limpia = str(row["Dirección"]).strip()
             pob_limpia = str(row["Población"]).strip()
-            cp = str(row.get("C.P.", "") or "").strip()
             lat, lon = None, None
 
-            if api_key and dir_limpia.upper() not in ("NAN", "NONE", "") and pob_limpia.upper() not in ("NAN", "NONE", ""):
-                if cp.upper() not in ("NAN", "NONE", ""):
-                    direccion_completa = f"{dir_limpia}, {cp} {pob_limpia}, {provincia}, ESPAÑA"
-                else:
-                    direccion_completa = f"{dir_limpia}, {pob_limpia}, {provincia}, ESPAÑA"
-                lat, lon = geocodificar(direccion_completa, api_key)
+            if idx in direcciones:
+                lat, lon, precision = coords_api[direcciones[idx]]
 
                 if lat is not None and lon is not None and coords_municipios:
                     pueblo_norm = normalizar_texto(pob_limpia)
@@ -289,6 +263,9 @@ def run(csv_path: Path, reglas_path: Path, out_path: Path, origen: str, delegaci
                     if coords_ref is not None:
                         lat_ref, lon_ref = coords_ref
                         if ((lat - lat_ref) ** 2 + (lon - lon_ref) ** 2) ** 0.5 > 0.1:
+                            # Solo se marcan en caché los resultados de la API
+                            if precision == "exacta":
+                                rechazadas.add(direcciones[idx])
                             lat, lon = None, None
 
             # Fallback a coordenadas del municipio
@@ -302,40 +279,30 @@ def run(csv_path: Path, reglas_path: Path, out_path: Path, origen: str, delegaci
                 df.at[idx, "Latitud"] = lat
                 df.at[idx, "Longitud"] = lon
 
-    # -------------------------
-    # APLICAR REGLAS
-    # -------------------------
-
-    df["Pob_norm"] = df["Población"].apply(norm)
-    df["Dir_norm"] = df["Dirección"].apply(norm)
+        if rechazadas:
+            registrar_rechazos(rechazadas)
 
-    wb_rules = load_workbook(reglas_path, data_only=True)
-    rules_h = sheet_to_df(wb_rules, "REGLAS_HOSPITALES")
-    rules_f = sheet_to_df(wb_rules, "REGLAS_FEDERACION")
 
-    rules_h_prep = prepare_rules(rules_h, "Población", "Patrón_dirección")
-    rules_f_prep = prepare_rules(rules_f, "Población", "Patrón_dirección")
+def clasificar_llegadas(df: pd.DataFrame, motor_h, motor_f) -> pd.DataFrame:
+    """Hospital/federación por reglas y clave de parada (Población|calle sin número)."""
+    pob_norm = norm_serie(df["Población"])
+    dir_norm = norm_serie(df["Dirección"])
 
-    df["is_hospital"] = False
-    df["Hospital"] = ""
+    # Misma semántica que motor_reglas.match_rules (gana la primera regla), en una pasada
+    df["is_hospital"], df["Hospital"], df["Regla_hospital"] = motor_h.clasificar(pob_norm, dir_norm)
+    df["is_fed"], _, df["Regla_federacion"] = motor_f.clasificar(pob_norm, dir_norm)
 
-    for i, r in df.iterrows():
-        ok, tag = match_rules(r["Pob_norm"], r["Dir_norm"], rules_h_prep, "Hospital_final")
-        if ok:
-            df.at[i, "is_hospital"] = True
-            df.at[i, "Hospital"] = tag
+    df["is_any_special"] = df["is_hospital"] | df["is_fed"]
+    # astype(str): sin filas (bloque con solo líneas descartadas) la serie queda object y no se suma a str
+    calle_sin_num = calle_sin_numero_serie(df["Dirección"]).astype(str)
+    df["Clave_parada"] = df["Población"].str.strip().str.upper() + "|" + calle_sin_num.str.upper()
+    return compactar_tipos(df)
 
-    df["is_fed"] = False
-    for i, r in df.iterrows():
-        ok, _ = match_rules(r["Pob_norm"], r["Dir_norm"], rules_f_prep)
-        if ok:
-            df.at[i, "is_fed"] = True
 
-    df["is_any_special"] = df["is_hospital"] | df["is_fed"]
-    df["Calle_sin_num"] = df["Dirección"].apply(extraer_calle_sin_numero)
-    df["Clave_parada"] = df["Población"].str.strip().str.upper() + "|" + df["Calle_sin_num"].str.upper()
-    hosp = df[df["is_hospital"]].copy()
-    fed = df[df["is_fed"]].copy()
+def particiones(df: pd.DataFrame):
+    """(hoja, Z.Rep, filas): HOSPITALES, FEDERACION y una por Z.Rep del resto, por orden de Z.Rep."""
+    yield "HOSPITALES", None, df[df["is_hospital"]]
+    yield "FEDERACION", None, df[df["is_fed"]]
     resto = df[~df["is_any_special"]].copy()
     resto["Z.Rep"] = (
         resto["Z.Rep"]
@@ -343,106 +310,387 @@ def run(csv_path: Path, reglas_path: Path, out_path: Path, origen: str, delegaci
         .str.strip()
         .replace(".", "")
     )
-    
-    # -------------------------
-    # EXCEL
-    # -------------------------
-
-    wb_out = Workbook()
-    wb_out.remove(wb_out.active)
-
-    COLUMNAS_BASE = [
-        "Exp", "Ref.", "Hospital", "Población", "Dirección",
-        "Consignatario", "Cliente", "Kgs",
-        "Bultos", "Z.Rep", "N. servicio", "C.P.",
-        "Latitud", "Longitud",
-    ]
-
-    COLUMNAS_EXTRA = ["Remitente", "Tel.Contacto", "ObsClt", "F.Max.Ent", "Compromiso", "Prio.", "B.Doc", "F.Teo.Entr.", "Obs.", "AmpFtiI"]
-
-    # METADATOS
-    meta = pd.DataFrame({
-        "Clave": ["Delegación", "Origen de datos", "CSV", "Reglas", "Generado"],
+    for z, sub in resto.groupby("Z.Rep"):
+        yield "ZREP", z, sub
+
+
+def nombre_hoja_zrep(z) -> str:
+    z = str(z).strip()
+    if z == ".":
+        z = ""
+    nombre = f"ZREP_{z}"
+    return re.sub(r"[\\/*?:\[\]]", "_", nombre)[:31]
+
+
+def nombre_libre(nombre: str, existentes: set) -> str:
+    """`nombre` o, si ya existe, con sufijo _1, _2… dentro de los 31 caracteres."""
+    base = nombre
+    i = 1
+    while nombre in existentes:
+        sufijo = f"_{i}"
+        nombre = (base[:31 - len(sufijo)] + sufijo)
+        i += 1
+    existentes.add(nombre)
+    return nombre
+
+
+def _metadatos(delegacion, origen, csv_path, reglas_path, motor_h, motor_f, regla_h, regla_f, tiempos) -> pd.DataFrame:
+    return pd.DataFrame({
+        "Clave": [
+            "Delegación", "Origen de datos", "CSV", "Reglas", "Generado",
+            "Reglas hospitales", "Hospitales con más aciertos",
+            "Reglas federación", "Federación con más aciertos",
+        ] + [f"Tiempo {nombre} (s)" for nombre in tiempos],
         "Valor": [
             delegacion,
             origen,
             str(csv_path),
             str(reglas_path),
             _dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        ],
+            *_resumen_reglas(motor_h, regla_h),
+            *_resumen_reglas(motor_f, regla_f),
+        ] + [round(t, 3) for t in tiempos.values()],
     })
 
-    ws_meta = wb_out.create_sheet("METADATOS")
-    for row in dataframe_to_rows(meta, index=False, header=True):
-        ws_meta.append([sanitize_cell(v) for v in row])
-    style_sheet(ws_meta)
 
-    # HOSPITALES
-    cols_out = [c for c in COLUMNAS_BASE + COLUMNAS_EXTRA if c in df.columns]
-    ws_h = wb_out.create_sheet("HOSPITALES")
-    for row in dataframe_to_rows(hosp[cols_out], index=False, header=True):
-        ws_h.append([sanitize_cell(v) for v in row])
-    style_sheet(ws_h)
+class _Particiones:
+    """Filas de cada hoja de salida guardadas en disco bloque a bloque (modo por bloques)."""
+
+    def __init__(self, directorio: Path):
+        self.directorio = directorio
+        self.ficheros = {}
+
+    def anadir(self, clave: tuple, df: pd.DataFrame):
+        if clave not in self.ficheros:
+            self.ficheros[clave] = self.directorio / f"particion_{len(self.ficheros)}.pkl"
+        with open(self.ficheros[clave], "ab") as f:
+            pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def leer(self, clave: tuple, claves_parada: set):
+        """Bloques guardados de la hoja; va añadiendo sus Clave_parada a `claves_parada`."""
+        ruta = self.ficheros.get(clave)
+        if ruta is None:
+            return
+        with open(ruta, "rb") as f:
+            while True:
+                try:
+                    parte = pickle.load(f)
+                except EOFError:
+                    return
+                claves_parada.update(parte["Clave_parada"].dropna())
+                yield parte
+
+
+def _escribir_salida(out_path: Path, meta: pd.DataFrame, hojas: dict, cols_out: list, libro_final: bool):
+    """
+    Escribe el Excel de salida en una pasada. `hojas`: {nombre: bloques()},
+    con bloques() devolviendo los DataFrames de la hoja.
+    Con `libro_final`: RESUMEN_UNICO, METADATOS, ALMACEN (vacía, con la
+    cabecera de las demás) y las hojas con la fila de regreso al resumen.
+    """
+    wb_out = nuevo_libro(registro=Registro(out_path))
+
+    resumidas = set()
+    if libro_final:
+        resumidas = escribir_resumen_unico(wb_out, {nombre: cols_out for nombre in ["ALMACEN", *hojas]})
+
+    escribir_df(wb_out, "METADATOS", meta, list(meta.columns))
+
+    if libro_final:
+        ws = HojaSalida(wb_out, "ALMACEN")
+        if "ALMACEN" in resumidas:
+            fila_volver(ws)
+        ws.fila([sanitize_cell(c) for c in cols_out])
+
+    for nombre, bloques in hojas.items():
+        ws = HojaSalida(wb_out, nombre, congelar="A2")
+        if nombre in resumidas:
+            fila_volver(ws)
+        ws.tabla_df(bloques(), cols_out)
 
-    # FEDERACION
-    ws_f = wb_out.create_sheet("FEDERACION")
-    for row in dataframe_to_rows(fed[cols_out], index=False, header=True):
-        ws_f.append([sanitize_cell(v) for v in row])
-    style_sheet(ws_f)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    guardar_libro(wb_out, out_path)
 
-    # ZREP
-    existing = set(wb_out.sheetnames)
 
-    for z, sub in resto.groupby("Z.Rep"):
+def _libros_gestores(hojas: dict, cols_out: list, asignacion_gestores: Path, carpeta: Path) -> dict:
+    """Libros por gestor con las hojas ZREP_* de la salida, sin volver a leerla."""
+    zonas = {
+        nombre: (cols_out, lambda bloques=bloques: (
+            fila for bloque in bloques() for fila in filas_df(bloque, cols_out)
+        ))
+        for nombre, bloques in hojas.items() if nombre.startswith("ZREP_")
+    }
+    return escribir_libros_gestores(zonas, str(asignacion_gestores), str(carpeta))
+
+
+def _resultado(out_path: Path, expediciones: int, paradas_por_hoja: dict, tiempos: dict, traza: bool,
+               gestores: dict | None = None, desde_cache: bool = False) -> dict:
+    return {
+        "salida": str(out_path),
+        "paradas": str(out_path.with_suffix(".paradas.json")),
+        "traza": str(out_path.with_suffix(".reglas.json")) if traza else None,
+        "expediciones": expediciones,
+        "paradas_por_hoja": paradas_por_hoja,
+        "gestores": gestores,
+        "tiempos": {nombre: round(t, 3) for nombre, t in tiempos.items()},
+        "desde_cache": desde_cache,
+    }
+
+
+def _guardar_en_cache(clave: str, out_path: Path, resultado: dict):
+    """Salida, paradas, traza, libros por gestor e instantánea, con rutas relativas a la carpeta de salida."""
+    carpeta = out_path.parent
+    ficheros = [Path(resultado["salida"]).name, Path(resultado["paradas"]).name]
+    if resultado["traza"]:
+        ficheros.append(Path(resultado["traza"]).name)
+    gestores = resultado["gestores"]
+    if gestores is not None:
+        gestores = {**gestores, "archivos_generados": {
+            gestor: Path(ruta).name for gestor, ruta in gestores["archivos_generados"].items()
+        }}
+        ficheros.extend(gestores["archivos_generados"].values())
+    instantanea = instantanea_de(out_path)
+    if instantanea is not None:
+        ficheros.append(instantanea.relative_to(carpeta).as_posix())
+    datos = {
+        "expediciones": resultado["expediciones"],
+        "paradas_por_hoja": resultado["paradas_por_hoja"],
+        "gestores": gestores,
+    }
+    guardar_en_cache(clave, carpeta, ficheros, datos)
 
-        z = str(z).strip()
-        if z == ".":
-            z = ""
 
-        nombre = f"ZREP_{z}"
-        nombre = re.sub(r"[\\/*?:\[\]]", "_", nombre)[:31]
+def _desde_cache(out_path: Path, datos: dict, traza: bool, segundos: float) -> dict:
+    """Resultado recuperado; en tiempos, lo que tardó la recuperación (no los de la ejecución guardada)."""
+    gestores = datos["gestores"]
+    if gestores is not None:
+        gestores["archivos_generados"] = {
+            gestor: str(out_path.parent / nombre) for gestor, nombre in gestores["archivos_generados"].items()
+        }
+    return _resultado(out_path, datos["expediciones"], datos["paradas_por_hoja"], {"cache": segundos}, traza,
+                      gestores, desde_cache=True)
 
-        base = nombre
-        i = 1
-        while nombre in existing:
-            sufijo = f"_{i}"
-            nombre = (base[:31 - len(sufijo)] + sufijo)
-            i += 1
 
-        existing.add(nombre)
+def run(csv_path: Path, reglas_path: Path, out_path: Path, origen: str, delegacion: str,
+        api_key: str = "", ruta_coordenadas: Path | None = None, traza: bool = False,
+        bloque: int | None = None, libro_final: bool = False,
+        asignacion_gestores: Path | None = None, cache: bool = False) -> dict:
+    """
+    Fase 1 completa. Con `bloque` (filas) el CSV se procesa por bloques: cada
+    bloque se limpia, geocodifica y clasifica, sus filas se guardan en disco
+    por hoja y el Excel se escribe al final, con memoria acotada aunque el
+    fichero sea muy grande. En los dos modos el Excel se escribe por filas
+    (salida_excel).
+
+    Con `libro_final` el Excel sale ya como lo entrega la aplicación: hoja
+    ALMACEN, RESUMEN_UNICO y fila de regreso en cada hoja resumida. Con
+    `asignacion_gestores` (gestor_zonas.xlsx) se escriben además los libros
+    por gestor junto a la salida, con las mismas filas y sin releer el Excel.
+
+    Con `cache`, una petición idéntica (mismos CSV, reglas, coordenadas y
+    asignación de gestores, mismos parámetros, misma generación de la caché
+    de geocodificación y mismo código) copia a la carpeta de salida los ficheros guardados en
+    cache_resultados en lugar de recalcularlos. Solo se guardan las ejecuciones
+    con todas las direcciones resueltas con exactitud (sin errores de la API
+    ni resultados locales).
+
+    Devuelve rutas generadas (salida, paradas, traza), número de expediciones,
+    paradas por hoja, libros por gestor, segundos por fase (o de la recuperación,
+    si viene de la caché) y si viene de la caché.
+    """
+    out_path = Path(out_path)
+
+    if not cache:
+        return _run(csv_path, reglas_path, out_path, origen, delegacion, api_key, ruta_coordenadas,
+                    traza, bloque, libro_final, asignacion_gestores)
+
+    # El tamaño de bloque no cambia la salida: fuera de la clave
+    inicio = time.perf_counter()
+    clave = clave_resultado(
+        "fase1",
+        {"csv": csv_path, "reglas": reglas_path, "coordenadas": ruta_coordenadas, "gestores": asignacion_gestores},
+        {"salida": out_path.name, "origen": origen, "delegacion": delegacion, "api": bool(api_key),
+         "traza": traza, "libro_final": libro_final, "geocache": generacion_cache()},
+    )
+    datos = recuperar_de_cache(clave, out_path.parent)
+    if datos is not None:
+        return _desde_cache(out_path, datos, traza, time.perf_counter() - inicio)
+
+    degradados = resultados_degradados()
+    resultado = _run(csv_path, reglas_path, out_path, origen, delegacion, api_key, ruta_coordenadas,
+                     traza, bloque, libro_final, asignacion_gestores)
+    # Con errores transitorios o aproximaciones locales se recalcula la próxima vez
+    if resultados_degradados() == degradados:
+        _guardar_en_cache(clave, out_path, resultado)
+    else:
+        print("Aviso: hay direcciones sin resultado exacto; el resultado no se guarda en la caché")
+    return resultado
 
-        ws = wb_out.create_sheet(nombre)
 
-        for row in dataframe_to_rows(sub[cols_out], index=False, header=True):
-            ws.append([sanitize_cell(v) for v in row])
+def _run(csv_path: Path, reglas_path: Path, out_path: Path, origen: str, delegacion: str, api_key: str,
+         ruta_coordenadas: Path | None, traza: bool, bloque: int | None, libro_final: bool,
+         asignacion_gestores: Path | None) -> dict:
+    """Parte de run que calcula la Fase 1 (sin caché)."""
 
-        style_sheet(ws)
+    # Segundos por fase (acumulados entre bloques), para METADATOS y la traza
+    tiempos = {}
+    marca = [time.perf_counter()]
 
-    # --- PARADAS: clave Población + calle sin número ---
+    def fase(nombre: str):
+        ahora = time.perf_counter()
+        tiempos[nombre] = tiempos.get(nombre, 0.0) + ahora - marca[0]
+        marca[0] = ahora
 
-    
+    coords_municipios = {}
+    if ruta_coordenadas is not None:
+        try:
+            coords_municipios = coordenadas_municipios(ruta_coordenadas)
+        except Exception as e:
+            print(f"Aviso: no se pudo cargar coordenadas de municipios: {e}")
+
+    # Reglas compiladas; solo se relee el Excel si ha cambiado
+    motores = cargar_reglas(reglas_path)
+    motor_h = motores["hospitales"]
+    motor_f = motores["federacion"]
+    fase("carga_reglas")
+
+    def procesar(df: pd.DataFrame) -> pd.DataFrame:
+        df = preparar_llegadas(df)
+        fase("lectura")
+        df = limpiar_direcciones(df, delegacion)
+        fase("callejero")
+        geocodificar_llegadas(df, delegacion, api_key, coords_municipios)
+        fase("geocodificacion")
+        df = clasificar_llegadas(df, motor_h, motor_f)
+        fase("clasificacion")
+        return df
+
+    if bloque:
+        return _run_por_bloques(csv_path, reglas_path, out_path, origen, delegacion, traza, bloque,
+                                procesar, motor_h, motor_f, tiempos, fase, libro_final, asignacion_gestores)
+
+    df = procesar(leer_llegadas(csv_path))
+
+    # -------------------------
+    # EXCEL
+    # -------------------------
+
+    # METADATOS
+    meta = _metadatos(delegacion, origen, csv_path, reglas_path, motor_h, motor_f,
+                      df["Regla_hospital"], df["Regla_federacion"], tiempos)
+
+    # HOSPITALES, FEDERACION y ZREP
+    cols_out = [c for c in COLUMNAS_BASE + COLUMNAS_EXTRA if c in df.columns]
+    existing = {"METADATOS"}
     paradas_por_hoja = {}
-    
-    for hoja, subdf in [("HOSPITALES", hosp), ("FEDERACION", fed)]:
-        paradas_por_hoja[hoja] = subdf["Clave_parada"].nunique()
-    
-    for z, subdf in resto.groupby("Z.Rep"):
-        z = str(z).strip()
-        if z == ".":
-            z = ""
-        nombre = f"ZREP_{z}"
-        nombre = re.sub(r"[\\/*?:\[\]]", "_", nombre)[:31]
-        paradas_por_hoja[nombre] = subdf["Clave_parada"].nunique()
-    
-    # Guardar paradas en un CSV auxiliar junto al Excel
+    hojas = {}
+
+    for hoja, z, sub in particiones(df):
+        if hoja == "ZREP":
+            hoja = nombre_hoja_zrep(z)
+            nombre = nombre_libre(hoja, existing)
+        else:
+            nombre = hoja
+
+        hojas[nombre] = lambda sub=sub: [sub]
+
+        # --- PARADAS: clave Población + calle sin número ---
+        paradas_por_hoja[hoja] = sub["Clave_parada"].nunique()
 
+    # Guardar paradas en un JSON auxiliar junto al Excel
     paradas_path = out_path.with_suffix(".paradas.json")
     with open(paradas_path, "w", encoding="utf-8") as f:
         json.dump(paradas_por_hoja, f, ensure_ascii=False)
 
-    # --- GUARDAR ---
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    wb_out.save(out_path)
+    _escribir_salida(out_path, meta, hojas, cols_out, libro_final)
+    fase("excel")
+
+    gestores = None
+    if asignacion_gestores is not None:
+        gestores = _libros_gestores(hojas, cols_out, asignacion_gestores, out_path.parent)
+        fase("gestores")
+
+    # Traza de clasificación opcional junto al Excel
+    if traza:
+        with open(out_path.with_suffix(".reglas.json"), "w", encoding="utf-8") as f:
+            json.dump(traza_reglas(df, motor_h, motor_f, tiempos), f, ensure_ascii=False, indent=1)
+
+    return _resultado(out_path, len(df), paradas_por_hoja, tiempos, traza, gestores)
+
+
+def _run_por_bloques(csv_path, reglas_path, out_path, origen, delegacion, traza, bloque,
+                     procesar, motor_h, motor_f, tiempos, fase, libro_final, asignacion_gestores):
+    """Parte de run para el modo por bloques: procesa, reparte a disco y escribe al final."""
+    with tempfile.TemporaryDirectory(prefix="reparto_") as directorio:
+        partes = _Particiones(Path(directorio))
+        cols_out = None
+        zonas = set()
+        expediciones = 0
+        # Solo las filas que encajan con alguna regla, para METADATOS y la traza
+        con_regla = []
+
+        for df in leer_llegadas_por_bloques(csv_path, bloque):
+            df = procesar(df)
+            expediciones += len(df)
+            if cols_out is None:
+                cols_out = [c for c in COLUMNAS_BASE + COLUMNAS_EXTRA if c in df.columns]
+            for hoja, z, sub in particiones(df):
+                if hoja == "ZREP":
+                    zonas.add(z)
+                partes.anadir((hoja, z), sub[cols_out + ["Clave_parada"]])
+            con_regla.append(
+                df.loc[df["Regla_hospital"].notna() | df["Regla_federacion"].notna(),
+                       ["Exp", "Regla_hospital", "Regla_federacion"]]
+            )
+            del df
+
+        # read_csv da al menos un bloque (vacío si solo hay cabecera)
+        reglas = pd.concat(con_regla, ignore_index=True)
+
+        # -------------------------
+        # EXCEL
+        # -------------------------
+        meta = _metadatos(delegacion, origen, csv_path, reglas_path, motor_h, motor_f,
+                          reglas["Regla_hospital"], reglas["Regla_federacion"], tiempos)
+
+        existing = {"METADATOS"}
+        claves_parada = []
+        hojas = {}
+        claves = [("HOSPITALES", None), ("FEDERACION", None)] + [("ZREP", z) for z in sorted(zonas)]
+        for clave in claves:
+            hoja, z = clave
+            if hoja == "ZREP":
+                hoja = nombre_hoja_zrep(z)
+                nombre = nombre_libre(hoja, existing)
+            else:
+                nombre = hoja
+
+            vistas = set()
+            claves_parada.append((hoja, vistas))
+            hojas[nombre] = lambda clave=clave, vistas=vistas: partes.leer(clave, vistas)
+
+        # Las paradas se cuentan mientras se escriben las hojas
+        _escribir_salida(out_path, meta, hojas, cols_out, libro_final)
+        paradas_por_hoja = {}
+        for hoja, vistas in claves_parada:
+            paradas_por_hoja[hoja] = len(vistas)
+
+        paradas_path = out_path.with_suffix(".paradas.json")
+        with open(paradas_path, "w", encoding="utf-8") as f:
+            json.dump(paradas_por_hoja, f, ensure_ascii=False)
+        fase("excel")
+
+        gestores = None
+        if asignacion_gestores is not None:
+            gestores = _libros_gestores(hojas, cols_out, asignacion_gestores, out_path.parent)
+            fase("gestores")
+
+    if traza:
+        with open(out_path.with_suffix(".reglas.json"), "w", encoding="utf-8") as f:
+            json.dump(traza_reglas(reglas, motor_h, motor_f, tiempos), f, ensure_ascii=False, indent=1)
+
+    return _resultado(out_path, expediciones, paradas_por_hoja, tiempos, traza, gestores)
+
 
 # -------------------------
 # MAIN
@@ -456,6 +704,16 @@ def main():
     parser.add_argument("--delegacion", default="castellon")
     parser.add_argument("--api_key", default="")
     parser.add_argument("--coordenadas", default=None)
+    parser.add_argument("--traza_reglas", action="store_true",
+                        help="guarda <salida>.reglas.json con aciertos por regla y tiempos")
+    parser.add_argument("--bloque", type=int, default=0,
+                        help="filas por bloque para ficheros muy grandes (0 = todo el CSV de una vez)")
+    parser.add_argument("--final", action="store_true",
+                        help="libro como lo entrega la aplicación: ALMACEN, RESUMEN_UNICO y enlaces de regreso")
+    parser.add_argument("--gestores", default=None,
+                        help="gestor_zonas.xlsx: escribe también los libros por gestor junto a la salida")
+    parser.add_argument("--cache", action="store_true",
+                        help="reutiliza el resultado guardado de una petición idéntica (cache_resultados)")
 
     args = parser.parse_args()
 
@@ -465,7 +723,9 @@ def main():
     coord_p = Path(args.coordenadas) if args.coordenadas else None
 
     run(csv_p, reglas_p, out_p, "LLEGADAS", args.delegacion,
-        api_key=args.api_key, ruta_coordenadas=coord_p)
+        api_key=args.api_key, ruta_coordenadas=coord_p, traza=args.traza_reglas,
+        bloque=args.bloque or None, libro_final=args.final,
+        asignacion_gestores=Path(args.gestores) if args.gestores else None, cache=args.cache)
 
     print(f"OK: generado {out_p}")
 
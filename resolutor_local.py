@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+resolutor_local.py — Geocodificación aproximada sin llamar a la API
+- Vecino: interpolación entre los portales más cercanos de la misma calle ya en caché
+- Centroide de calle: mediana de los portales de esa calle ya geocodificados en la caché
+- Centroide de C.P. y de municipio: libros de referencia de Castellón y Valencia
+- Cada resultado lleva su precisión: exacta > vecino > calle > cp > municipio
+"""
+
+from bisect import bisect_left, insort
+from pathlib import Path
+from statistics import median
+
+import pandas as pd
+
+from normalizacion import calle_base, numero_portal, partes_clave, texto_clave
+
+RAIZ = Path(__file__).resolve().parent
+
+REFERENCIAS = [
+    RAIZ / "Libro_de_Servicio_Castellon_con_coordenadas.xlsx",
+    RAIZ / "valencia_municipios_coordenadas.xlsx",
+]
+
+# De más a menos precisa
+PRECISIONES = ("exacta", "vecino", "calle", "cp", "municipio")
+
+# Interpolación entre portales: confianza 1 en el mismo número y 0 a
+# `max_salto` números del vecino; penalizaciones si el vecino es de la otra
+# acera (paridad), si solo hay vecinos por un lado o si están muy separados
+_PENALIZACION_PARIDAD = 0.8
+_PENALIZACION_EXTRAPOLACION = 0.8
+_SEPARACION_MAXIMA = 0.005  # grados (~500 m) entre los dos vecinos
+
+
+def rango_precision(precision: str) -> int:
+    """Posición de la precisión en PRECISIONES (0 = exacta)."""
+    if precision not in PRECISIONES:
+        raise ValueError(f"Precisión desconocida: {precision}. Valores posibles: {', '.join(PRECISIONES)}")
+    return PRECISIONES.index(precision)
+
+
+def cargar_referencias(rutas=None) -> tuple:
+    """
+    Lee los libros de referencia y devuelve ({cp: (lat, lon)}, {municipio: (lat, lon)}).
+    Usa todas las hojas con columnas LATITUD/LONGITUD y CODPOS y/o PUEBLO.
+    Los municipios con varias filas (varios C.P.) se promedian.
+    """
+    cps = {}
+    puntos_municipio = {}
+    for ruta in (REFERENCIAS if rutas is None else rutas):
+        ruta = Path(ruta)
+        if not ruta.exists():
+            continue
+        hojas = list(pd.read_excel(ruta, sheet_name=None).values())
+        for df in hojas:
+            df.columns = df.columns.astype(str).str.strip().str.upper()
+        # Las hojas solo de C.P. (CP_COORDS) antes que las de municipios
+        for df in sorted(hojas, key=lambda h: "PUEBLO" in h.columns):
+            if not {"LATITUD", "LONGITUD"}.issubset(df.columns):
+                continue
+            for _, row in df.iterrows():
+                lat, lon = row["LATITUD"], row["LONGITUD"]
+                if pd.isna(lat) or pd.isna(lon):
+                    continue
+                punto = (float(lat), float(lon))
+                if "CODPOS" in df.columns and pd.notna(row["CODPOS"]):
+                    cp = str(row["CODPOS"]).strip().split(".")[0].zfill(5)
+                    cps.setdefault(cp, punto)
+                if "PUEBLO" in df.columns and pd.notna(row["PUEBLO"]):
+                    municipio = texto_clave(row["PUEBLO"])
+                    if municipio:
+                        puntos_municipio.setdefault(municipio, []).append(punto)
+
+    municipios = {
+        m: (sum(p[0] for p in puntos) / len(puntos), sum(p[1] for p in puntos) / len(puntos))
+        for m, puntos in puntos_municipio.items()
+    }
+    return cps, municipios
+
+
+class IndiceLocal:
+    """Índice en memoria de centroides de calle, C.P. y municipio por clave canónica."""
+
+    def __init__(self, cps: dict | None = None, municipios: dict | None = None):
+        self.cps = cps or {}
+        self.municipios = municipios or {}
+        self.calles = {}  # calle_base → {municipio: [(lat, lon), ...]}
+        self.portales = {}  # (calle_base, municipio) → [(número, lat, lon), ...] ordenada
+        self._centroides = {}
+
+    @classmethod
+    def desde_referencias(cls, rutas=None) -> "IndiceLocal":
+        return cls(*cargar_referencias(rutas))
+
+    def anadir(self, clave: str, lat: float, lon: float):
+        """Añade un portal geocodificado a la calle de su clave."""
+        calle, _cp, municipio, _prov = partes_clave(clave)
+        base = calle_base(calle)
+        if not base or not municipio:
+            return
+        self.calles.setdefault(base, {}).setdefault(municipio, []).append((lat, lon))
+        self._centroides.pop((base, municipio), None)
+        numero = numero_portal(calle)
+        if numero is not None:
+            insort(self.portales.setdefault((base, municipio), []), (numero, lat, lon))
+
+    def quitar(self, clave: str, lat: float, lon: float):
+        """Retira un portal añadido con anadir (p. ej. un resultado rechazado)."""
+        calle, _cp, municipio, _prov = partes_clave(clave)
+        base = calle_base(calle)
+        puntos = self.calles.get(base, {}).get(municipio)
+        if not puntos or (lat, lon) not in puntos:
+            return
+        puntos.remove((lat, lon))
+        if not puntos:
+            del self.calles[base][municipio]
+            if not self.calles[base]:
+                del self.calles[base]
+        self._centroides.pop((base, municipio), None)
+        numero = numero_portal(calle)
+        portales = self.portales.get((base, municipio))
+        if numero is not None and portales and (numero, lat, lon) in portales:
+            portales.remove((numero, lat, lon))
+            if not portales:
+                del self.portales[(base, municipio)]
+
+    @staticmethod
+    def _buscar_municipio(municipio: str, tabla: dict):
+        """Nombre de `tabla` que corresponde al municipio: exacto o, como
+        buscar_coords_referencia, uno contenido en el otro."""
+        if not municipio:
+            return None
+        if municipio in tabla:
+            return municipio
+        if len(municipio) >= 4:
+            for nombre in tabla:
+                if municipio in nombre or nombre in municipio:
+                    return nombre
+        return None
+
+    def interpolar(self, clave: str, max_salto: int = 20):
+        """
+        (lat, lon, confianza) a partir de los portales de la misma calle y
+        municipio ya en caché, o None si no hay vecinos a menos de `max_salto`.
+        Entre dos vecinos de la misma acera se interpola linealmente; con un
+        solo lado se toma el más cercano.
+        """
+        calle, _cp, municipio, _prov = partes_clave(clave)
+        numero = numero_portal(calle)
+        base = calle_base(calle)
+        if numero is None or not base or base not in self.calles:
+            return None
+        nombre = self._buscar_municipio(municipio, self.calles[base])
+        portales = self.portales.get((base, nombre)) if nombre is not None else None
+        if not portales:
+            return None
+
+        factor = 1.0
+        acera = [p for p in portales if p[0] % 2 == numero % 2]
+        if not acera:
+            acera = portales
+            factor *= _PENALIZACION_PARIDAD
+
+        i = bisect_left(acera, (numero,))
+        if i < len(acera) and acera[i][0] == numero:
+            return acera[i][1], acera[i][2], round(factor, 2)
+        anterior = acera[i - 1] if i > 0 else None
+        siguiente = acera[i] if i < len(acera) else None
+
+        if anterior is not None and siguiente is not None:
+            t = (numero - anterior[0]) / (siguiente[0] - anterior[0])
+            lat = anterior[1] + t * (siguiente[1] - anterior[1])
+            lon = anterior[2] + t * (siguiente[2] - anterior[2])
+            salto = max(numero - anterior[0], siguiente[0] - numero)
+            separacion = ((siguiente[1] - anterior[1]) ** 2 + (siguiente[2] - anterior[2]) ** 2) ** 0.5
+            if separacion > _SEPARACION_MAXIMA:
+                factor *= 0.5
+        else:
+            vecino = anterior if anterior is not None else siguiente
+            lat, lon = vecino[1], vecino[2]
+            salto = abs(numero - vecino[0])
+            factor *= _PENALIZACION_EXTRAPOLACION
+
+        confianza = factor * max(0.0, 1 - salto / max_salto)
+        if confianza <= 0:
+            return None
+        return lat, lon, round(confianza, 2)
+
+    def resolver(self, clave: str):
+        """(lat, lon, precisión) más preciso disponible para la clave o None."""
+        calle, cp, municipio, _prov = partes_clave(clave)
+
+        base = calle_base(calle)
+        por_municipio = self.calles.get(base) if base else None
+        nombre = self._buscar_municipio(municipio, por_municipio) if por_municipio else None
+        if nombre is not None:
+            centroide = self._centroides.get((base, nombre))
+            if centroide is None:
+                puntos = por_municipio[nombre]
+                centroide = (median(p[0] for p in puntos), median(p[1] for p in puntos))
+                self._centroides[(base, nombre)] = centroide
+            return (*centroide, "calle")
+
+        if cp in self.cps:
+            return (*self.cps[cp], "cp")
+
+        nombre = self._buscar_municipio(municipio, self.municipios)
+        if nombre is not None:
+            return (*self.municipios[nombre], "municipio")
+        return None
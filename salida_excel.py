@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+salida_excel.py — Escritura de los Excel de salida en modo write_only (por filas)
+- Libro write_only con estilos con nombre (cabecera, celda, enlace…) registrados una vez
+- Cada celda copia el estilo ya resuelto de su hoja: sin objetos Border/Font por celda
+- Las filas se escriben según se generan; anchos, altos y paneles se fijan antes
+- valor_celda: caracteres de control fuera; valor_to_excel/filas_to_excel: lo que escribía DataFrame.to_excel
+- nuevo_libro(registro=...): cada fila escrita pasa además al registro de la instantánea (instantanea.py)
+"""
+
+import datetime as _dt
+import itertools
+import math
+import re
+from copy import copy
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import Cell, WriteOnlyCell
+from openpyxl.styles import DEFAULT_FONT, Alignment, Border, Font, NamedStyle, PatternFill, Side
+from openpyxl.utils import get_column_letter
+from openpyxl.utils.dataframe import dataframe_to_rows
+
+_FINO = Side(style="thin")
+_BORDE = Border(left=_FINO, right=_FINO, top=_FINO, bottom=_FINO)
+
+# nombre → atributos del NamedStyle (sin "font" se queda la fuente por defecto del libro)
+ESTILOS = {
+    "celda": {"border": _BORDE},
+    "cabecera": {"font": Font(bold=True), "border": _BORDE},
+    "negrita": {"font": Font(bold=True)},
+    "enlace": {"font": Font(color="0000FF", underline="single")},
+    "enlace_negrita": {"font": Font(color="0000FF", underline="single", bold=True)},
+    "oculto_negrita": {"font": Font(color="FFFFFF", bold=True)},
+    "fila_impar": {"fill": PatternFill(start_color="DDEEFF", end_color="DDEEFF", fill_type="solid")},
+    "cabecera_atrasos": {
+        "font": Font(bold=True),
+        "fill": PatternFill("solid", fgColor="D9E1F2"),
+        "alignment": Alignment(horizontal="center", vertical="center", wrap_text=True),
+    },
+}
+
+# Formatos de DataFrame.to_excel para fechas
+FORMATO_FECHA_HORA = "YYYY-MM-DD HH:MM:SS"
+FORMATO_FECHA = "YYYY-MM-DD"
+
+_ILLEGAL_CHARS_RE = re.compile(
+    r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f]"
+)
+
+
+# -------------------------
+# VALORES
+# -------------------------
+
+def valor_celda(x):
+    """Elimina caracteres de control ilegales para openpyxl; NaN/None → celda vacía."""
+    if x is None or (isinstance(x, float) and pd.isna(x)):
+        return None
+    if isinstance(x, str):
+        return _ILLEGAL_CHARS_RE.sub("", x)
+    return x
+
+
+def valor_to_excel(x) -> tuple:
+    """(valor, formato) como los escribía DataFrame.to_excel(index=False); NaN → celda vacía."""
+    if isinstance(x, str):
+        return (x or None), None
+    if x is None or (pd.api.types.is_scalar(x) and pd.isna(x)):
+        return None, None
+    if pd.api.types.is_integer(x):
+        return int(x), None
+    if pd.api.types.is_float(x):
+        if x in (float("inf"), float("-inf")):
+            return ("inf" if x > 0 else "-inf"), None
+        return float(x), None
+    if pd.api.types.is_bool(x):
+        return bool(x), None
+    if isinstance(x, Decimal):
+        return x, None
+    if isinstance(x, _dt.datetime):
+        return x, FORMATO_FECHA_HORA
+    if isinstance(x, _dt.date):
+        return x, FORMATO_FECHA
+    if isinstance(x, _dt.timedelta):
+        return x.total_seconds() / 86400, "0"
+    return (str(x) or None), None
+
+
+def valor_leido(x):
+    """
+    Valor que da openpyxl (data_only) al volver a leer la celda: números con
+    16 cifras y los enteros como int, fórmulas y "" vacías, fechas como datetime.
+    """
+    if isinstance(x, np.generic):
+        x = x.item()
+    if isinstance(x, str):
+        return None if x == "" or (len(x) > 1 and x.startswith("=")) else x
+    if isinstance(x, float):
+        if not math.isfinite(x):
+            return None
+        texto = "%.16g" % x
+        if not any(c in texto for c in ".Ee"):
+            return int(texto)
+        return float(texto)
+    if isinstance(x, pd.Timestamp):
+        return x.to_pydatetime()
+    if isinstance(x, _dt.date) and not isinstance(x, _dt.datetime):
+        return _dt.datetime.combine(x, _dt.time())
+    return x
+
+
+def filas_to_excel(df: pd.DataFrame):
+    """Cabecera y filas de df.to_excel(index=False): por fila, (valores, formatos)."""
+    for fila in itertools.chain([df.columns], df.itertuples(index=False, name=None)):
+        pares = [valor_to_excel(v) for v in fila]
+        yield [v for v, _ in pares], [f for _, f in pares]
+
+
+# -------------------------
+# LIBRO Y HOJAS
+# -------------------------
+
+def nuevo_libro(registro=None) -> Workbook:
+    """
+    Workbook write_only con los ESTILOS registrados. `registro`
+    (instantanea.Registro) recibe cada hoja creada y cada fila escrita tal
+    como se volverá a leer (valor_leido).
+    """
+    wb = Workbook(write_only=True)
+    for nombre, atributos in ESTILOS.items():
+        wb.add_named_style(NamedStyle(name=nombre, **{"font": DEFAULT_FONT, **atributos}))
+    wb.registro = registro
+    return wb
+
+
+class HojaSalida:
+    """
+    Hoja write_only. Anchos, paneles y autofiltro en la creación; el alto de
+    cada fila al escribirla. Los estilos se resuelven una vez por (estilo,
+    formato) y cada celda copia el resultado.
+    """
+
+    def __init__(self, wb: Workbook, titulo: str, anchos: dict | None = None,
+                 congelar: str | None = None, autofiltro: str | None = None):
+        self.ws = wb.create_sheet(titulo)
+        self.filas = 0
+        self._estilos = {}
+        self._registro = getattr(wb, "registro", None)
+        if self._registro is not None:
+            self._registro.hoja(self.ws.title)
+        for columna, ancho in (anchos or {}).items():
+            letra = get_column_letter(columna) if isinstance(columna, int) else columna
+            self.ws.column_dimensions[letra].width = ancho
+        if congelar:
+            self.ws.freeze_panes = congelar
+        if autofiltro:
+            self.ws.auto_filter.ref = autofiltro
+
+    def celda(self, valor=None, estilo: str | None = None, formato: str | None = None,
+              enlace: str | None = None) -> Cell:
+        c = WriteOnlyCell(self.ws, value=valor)
+        if estilo or formato:
+            clave = (estilo, formato)
+            resuelto = self._estilos.get(clave)
+            if resuelto is None:
+                plantilla = WriteOnlyCell(self.ws)
+                if estilo:
+                    plantilla.style = estilo
+                if formato:
+                    plantilla.number_format = formato
+                resuelto = self._estilos[clave] = plantilla._style
+            c._style = copy(resuelto)
+        if enlace:
+            c.hyperlink = enlace
+        return c
+
+    def fila(self, valores, estilo: str | None = None, formatos=None, alto: float | None = None):
+        """
+        Añade una fila. `valores` puede mezclar valores y celdas (celda()); los
+        valores toman `estilo` y su formato de `formatos` (lista por columna).
+        """
+        self.filas += 1
+        if alto is not None:
+            self.ws.row_dimensions[self.filas].height = alto
+        valores = list(valores)
+        if self._registro is not None:
+            self._registro.fila(self.ws.title, tuple(valor_leido(v.value if isinstance(v, Cell) else v) for v in valores))
+        if estilo is None and not any(formatos or ()) and not any(isinstance(v, Cell) for v in valores):
+            self.ws.append(valores)
+            return
+        # Sin mezclar: en modo write_only un valor suelto tras una celda hereda su estilo
+        fila = []
+        for i, v in enumerate(valores):
+            if isinstance(v, Cell):
+                fila.append(v)
+            else:
+                formato = formatos[i] if formatos is not None and i < len(formatos) else None
+                fila.append(self.celda(v, estilo, formato))
+        self.ws.append(fila)
+
+    def tabla(self, columnas: list, filas, estilo_cabecera: str | None = "cabecera",
+              estilo: str | None = "celda", formatos: dict | None = None):
+        """Cabecera y filas (iterables de valores ya preparados); `formatos` por nombre de columna."""
+        self.fila([self.celda(c, estilo_cabecera) for c in columnas])
+        por_columna = [formatos.get(c) for c in columnas] if formatos else None
+        for valores in filas:
+            self.fila(valores, estilo, por_columna)
+
+    def tabla_df(self, bloques, columnas: list):
+        """tabla() con las filas de un DataFrame o de un iterable de DataFrames."""
+        if isinstance(bloques, pd.DataFrame):
+            bloques = [bloques]
+        self.tabla(
+            [valor_celda(c) for c in columnas],
+            (fila for bloque in bloques for fila in filas_df(bloque, columnas)),
+        )
+
+    def imagen(self, imagen, ancla: str):
+        self.ws.add_image(imagen, ancla)
+
+
+def filas_df(df: pd.DataFrame, columnas: list | None = None):
+    """Filas de valores (valor_celda) de las columnas indicadas."""
+    if columnas is not None:
+        df = df[columnas]
+    for fila in dataframe_to_rows(df, index=False, header=False):
+        yield [valor_celda(v) for v in fila]
+
+
+def escribir_df(wb: Workbook, titulo: str, bloques, columnas: list,
+                congelar: str | None = "A2") -> HojaSalida:
+    """
+    Hoja con cabecera en negrita, bordes finos en todas las celdas y la fila 1
+    fija. `bloques`: DataFrame o iterable de DataFrames con esas columnas.
+    """
+    hoja = HojaSalida(wb, titulo, congelar=congelar)
+    hoja.tabla_df(bloques, columnas)
+    return hoja
+
+
+def escribir_como_to_excel(wb: Workbook, titulo: str, df: pd.DataFrame) -> HojaSalida:
+    """Hoja con lo que escribía df.to_excel(index=False): cabecera sin formato y NaN vacío."""
+    hoja = HojaSalida(wb, titulo)
+    for valores, formatos in filas_to_excel(df):
+        hoja.fila(valores, formatos=formatos)
+    return hoja
@@ -0,0 +1,23 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Módulos planos en la raíz del proyecto
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import geocodificador  # noqa: E402
+
+
+@pytest.fixture
+def geocache(tmp_path, monkeypatch):
+    """geocodificador con una geocache.db vacía en tmp_path; deja el módulo como estaba."""
+    monkeypatch.setattr(geocodificador, "DB_PATH", tmp_path / "geocache.db")
+    yield geocodificador
+    geocodificador.vaciar_escrituras()
+    with geocodificador._LOCK:
+        if geocodificador._CONN is not None:
+            geocodificador._CONN.close()
+        geocodificador._CONN = geocodificador._CONN_PATH = None
+        geocodificador._LRU.clear()
+        geocodificador._reiniciar_indice_local()
@@ -0,0 +1,32 @@
+import cache_resultados
+
+
+def test_clave_cambia_con_el_codigo(tmp_path, monkeypatch):
+    csv = tmp_path / "entrada.csv"
+    csv.write_text("a;b\n1;2\n")
+    antes = cache_resultados.clave_resultado("fase1", {"csv": csv}, {"origen": "LLEGADAS"})
+    assert cache_resultados.clave_resultado("fase1", {"csv": csv}, {"origen": "LLEGADAS"}) == antes
+
+    monkeypatch.setattr(cache_resultados, "version_codigo", lambda: "otra")
+    assert cache_resultados.clave_resultado("fase1", {"csv": csv}, {"origen": "LLEGADAS"}) != antes
+
+
+def test_version_codigo_sigue_a_los_modulos(tmp_path, monkeypatch):
+    (tmp_path / "normalizacion.py").write_text("VERSION = 1\n")
+    monkeypatch.setattr(cache_resultados, "RAIZ", tmp_path)
+    cache_resultados.version_codigo.cache_clear()
+    try:
+        antes = cache_resultados.version_codigo()
+        (tmp_path / "normalizacion.py").write_text("VERSION = 2\n")
+        cache_resultados.version_codigo.cache_clear()
+        assert cache_resultados.version_codigo() != antes
+    finally:
+        cache_resultados.version_codigo.cache_clear()
+
+
+def test_recuperado_da_el_tiempo_de_recuperacion(tmp_path):
+    from reparto_gpt import _desde_cache
+
+    datos = {"expediciones": 3, "paradas_por_hoja": {"ZREP_1": 3}, "gestores": None}
+    r = _desde_cache(tmp_path / "salida.xlsx", datos, False, 0.0123)
+    assert r["desde_cache"] and r["tiempos"] == {"cache": 0.012}
@@ -0,0 +1,117 @@
+from callejero import Callejero
+
+
+def _callejero() -> Callejero:
+    c = Callejero()
+    c.anadir("VALENCIA", "46001", "CALLE", "SAN VICENTE MARTIR")
+    c.anadir("TORRENT", "46900", "CALLE", "VALENCIA")
+    c.anadir("ALMASSORA", "12550", "CALLE", "TRINITAT")
+    c.anadir("VILA REAL", "12540", "CALLE", "MAYOR")
+    c.anadir("VILA", "46001", "CALLE", "NOU")
+    # Callejero antiguo: sin municipio propio ni C.P.
+    c.anadir("CASTELL", "", "CALLE", "ENMEDIO")
+    return c
+
+
+# -------------------------
+# MUNICIPIO
+# -------------------------
+
+def test_municipio_exacto():
+    assert _callejero().municipio("Torrent", "") == "TORRENT"
+
+
+def test_municipio_contenido_solo_entre_los_del_cp():
+    c = _callejero()
+    assert c.municipio("Almassora / Almazora", "12550") == "ALMASSORA"
+    # El mismo parecido con el C.P. de otro municipio no vale
+    assert c.municipio("Almassora / Almazora", "46001") is None
+    assert c.municipio("Almassora / Almazora", "") is None
+
+
+def test_municipio_contenido_de_otro_cp_no_vale():
+    c = _callejero()
+    # 'VILA' (46001) está contenido en 'LA VILA JOIOSA', pero no es del C.P.
+    assert c.municipio("La Vila Joiosa", "03570") is None
+    assert c.municipio("La Vila Joiosa", "") is None
+    assert c.municipio("La Vila Joiosa", "46001") == "VILA"
+
+
+def test_municipio_contenido_con_longitud_minima():
+    c = Callejero()
+    c.anadir("LA", "46001", "CALLE", "MAYOR")
+    c.anadir("LLIRIA", "46001", "CALLE", "MAYOR")
+    # 'LA' está contenido en 'LA POBLA' pero es demasiado corto
+    assert c.municipio("La Pobla", "46001") is None
+
+
+def test_municipio_unico_del_cp():
+    assert _callejero().municipio("Poblacion desconocida", "12550") == "ALMASSORA"
+
+
+def test_callejero_antiguo_por_poblacion():
+    c = _callejero()
+    assert c.municipio("Castellón de la Plana", "12001") == "CASTELL"
+    assert c.municipio("Castellón de la Plana", "") == "CASTELL"
+
+
+# -------------------------
+# CORRECCIÓN
+# -------------------------
+
+def _muestras(nombres, n, semilla=0):
+    """Nombres del callejero con una errata (letra quitada, cambiada o repetida)."""
+    import random
+
+    rnd = random.Random(semilla)
+    muestras = []
+    for nombre in rnd.sample(sorted(nombres), n):
+        i = rnd.randrange(len(nombre))
+        muestras.append(rnd.choice([
+            nombre[:i] + nombre[i + 1:],
+            nombre[:i] + "X" + nombre[i + 1:],
+            nombre[:i] + nombre[i] + nombre[i:],
+            nombre,
+        ]))
+    return muestras
+
+
+def test_indice_decide_como_difflib():
+    import difflib
+
+    from callejero import CORTE_SIMILITUD, cargar_callejero
+
+    callejero = cargar_callejero("castellon")
+    for municipio in callejero.calles:
+        indice = callejero.indice(municipio)
+        for tipo, grupo in indice.grupos.items():
+            nombres = list(grupo["nombres"])
+            for clave in _muestras(nombres, min(len(nombres), 100)):
+                esperado = difflib.get_close_matches(clave, nombres, n=1, cutoff=CORTE_SIMILITUD)
+                encontrado = indice.buscar(tipo, clave)
+                assert (encontrado[0] if encontrado else None) == (esperado[0] if esperado else None), clave
+
+
+def test_formato_de_la_correccion():
+    import callejero as modulo
+    from callejero import corregir_calle
+
+    c = Callejero()
+    c.anadir("CASTELL", "", "CARRER", "FONT (DE LA)")
+    c.anadir("CASTELL", "", "CALLE", "ENMEDIO")
+    c.anadir("CASTELL", "", "AVDA", "REY DON JAIME")
+    modulo._CALLEJEROS["prueba"] = c
+    corregir_calle.cache_clear()
+    try:
+        # Tipo de vía y número como venían; nombre del callejero con el artículo delante
+        assert corregir_calle("Castellón", "C/ FONTT DE LA, 3", "", "prueba") == "C/ DE LA FONT 3"
+        assert corregir_calle("Castellón", "CL ENMEDO, 5 2º", "", "prueba") == "CL ENMEDIO 5 2º"
+        assert corregir_calle("Castellón", "Avda. Rey Don Jaume 10", "", "prueba") == "Avda. REY DON JAIME 10"
+        # Ya era el nombre del callejero: se respeta como venía
+        assert corregir_calle("Castellón", "c/ enmedio, 5", "", "prueba") == "c/ enmedio 5"
+        # Sin parecido suficiente o fuera del callejero: sin cambios
+        assert corregir_calle("Castellón", "C/ MAYOR 5", "", "prueba") == "C/ MAYOR 5"
+        assert corregir_calle("Valencia", "C/ ENMEDO 5", "46001", "prueba") == "C/ ENMEDO 5"
+    finally:
+        del modulo._CALLEJEROS["prueba"]
+        corregir_calle.cache_clear()
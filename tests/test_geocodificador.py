@@ -0,0 +1,228 @@
+import csv
+import gzip
+import sqlite3
+import threading
+
+import geocodificador
+from normalizacion import clave_canonica
+
+INSERTAR = "INSERT INTO geocache (direccion, latitud, longitud) VALUES (?, ?, ?)"
+
+
+def _vaciar(geo, segundos: float = 10) -> bool:
+    """vaciar_escrituras() con límite de tiempo: False si se quedó esperando."""
+    hilo = threading.Thread(target=geo.vaciar_escrituras, daemon=True)
+    hilo.start()
+    hilo.join(segundos)
+    return not hilo.is_alive()
+
+
+def _filas(ruta) -> dict:
+    conn = sqlite3.connect(ruta)
+    try:
+        return {d: (lat, lon) for d, lat, lon in conn.execute("SELECT direccion, latitud, longitud FROM geocache")}
+    finally:
+        conn.close()
+
+
+# -------------------------
+# ESCRITOR ÚNICO
+# -------------------------
+
+def test_vaciar_confirma_lo_encolado(geocache):
+    with geocache._LOCK:
+        geocache._conexion()
+    geocache._encolar(INSERTAR, [("A|12001|CASTELLON|CASTELLON", 39.9, -0.05)])
+    assert _vaciar(geocache)
+    assert _filas(geocache.DB_PATH) == {"A|12001|CASTELLON|CASTELLON": (39.9, -0.05)}
+
+
+def test_lote_con_error_no_bloquea_la_cola(geocache, capsys):
+    with geocache._LOCK:
+        geocache._conexion()
+    # IntegrityError (clave repetida): no es OperationalError, no se reintenta
+    geocache._encolar(INSERTAR, [("A", 1.0, 2.0), ("A", 3.0, 4.0)])
+    assert _vaciar(geocache)
+    assert "se descartan 2 filas" in capsys.readouterr().out
+    assert geocache._ESCRITOR.is_alive()
+
+    geocache._encolar(INSERTAR, [("B", 5.0, 6.0)])
+    assert _vaciar(geocache)
+    assert _filas(geocache.DB_PATH) == {"B": (5.0, 6.0)}
+
+
+def test_fichero_que_no_se_puede_abrir(geocache, tmp_path, monkeypatch, capsys):
+    with geocache._LOCK:
+        geocache._conexion()
+    monkeypatch.setattr(geocache, "DB_PATH", tmp_path / "no_existe" / "geocache.db")
+    geocache._encolar(INSERTAR, [("A", 1.0, 2.0)])
+    assert _vaciar(geocache)
+    assert "se descartan 1 filas" in capsys.readouterr().out
+    assert geocache._ESCRITOR.is_alive()
+
+
+# -------------------------
+# MIGRACIÓN
+# -------------------------
+
+def test_migracion_v0_a_v3(geocache):
+    conn = sqlite3.connect(geocache.DB_PATH)
+    conn.execute("CREATE TABLE geocache (direccion TEXT PRIMARY KEY, latitud REAL, longitud REAL)")
+    conn.executemany(INSERTAR, [
+        ("C/ Mayor 1, 12001 Castellón, Castellón, ESPAÑA", 39.98, -0.04),
+        # Duplicado de la anterior con la clave canónica: se conserva la primera
+        ("CALLE MAYOR 1, 12001 CASTELLON, CASTELLON, ESPAÑA", 1.0, 1.0),
+        ("Av. del Mar 5, 12100 Grao, Castellón, ESPAÑA", 39.97, 0.01),
+        # Número en el nombre: desde la dirección original la clave sale bien y se conserva
+        ("AV 9 D'OCTUBRE 14, 12004 Castellón, Castellón, ESPAÑA", 39.98, -0.03),
+    ])
+    conn.commit()
+    conn.close()
+
+    conn = geocache._get_connection()
+    try:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == geocache.ESQUEMA_VERSION == 3
+        columnas = {r[1] for r in conn.execute("PRAGMA table_info(geocache)")}
+        assert {nombre for nombre, _ in geocache._COLUMNAS_V2} <= columnas
+        filas = conn.execute(
+            "SELECT direccion, latitud, longitud, fuente, creado, aciertos, negativo FROM geocache"
+        ).fetchall()
+    finally:
+        conn.close()
+
+    por_clave = {f[0]: f for f in filas}
+    mayor = clave_canonica("C/ Mayor 1, 12001 Castellón, Castellón, ESPAÑA")
+    assert set(por_clave) == {
+        mayor,
+        clave_canonica("Av. del Mar 5, 12100 Grao, Castellón, ESPAÑA"),
+        "AVENIDA 9 OCTUBRE 14|12004|CASTELLON|CASTELLON",
+    }
+    assert por_clave[mayor][1:3] == (39.98, -0.04)
+    for _, _, _, fuente, creado, aciertos, negativo in filas:
+        assert fuente == "google" and creado and aciertos == 0 and negativo == 0
+
+
+def _esquema_v2(ruta, claves):
+    conn = sqlite3.connect(ruta)
+    conn.execute("CREATE TABLE geocache (direccion TEXT PRIMARY KEY, latitud REAL, longitud REAL)")
+    for nombre, tipo in geocodificador._COLUMNAS_V2:
+        conn.execute(f"ALTER TABLE geocache ADD COLUMN {nombre} {tipo}")
+    conn.executemany(INSERTAR, [(c, 1.0, 2.0) for c in claves])
+    conn.execute("PRAGMA user_version = 2")
+    conn.commit()
+    conn.close()
+
+
+# Claves del esquema 2: números del nombre al final, piso y puerta dentro
+CLAVES_V2 = {
+    "CALLE MAYOR 5|12001|CASTELLON|CASTELLON": True,
+    "AVENIDA EUROPA SN|12001|CASTELLON|CASTELLON": True,
+    "AVENIDA OCTUBRE 9 14|12004|CASTELLON|CASTELLON": False,
+    "CALLE MAYOR B 5 2|12001|CASTELLON|CASTELLON": False,
+    "CALLE MAYO 3 1|12001|CASTELLON|CASTELLON": False,
+}
+
+
+def test_migracion_v2_a_v3_borra_claves_del_formato_anterior(geocache):
+    _esquema_v2(geocache.DB_PATH, CLAVES_V2)
+
+    conn = geocache._get_connection()
+    try:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == 3
+        claves = {d for (d,) in conn.execute("SELECT direccion FROM geocache")}
+    finally:
+        conn.close()
+    assert claves == {c for c, vigente in CLAVES_V2.items() if vigente}
+
+
+def test_importar_volcado_anterior_al_esquema_3(geocache, tmp_path):
+    ruta = tmp_path / "v2.csv.gz"
+    with gzip.open(ruta, "wt", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(geocache._COLUMNAS_EXPORTACION)
+        w.writerows([c, 1.0, 2.0, "google", "", "2024-01-01 00:00:00", "", 0, 0] for c in CLAVES_V2)
+
+    assert geocache.importar_cache(ruta)["importadas"] == sum(CLAVES_V2.values())
+
+    # Un volcado del esquema actual se importa entero
+    geocache._encolar(INSERTAR, [("CALLE 1 5|12001|CASTELLON|CASTELLON", 3.0, 4.0)])
+    actual = tmp_path / "v3.csv.gz"
+    geocache.exportar_cache(actual)
+    geocache.limpiar_cache()
+    assert geocache.importar_cache(actual)["importadas"] == sum(CLAVES_V2.values()) + 1
+
+
+def test_migracion_ya_hecha_no_cambia_nada(geocache):
+    conn = geocache._get_connection()
+    conn.execute(
+        "INSERT INTO geocache (direccion, latitud, longitud, fuente, creado) VALUES (?, ?, ?, ?, ?)",
+        ("A|12001|CASTELLON|CASTELLON", 1.0, 2.0, "importado", "2020-01-01 00:00:00"),
+    )
+    conn.commit()
+    conn.close()
+
+    conn = geocache._get_connection()
+    try:
+        assert conn.execute("SELECT fuente, creado FROM geocache").fetchall() == [("importado", "2020-01-01 00:00:00")]
+    finally:
+        conn.close()
+
+
+# -------------------------
+# RECHAZOS
+# -------------------------
+
+def test_rechazo_sale_del_indice_local(geocache, monkeypatch):
+    from resolutor_local import IndiceLocal
+
+    direccion = "C/ Mayor 10, 12001 Castellón, Castellón, ESPAÑA"
+    rechazada = clave_canonica(direccion)
+    indice = IndiceLocal()
+    indice.anadir("CALLE MAYOR 2|12001|CASTELLON|CASTELLON", 39.98, -0.04)
+    indice.anadir(rechazada, 40.5, 0.5)
+    with geocache._LOCK:
+        geocache._conexion()
+        monkeypatch.setattr(geocache, "_INDICE_LOCAL", indice)
+        geocache._lru_guardar(rechazada, (40.5, 0.5, 0, geocache._ahora()))
+
+    assert geocache.registrar_rechazos([direccion]) == 1
+    assert indice.interpolar("CALLE MAYOR 8|12001|CASTELLON|CASTELLON")[:2] == (39.98, -0.04)
+    assert indice.resolver("CALLE MAYOR 8|12001|CASTELLON|CASTELLON") == (39.98, -0.04, "calle")
+    assert geocache._LRU[rechazada][2] == 1
+
+
+def test_negativa_sin_resultado_local(geocache, monkeypatch):
+    from resolutor_local import IndiceLocal
+
+    direccion = "C/ Mayor 10, 12001 Castellón, Castellón, ESPAÑA"
+    indice = IndiceLocal()
+    indice.anadir("CALLE MAYOR 8|12001|CASTELLON|CASTELLON", 39.98, -0.04)
+    with geocache._LOCK:
+        geocache._conexion()
+        monkeypatch.setattr(geocache, "_INDICE_LOCAL", indice)
+    assert geocache.geocodificar_lote([direccion], "")[direccion] == (39.98, -0.04)
+
+    geocache.registrar_rechazos([direccion])
+    assert geocache.geocodificar_lote([direccion], "")[direccion] == (None, None)
+
+
+# -------------------------
+# GENERACIÓN
+# -------------------------
+
+def test_generacion_cambia_al_borrar_o_importar(geocache, tmp_path):
+    g0 = geocache.generacion_cache()
+    geocache._encolar(INSERTAR, [("CALLE MAYOR 1|12001|CASTELLON|CASTELLON", 1.0, 2.0)])
+    geocache.vaciar_escrituras()
+
+    assert geocache.invalidar_cache(municipio="Valencia") == 0
+    assert geocache.generacion_cache() == g0
+
+    ruta = tmp_path / "exportada.csv.gz"
+    geocache.exportar_cache(ruta)
+    geocache.limpiar_cache()
+    g1 = geocache.generacion_cache()
+    assert g1 > g0
+
+    assert geocache.importar_cache(ruta)["importadas"] == 1
+    assert geocache.generacion_cache() > g1
@@ -0,0 +1,166 @@
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+
+from add_resumen_unico import escribir_resumen_unico, generar_resumen_unico
+from instantanea import VOLVER_RESUMEN
+from modulo_valencia_gestores import _leer_zona, escribir_libros_gestores, generar_libros_gestores
+from salida_excel import nuevo_libro
+
+
+def _hoja(wb, titulo, filas, volver=False):
+    ws = wb.create_sheet(titulo)
+    if volver:
+        ws.append([VOLVER_RESUMEN])
+    for fila in filas:
+        ws.append(fila)
+
+
+def _libro_final(ruta):
+    wb = Workbook()
+    wb.remove(wb.active)
+    _hoja(wb, "ALMACEN", [["Exp", "Bultos", "Kgs"], [1, 2, 10.5]], volver=True)
+    # Columnas distintas por zona: Kgs en otra posición y Notas solo en una
+    _hoja(wb, "ZREP_NORTE", [["Exp", "Kgs", "Bultos"], [11, 5.0, 1], [12, 7.5, 2]], volver=True)
+    _hoja(wb, "ZREP_SUR", [["Exp", "Bultos", "Notas", "Kgs"], [21, 3, "frágil", 2.0]])
+    _hoja(wb, "ZREP_ESTE", [["Exp", "Bultos", "Kgs"], [31, 1, 1.0]], volver=True)
+    wb.save(ruta)
+
+
+def _asignacion(ruta, filas):
+    pd.DataFrame(filas, columns=["ZONA_REP", "GESTOR"]).to_excel(ruta, index=False)
+
+
+def _filas(ws) -> list:
+    return [list(f) for f in ws.iter_rows(values_only=True)]
+
+
+# -------------------------
+# LIBROS POR GESTOR
+# -------------------------
+
+def test_leer_zona_salta_la_fila_de_regreso(tmp_path):
+    ruta = tmp_path / "final.xlsx"
+    _libro_final(ruta)
+    with pd.ExcelFile(ruta) as xls:
+        assert list(_leer_zona(xls, "ZREP_NORTE").columns) == ["Exp", "Kgs", "Bultos"]
+        assert list(_leer_zona(xls, "ZREP_SUR").columns) == ["Exp", "Bultos", "Notas", "Kgs"]
+        assert _leer_zona(xls, "ZREP_NORTE")["Exp"].tolist() == [11, 12]
+
+
+def test_libros_por_gestor(tmp_path):
+    final = tmp_path / "final.xlsx"
+    _libro_final(final)
+    asignacion = tmp_path / "gestor_zonas.xlsx"
+    _asignacion(asignacion, [["ZREP_NORTE", "Ana"], [" ZREP_SUR ", "Ana"], ["ZREP_ESTE", "Luis"]])
+
+    resultado = generar_libros_gestores(str(final), str(asignacion), str(tmp_path / "salida"))
+    assert resultado["ok"], resultado["errores"]
+    assert set(resultado["archivos_generados"]) == {"Ana", "Luis"}
+
+    wb = load_workbook(resultado["archivos_generados"]["Ana"])
+    assert wb.sheetnames == ["RESUMEN_UNICO", "ZREP_NORTE", "ZREP_SUR", "TODO"]
+    assert _filas(wb["ZREP_NORTE"]) == [["Exp", "Kgs", "Bultos"], [11, 5, 1], [12, 7.5, 2]]
+
+    # TODO: columnas de todas las zonas en orden de aparición y ZONA al final
+    todo = _filas(wb["TODO"])
+    assert todo == [
+        ["Exp", "Kgs", "Bultos", "Notas", "ZONA"],
+        [11, 5, 1, None, "ZREP_NORTE"],
+        [12, 7.5, 2, None, "ZREP_NORTE"],
+        [21, 2, 3, "frágil", "ZREP_SUR"],
+    ]
+
+    # RESUMEN: Kgs es la columna B de TODO y ZONA la E
+    assert _filas(wb["RESUMEN_UNICO"]) == [
+        ["Total expediciones", "=COUNTA(TODO!A:A)-1", None],
+        ["Total Kgs", "=SUM(TODO!B:B)", None],
+        [None, None, None],
+        ["Zona", "Expediciones", "Kgs"],
+        ["ZREP_NORTE", '=COUNTIF(TODO!E:E,"ZREP_NORTE")', '=SUMIF(TODO!E:E,"ZREP_NORTE",TODO!B:B)'],
+        ["ZREP_SUR", '=COUNTIF(TODO!E:E,"ZREP_SUR")', '=SUMIF(TODO!E:E,"ZREP_SUR",TODO!B:B)'],
+    ]
+
+    wb = load_workbook(resultado["archivos_generados"]["Luis"])
+    assert wb.sheetnames == ["RESUMEN_UNICO", "ZREP_ESTE", "TODO"]
+    assert _filas(wb["TODO"]) == [["Exp", "Bultos", "Kgs", "ZONA"], [31, 1, 1, "ZREP_ESTE"]]
+    assert wb["RESUMEN_UNICO"]["B2"].value == "=SUM(TODO!C:C)"
+
+
+def test_zona_sin_gestor(tmp_path):
+    final = tmp_path / "final.xlsx"
+    _libro_final(final)
+    asignacion = tmp_path / "gestor_zonas.xlsx"
+    _asignacion(asignacion, [["ZREP_NORTE", "Ana"], ["ZREP_SUR", "Ana"]])
+
+    resultado = generar_libros_gestores(str(final), str(asignacion), str(tmp_path / "salida"))
+    assert not resultado["ok"]
+    assert "ZREP_ESTE" in resultado["errores"][0]
+    assert not resultado["archivos_generados"]
+
+
+def test_filas_se_leen_una_vez_por_hoja_y_otra_para_todo(tmp_path):
+    asignacion = tmp_path / "gestor_zonas.xlsx"
+    _asignacion(asignacion, [["ZREP_A", "Ana"]])
+    llamadas = []
+
+    def filas():
+        llamadas.append(1)
+        return iter([[1, 2.0]])
+
+    resultado = escribir_libros_gestores({"ZREP_A": (["Exp", "Kgs"], filas)}, str(asignacion), str(tmp_path))
+    assert resultado["ok"], resultado["errores"]
+    assert len(llamadas) == 2
+
+
+# -------------------------
+# RESUMEN_UNICO
+# -------------------------
+
+COLUMNAS = {
+    "ZREP_B": ["Exp", "Kgs", "Notas", "Bultos"],
+    "HOSPITALES": ["Exp", "Bultos", "Kilos"],
+    "ZREP_A": ["Exp", "Bultos", "Kgs"],
+    "ALMACEN": ["Exp", "Bultos", "Kgs"],
+    # Sin Bultos: no se resume
+    "FEDERACION": ["Exp", "Kgs"],
+    "OTRA": ["Exp", "Bultos", "Kgs"],
+}
+
+
+def test_resumen_unico_letras_y_orden(tmp_path):
+    wb = nuevo_libro()
+    resumidas = escribir_resumen_unico(wb, COLUMNAS, {"ZREP_A": 4})
+    ruta = tmp_path / "libro.xlsx"
+    wb.save(ruta)
+
+    assert resumidas == {"ALMACEN", "HOSPITALES", "ZREP_A", "ZREP_B"}
+    ws = load_workbook(ruta)["RESUMEN_UNICO"]
+    assert _filas(ws) == [
+        ["Clave", "Expediciones", "Bultos", "Kilos", "Paradas"],
+        ["ALMACEN", "=COUNTA('ALMACEN'!A:A)-1", "=SUM('ALMACEN'!B:B)", "=SUM('ALMACEN'!C:C)", None],
+        ["HOSPITALES", "=COUNTA('HOSPITALES'!A:A)-1", "=SUM('HOSPITALES'!B:B)", "=SUM('HOSPITALES'!C:C)", None],
+        ["ZREP_A", "=COUNTA('ZREP_A'!A:A)-1", "=SUM('ZREP_A'!B:B)", "=SUM('ZREP_A'!C:C)", 4],
+        ["ZREP_B", "=COUNTA('ZREP_B'!A:A)-1", "=SUM('ZREP_B'!D:D)", "=SUM('ZREP_B'!B:B)", None],
+    ]
+    assert ws["A5"].hyperlink.target == "#'ZREP_B'!A1"
+
+
+def test_resumen_unico_igual_que_sobre_el_libro_guardado(tmp_path):
+    """Las fórmulas de escribir_resumen_unico son las de generar_resumen_unico sobre el mismo libro."""
+    ruta = tmp_path / "libro.xlsx"
+    wb = Workbook()
+    wb.remove(wb.active)
+    for hoja, columnas in COLUMNAS.items():
+        _hoja(wb, hoja, [columnas, list(range(len(columnas)))])
+    wb.save(ruta)
+    generar_resumen_unico(str(ruta), {"ZREP_A": 4})
+
+    wb = nuevo_libro()
+    escribir_resumen_unico(wb, COLUMNAS, {"ZREP_A": 4})
+    propia = tmp_path / "propia.xlsx"
+    wb.save(propia)
+
+    propia, guardada = load_workbook(propia)["RESUMEN_UNICO"], load_workbook(ruta)["RESUMEN_UNICO"]
+    assert _filas(propia) == _filas(guardada)
+    # Enlaces en la fila de cada hoja, también tras una hoja saltada (FEDERACION)
+    assert [c.hyperlink.target for c in propia["A"][1:]] == [c.hyperlink.target for c in guardada["A"][1:]]
@@ -0,0 +1,119 @@
+import datetime as dt
+import pickle
+
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+
+import instantanea
+from instantanea import VOLVER_RESUMEN, guardar_libro, instantanea_de, leer_libro, tabla_leida
+
+
+def _libro(ruta):
+    """Libro como los de la Fase 2/3: fila "← RESUMEN", navegación, cabecera con Exp y datos variados."""
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Ruta 1"
+    ws.append([VOLVER_RESUMEN])
+    ws.append(["Siguiente", None, "Anterior"])
+    ws.append(["Exp", "Nombre", "Importe", "Fecha", "Notas", None])
+    ws.append([101, "Ana", 12.5, dt.datetime(2024, 3, 5, 9, 0), None, None])
+    ws.append([102, "", 3.0, dt.date(2024, 3, 6), "=B4", None])
+    ws.append([None, None, None, None, None, None])
+    ws.append([103, "Luis", 1 / 3, None, "fin", None])
+    otra = wb.create_sheet("Resumen")
+    otra.append(["Ruta", "Servicios"])
+    otra.append(["Ruta 1", 3])
+    wb.save(ruta)
+
+
+def _igual(a: pd.DataFrame, b: pd.DataFrame):
+    assert list(a.columns) == list(b.columns)
+    pd.testing.assert_frame_equal(a.reset_index(drop=True), b.reset_index(drop=True), check_names=False)
+
+
+def test_tabla_leida_como_read_excel(tmp_path):
+    ruta = tmp_path / "libro.xlsx"
+    _libro(ruta)
+
+    tablas = leer_libro(ruta)
+    assert list(tablas) == ["Ruta 1", "Resumen"]
+    for nombre, hoja in tablas.items():
+        crudo = pd.read_excel(ruta, sheet_name=nombre, header=None)
+        h = instantanea.fila_cabecera(instantanea.filas_hoja(hoja))
+        esperado = crudo.iloc[h + 1:].reset_index(drop=True)
+        esperado.columns = crudo.iloc[h]
+        _igual(tabla_leida(hoja), esperado)
+
+
+def test_segunda_lectura_desde_la_instantanea(tmp_path, monkeypatch):
+    ruta = tmp_path / "libro.xlsx"
+    _libro(ruta)
+    primera = leer_libro(ruta)
+    assert instantanea_de(ruta) is not None
+
+    def no_leer(_):
+        raise AssertionError("se leyó el Excel")
+
+    monkeypatch.setattr(instantanea, "_leer_excel", no_leer)
+    segunda = leer_libro(ruta)
+    for nombre in primera:
+        _igual(segunda[nombre], primera[nombre])
+
+
+def test_guardar_libro_deja_la_instantanea_del_fichero(tmp_path):
+    ruta = tmp_path / "libro.xlsx"
+    _libro(ruta)
+    esperado = leer_libro(ruta)
+    for pkl in (tmp_path / instantanea.CARPETA_INSTANTANEAS).glob("*.pkl"):
+        pkl.unlink()
+
+    guardar_libro(load_workbook(ruta), ruta)
+    assert instantanea_de(ruta) is not None
+    for nombre, hoja in leer_libro(ruta).items():
+        _igual(tabla_leida(hoja), tabla_leida(esperado[nombre]))
+
+
+def test_instantanea_corrupta_lee_el_excel(tmp_path, capsys):
+    ruta = tmp_path / "libro.xlsx"
+    _libro(ruta)
+    esperado = leer_libro(ruta)
+    instantanea_de(ruta).write_bytes(b"no es un pickle")
+
+    tablas = leer_libro(ruta)
+    assert "instantánea ilegible" in capsys.readouterr().out
+    for nombre in esperado:
+        _igual(tablas[nombre], esperado[nombre])
+    # Y la vuelve a dejar bien para la siguiente lectura
+    assert instantanea._cargar(ruta, instantanea.huella_fichero(ruta)) is not None
+
+
+def test_instantanea_de_otra_version_lee_el_excel(tmp_path, monkeypatch):
+    ruta = tmp_path / "libro.xlsx"
+    _libro(ruta)
+    leer_libro(ruta)
+    pkl = instantanea_de(ruta)
+    with open(pkl, "wb") as f:
+        pickle.dump({"version": instantanea.VERSION_INSTANTANEA - 1}, f)
+        pickle.dump(("fin", instantanea.huella_fichero(ruta), []), f)
+
+    leidas = []
+    original = instantanea._leer_excel
+    monkeypatch.setattr(instantanea, "_leer_excel", lambda r: leidas.append(r) or original(r))
+    assert list(leer_libro(ruta)) == ["Ruta 1", "Resumen"]
+    assert leidas == [ruta]
+
+
+def test_fichero_cambiado_no_usa_la_instantanea_anterior(tmp_path):
+    ruta = tmp_path / "libro.xlsx"
+    _libro(ruta)
+    leer_libro(ruta)
+    anterior = instantanea_de(ruta)
+
+    wb = Workbook()
+    wb.active.title = "Nueva"
+    wb.active.append(["Exp"])
+    wb.active.append([1])
+    wb.save(ruta)
+    assert instantanea_de(ruta) is None
+    assert list(leer_libro(ruta)) == ["Nueva"]
+    assert instantanea_de(ruta) != anterior
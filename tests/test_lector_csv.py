@@ -0,0 +1,86 @@
+import pandas as pd
+import pytest
+
+from lector_csv import leer_csv, leer_csv_por_bloques
+
+CASOS = {
+    # Campo entre comillas con saltos de línea: un solo registro para el motor C
+    "multilinea": (
+        b'Exp;Dir;Kgs\r\n1;"C/ MAYOR 5\r\n2\xc2\xba B";3\r\n2;C/ NOU 1;4;EXTRA\r\n3;"PZA ""SOL""";5\r\n',
+        [(3, "2;C/ NOU 1;4;EXTRA")],
+    ),
+    # \x0c, \x0b y \x1c no son fin de línea para el motor C (sí para str.splitlines)
+    "control": (
+        b'Exp;Dir;Kgs\n1;C/ MAYOR\x0c5;3\n2;AV\x0bMAR;4;EXTRA\n3;C/ SOL\x1c1;5\n',
+        [(3, "2;AV\x0bMAR;4;EXTRA")],
+    ),
+    # \x85 en latin-1 ('…') tampoco
+    "latin1": (
+        b'Exp;Dir;Kgs\n1;CAMI\x85 5;3\n2;ESPA\xd1A;4;EXTRA\n',
+        [(3, "2;ESPAÑA;4;EXTRA")],
+    ),
+    # Líneas en blanco: cuentan en la numeración del motor C
+    "blancos": (
+        b'Exp;Dir;Kgs\n\n1;A;3\n\n2;B;4;EXTRA\n3;C;5\n',
+        [(5, "2;B;4;EXTRA")],
+    ),
+    # Comilla sin cerrar: todo sin comillas; \\ al final de línea la continúa
+    "sin_comillas": (
+        b'Exp;Dir;Kgs\n1;ab"c;3\n2;AV MAR\\\n 7;4\n3;C/ SOL;5;EXTRA\n4;"C/ MAYOR 5;6\n',
+        [(4, "3;C/ SOL;5;EXTRA")],
+    ),
+    # Comilla dentro del campo (no al principio): es un carácter más
+    "comilla_interior": (
+        b'Exp;Dir;Kgs\n1;C/ 9 D"OCTUBRE;3\n2;B;4;EXTRA\n',
+        [(3, "2;B;4;EXTRA")],
+    ),
+}
+
+
+@pytest.mark.parametrize("caso", sorted(CASOS))
+@pytest.mark.parametrize("filas", [1, 2, 100])
+def test_bloques_igual_que_fichero_entero(tmp_path, caso, filas):
+    datos, esperadas = CASOS[caso]
+    ruta = tmp_path / "entrada.csv"
+    ruta.write_bytes(datos)
+
+    entero = leer_csv(ruta)
+    bloques = list(leer_csv_por_bloques(ruta, filas))
+    pd.testing.assert_frame_equal(pd.concat(bloques, ignore_index=True), entero.reset_index(drop=True))
+
+    descartadas = entero.attrs["lectura"]["descartadas"]
+    assert [(d["linea"], d["texto"]) for d in descartadas] == esperadas
+    assert [d for b in bloques for d in b.attrs["lectura"]["descartadas"]] == descartadas
+    for b in bloques:
+        assert {k: v for k, v in b.attrs["lectura"].items() if k != "descartadas"} == \
+            {k: v for k, v in entero.attrs["lectura"].items() if k != "descartadas"}
+
+
+def test_comillas(tmp_path):
+    ruta = tmp_path / "entrada.csv"
+    ruta.write_bytes(CASOS["multilinea"][0])
+    df = leer_csv(ruta)
+    assert not df.attrs["lectura"]["sin_comillas"]
+    assert df["Dir"].tolist() == ["C/ MAYOR 5\r\n2º B", 'PZA "SOL"']
+
+    ruta.write_bytes(CASOS["sin_comillas"][0])
+    df = leer_csv(ruta)
+    assert df.attrs["lectura"]["sin_comillas"]
+    assert df["Dir"].tolist() == ['ab"c', "AV MAR\n 7", '"C/ MAYOR 5']
+
+
+def test_bloques_igual_que_fichero_entero_aleatorio(tmp_path):
+    import random
+
+    rnd = random.Random(0)
+    filas_posibles = ["1;A;3", "2;B;4;EXTRA", "", "3;C", '4;"D\nE";5', '5;"F"";G";6', "6;H\x0cI;7", "7;J;8;X;Y"]
+    ruta = tmp_path / "entrada.csv"
+    for _ in range(40):
+        filas = ["Exp;Dir;Kgs", "0;Z;1"] + rnd.choices(filas_posibles, k=rnd.randint(1, 15))
+        ruta.write_bytes(("\r\n" if rnd.random() < 0.5 else "\n").join(filas).encode() + b"\n")
+        entero = leer_csv(ruta)
+        for n in (1, 2, 3, 7):
+            bloques = list(leer_csv_por_bloques(ruta, n))
+            pd.testing.assert_frame_equal(pd.concat(bloques), entero)
+            assert [d for b in bloques for d in b.attrs["lectura"]["descartadas"]] == \
+                entero.attrs["lectura"]["descartadas"]
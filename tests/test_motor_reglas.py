@@ -0,0 +1,100 @@
+import random
+import shutil
+from pathlib import Path
+
+import pandas as pd
+from openpyxl import load_workbook
+
+import motor_reglas
+from motor_reglas import HOJAS_REGLAS, MotorReglas, match_rules, prepare_rules, sheet_to_df
+from normalizacion import norm
+
+REGLAS = Path(__file__).resolve().parent.parent / "Reglas_hospitales.xlsx"
+
+
+def _comparar(reglas: pd.DataFrame, etiqueta, casos):
+    motor = MotorReglas(reglas, etiqueta)
+    for pob, direccion in casos:
+        orden = motor.primera_regla(pob, direccion)
+        esperado = match_rules(pob, direccion, reglas, etiqueta)
+        obtenido = (orden is not None, "" if orden is None else motor.etiquetas[orden])
+        assert obtenido == esperado, (pob, direccion)
+
+
+# -------------------------
+# MISMO RESULTADO QUE match_rules
+# -------------------------
+
+def test_aleatorio_igual_que_match_rules():
+    rnd = random.Random(0)
+    letras = "ABC "
+    for _ in range(60):
+        reglas = pd.DataFrame({
+            "Población": [rnd.choice(["", "A", "AB", "B C", "CA"]) for _ in range(rnd.randint(1, 12))],
+        })
+        reglas["Patrón_dirección"] = ["".join(rnd.choices(letras, k=rnd.randint(1, 4))) for _ in range(len(reglas))]
+        reglas["Hospital_final"] = [f"H{i}" for i in range(len(reglas))]
+        reglas = prepare_rules(reglas, "Población", "Patrón_dirección")
+        casos = [
+            ("".join(rnd.choices(letras, k=rnd.randint(0, 5))).strip(),
+             norm("".join(rnd.choices(letras, k=rnd.randint(0, 12)))))
+            for _ in range(30)
+        ]
+        _comparar(reglas, "Hospital_final", casos)
+
+
+def test_reglas_reales_igual_que_match_rules():
+    rnd = random.Random(1)
+    wb = load_workbook(REGLAS, data_only=True)
+    for hoja, etiqueta in HOJAS_REGLAS.values():
+        reglas = prepare_rules(sheet_to_df(wb, hoja), "Población", "Patrón_dirección")
+        poblaciones = sorted(set(reglas["Pob_norm"])) + ["VALENCIA", "CASTELLO DE LA PLANA", ""]
+        patrones = list(reglas["Pat_norm"])
+        casos = []
+        for _ in range(150):
+            direccion = " ".join(rnd.sample(patrones, k=rnd.randint(0, 2)) + [str(rnd.randint(1, 99))])
+            # Con erratas: quitar una letra puede hacer que otra regla gane
+            if direccion and rnd.random() < 0.3:
+                i = rnd.randrange(len(direccion))
+                direccion = direccion[:i] + direccion[i + 1:]
+            casos.append((rnd.choice(poblaciones), norm(direccion)))
+        _comparar(reglas, etiqueta, casos)
+
+
+# -------------------------
+# MEMORIA DE GRUPOS APLICABLES
+# -------------------------
+
+def test_aplicables_acotado(monkeypatch):
+    monkeypatch.setattr(motor_reglas, "APLICABLES_MAX", 3)
+    reglas = prepare_rules(pd.DataFrame({
+        "Población": ["", "VALENCIA", "TORRENT"],
+        "Patrón_dirección": ["HOSPITAL", "CLINICO", "GENERAL"],
+    }), "Población", "Patrón_dirección")
+    motor = MotorReglas(reglas)
+    for i in range(10):
+        assert motor.primera_regla(f"VALENCIA {i}", "HOSPITAL CLINICO") == 0
+        assert motor.primera_regla(f"TORRENT {i}", "GENERAL") == 2
+        assert len(motor._aplicables) <= 3
+
+
+# -------------------------
+# COMPILADO EN DISCO
+# -------------------------
+
+def test_compilado_se_rehace_si_cambia_la_normalizacion(tmp_path, monkeypatch):
+    reglas = tmp_path / "Reglas.xlsx"
+    shutil.copyfile(REGLAS, reglas)
+    motor_reglas.compilar_reglas(reglas)
+
+    compilados = []
+    compilar = motor_reglas.compilar_reglas
+    monkeypatch.setattr(motor_reglas, "compilar_reglas", lambda r: compilados.append(r) or compilar(r))
+
+    motor_reglas.cargar_reglas(reglas)
+    assert compilados == []
+
+    monkeypatch.setattr(motor_reglas, "huella_normalizacion", lambda: "otra")
+    motores = motor_reglas.cargar_reglas(reglas)
+    assert compilados == [reglas]
+    assert len(motores["hospitales"]) and not motores["hospitales"]._aplicables
@@ -0,0 +1,108 @@
+import pandas as pd
+import pytest
+
+from normalizacion import (
+    calle_base, calle_canonica_vigente, clean_text, clean_text_serie, clave_canonica, norm, norm_serie,
+    numero_portal, por_valores_distintos,
+)
+
+
+# -------------------------
+# CLAVES CANÓNICAS
+# -------------------------
+
+@pytest.mark.parametrize("direccion, calle", [
+    # Los números del nombre se quedan en su sitio
+    ("AV 9 D'OCTUBRE 14", "AVENIDA 9 OCTUBRE 14"),
+    ("Avda. 9 d'Octubre, nº 14", "AVENIDA 9 OCTUBRE 14"),
+    ("CALLE 3 DE MAYO 1", "CALLE 3 MAYO 1"),
+    ("CALLE 1º DE MAYO 3", "CALLE 1 MAYO 3"),
+    # Piso y puerta fuera de la clave
+    ("C/ MAYOR 5 2º B", "CALLE MAYOR 5"),
+    ("C/ Mayor 5, 1ª", "CALLE MAYOR 5"),
+    ("AV LA MURA N 3 ENTLO", "AVENIDA MURA 3"),
+    ("JUAN DE LA CIERVA 7 BAJO", "JUAN CIERVA 7"),
+    # Portal delante del tipo de vía
+    ("49 CL ANTONIO LLORET", "CALLE ANTONIO LLORET 49"),
+    ("C/ Mayor 012", "CALLE MAYOR 12"),
+    ("AVDA. EUROPA S/N", "AVENIDA EUROPA SN"),
+    # Dos números sin marca de piso: se conservan los dos
+    ("CALLE 1 5", "CALLE 1 5"),
+])
+def test_calle_de_la_clave(direccion, calle):
+    assert clave_canonica(f"{direccion}, 12001 Castellón, Castellón, ESPAÑA") == f"{calle}|12001|CASTELLON|CASTELLON"
+
+
+def test_piso_y_puerta_comparten_clave_con_el_portal():
+    claves = {
+        clave_canonica(f"{d}, 12001 Castellón, Castellón, ESPAÑA")
+        for d in ("C/ Mayor 5", "C/ MAYOR 5 2º B", "Calle Mayor, 5, 3º izda", "CL MAYOR N 5 BAJO")
+    }
+    assert len(claves) == 1
+
+
+@pytest.mark.parametrize("calle, base, numero", [
+    ("AVENIDA 9 OCTUBRE 14", "AVENIDA 9 OCTUBRE", 14),
+    ("AVENIDA 9 OCTUBRE", "AVENIDA 9 OCTUBRE", None),
+    ("CALLE MAYOR 12B", "CALLE MAYOR", 12),
+    ("AVENIDA EUROPA SN", "AVENIDA EUROPA", None),
+    # No se sabe cuál es el portal: sin número, no se interpola
+    ("CALLE 1 5", "CALLE 1", None),
+])
+def test_base_y_portal(calle, base, numero):
+    assert calle_base(calle) == base
+    assert numero_portal(calle) == numero
+
+
+@pytest.mark.parametrize("calle, vigente", [
+    ("CALLE MAYOR 5", True),
+    ("AVENIDA EUROPA SN", True),
+    ("CALLE MAYOR", True),
+    # Formato anterior: números del nombre al final, piso y puerta dentro
+    ("AVENIDA OCTUBRE 9 14", False),
+    ("CALLE MAYOR B 5 2", False),
+    ("JUAN CIERVA BAJO 7", False),
+])
+def test_calle_canonica_vigente(calle, vigente):
+    assert calle_canonica_vigente(calle) is vigente
+
+
+# -------------------------
+# COLUMNAS ENTERAS
+# -------------------------
+
+VALORES = [
+    float("nan"), None, pd.NA, "", "   ", "\t\n",
+    12, 3.5, -0.0, 10 ** 20, True,
+    "Castelló  de la\tPlana", "  ÑANDÚ ", "àvila", "L'Alcora", "Nº5 2ª", "straße", " Onda ",
+    "C/ Mayor, 5", "C/ Mayor, 5",
+]
+
+
+@pytest.mark.parametrize("serie", [
+    pd.Series(VALORES, dtype=object),
+    pd.Series(VALORES, dtype=object, index=range(100, 100 + len(VALORES))),
+    pd.Series([1.5, float("nan"), 2.0, 1.5]),
+    pd.Series([1, 2, 2, 3]),
+    pd.Series(["a ", None, "Á", "a "], dtype="string"),
+    pd.Series(["Á b", "c", "Á b"], dtype="category"),
+    pd.Series([], dtype=object),
+])
+def test_serie_igual_que_fila_a_fila(serie):
+    for por_serie, por_fila in ((clean_text_serie, clean_text), (norm_serie, norm)):
+        resultado = por_serie(serie)
+        assert resultado.index.equals(serie.index)
+        assert resultado.tolist() == [por_fila(x) for x in serie]
+
+
+def test_por_valores_distintos_transforma_una_vez_por_valor():
+    llamadas = []
+
+    def transformar(s):
+        llamadas.append(s.tolist())
+        return s.str.len()
+
+    serie = pd.Series(["a", "bb", None, "a", float("nan"), "bb"], index=list("uvwxyz"))
+    resultado = por_valores_distintos(serie, transformar)
+    assert llamadas == [["a", "bb", ""]]
+    assert resultado.to_dict() == {"u": 1, "v": 2, "w": 0, "x": 1, "y": 0, "z": 2}
@@ -0,0 +1,175 @@
+from functools import partial
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+import cache_resultados
+import reordenar_rutas
+from instantanea import leer_libro, tabla_leida
+from reordenar_rutas import COLUMNAS_OBLIGATORIAS, huella_hoja, reordenar_excel
+
+ORIGEN = (39.98, -0.05)
+
+# Tres paradas por hoja en C.P. sin referencia (centroide de las propias paradas)
+HOJAS = {
+    "ZREP_A": [(101, 39.990, -0.040), (102, 39.995, -0.030), (103, 39.985, -0.020)],
+    "ZREP_B": [(201, 40.010, -0.060), (202, 40.020, -0.070), (203, 40.015, -0.080)],
+}
+
+
+def _fila(exp, lat, lon, kgs=1.0):
+    valores = {
+        "Exp": exp, "Hospital": "", "Población": "CASTELLON", "Dirección": f"CALLE MAYOR {exp}",
+        "Consignatario": f"C{exp}", "Cliente": "X", "Kgs": kgs, "Bultos": 1, "Z.Rep": "1",
+        "N. servicio": "S", "C.P.": "99999", "Latitud": lat, "Longitud": lon,
+    }
+    return [valores[c] for c in [*COLUMNAS_OBLIGATORIAS, "C.P.", "Latitud", "Longitud"]]
+
+
+def _entrada(ruta, kgs_b=1.0):
+    wb = Workbook()
+    wb.remove(wb.active)
+    for nombre, paradas in HOJAS.items():
+        ws = wb.create_sheet(nombre)
+        ws.append([*COLUMNAS_OBLIGATORIAS, "C.P.", "Latitud", "Longitud"])
+        for exp, lat, lon in paradas:
+            ws.append(_fila(exp, lat, lon, kgs_b if nombre == "ZREP_B" else 1.0))
+    wb.save(ruta)
+
+
+class _Respuesta:
+    def __init__(self, datos):
+        self.datos = datos
+
+    def json(self):
+        return self.datos
+
+
+@pytest.fixture
+def fase3(tmp_path, monkeypatch, geocache):
+    """
+    reordenar_excel con la caché de resultados en tmp_path, una Routes API
+    que deja el orden de entrada (o no responde en los tramos por las
+    latitudes de estado["sin_ruta"]) y el registro de las hojas que se ordenan.
+    """
+    carpeta = tmp_path / "cache_resultados"
+    monkeypatch.setattr(reordenar_rutas, "recuperar_objeto", partial(cache_resultados.recuperar_objeto, carpeta=carpeta))
+    monkeypatch.setattr(reordenar_rutas, "guardar_objeto", partial(cache_resultados.guardar_objeto, carpeta=carpeta))
+    monkeypatch.setattr(reordenar_rutas, "recuperar_de_cache", partial(cache_resultados.recuperar, carpeta=carpeta))
+    monkeypatch.setattr(reordenar_rutas, "guardar_en_cache", partial(cache_resultados.guardar, carpeta=carpeta))
+
+    estado = {"ordenadas": [], "sin_ruta": set()}
+
+    def post(url, json, headers, timeout):
+        # Sin resultado si el tramo pasa por una latitud de `sin_ruta`
+        if {p["location"]["latLng"]["latitude"] for p in json["intermediates"]} & estado["sin_ruta"]:
+            return _Respuesta({})
+        return _Respuesta({"routes": [{"optimizedIntermediateWaypointIndex": list(range(len(json["intermediates"])))}]})
+
+    ordenar_hoja = reordenar_rutas.ordenar_hoja
+
+    def ordenar_contando(df, *args, **kwargs):
+        estado["ordenadas"].append(next(n for n, p in HOJAS.items() if p[0][0] in set(df["Exp"])))
+        return ordenar_hoja(df, *args, **kwargs)
+
+    monkeypatch.setattr(reordenar_rutas.requests, "post", post)
+    monkeypatch.setattr(reordenar_rutas, "ordenar_hoja", ordenar_contando)
+
+    coordenadas = tmp_path / "coordenadas.xlsx"
+    pd.DataFrame({"PUEBLO": ["CASTELLON"], "LATITUD": [39.98], "LONGITUD": [-0.04]}).to_excel(coordenadas, index=False)
+
+    def ejecutar(entrada, salida, api_key="clave"):
+        estado["ordenadas"].clear()
+        reordenar_excel(entrada, salida, coordenadas, *ORIGEN, api_key=api_key, cache=True)
+        return sorted(estado["ordenadas"])
+
+    ejecutar.estado = estado
+    return ejecutar
+
+
+def _hojas(ruta) -> dict:
+    return {nombre: tabla_leida(hoja) for nombre, hoja in leer_libro(ruta).items()}
+
+
+# -------------------------
+# HUELLA DE HOJA
+# -------------------------
+
+def test_huella_hoja_sigue_al_contenido():
+    df = pd.DataFrame({"Exp": [1, 2], "Kgs": [1.0, 2.0]})
+    assert huella_hoja(df) == huella_hoja(df.copy())
+    otra = df.copy()
+    otra.loc[1, "Kgs"] = 2.5
+    assert huella_hoja(otra) != huella_hoja(df)
+    assert huella_hoja(df[["Kgs", "Exp"]]) != huella_hoja(df)
+    assert huella_hoja(df.astype({"Kgs": object})) != huella_hoja(df)
+
+
+# -------------------------
+# CACHÉ POR HOJA
+# -------------------------
+
+def test_hoja_sin_cambios_se_recupera(fase3, tmp_path):
+    entrada = tmp_path / "entrada.xlsx"
+    _entrada(entrada)
+    assert fase3(entrada, tmp_path / "salida1.xlsx") == ["ZREP_A", "ZREP_B"]
+
+    # Cambia una fila de ZREP_B: solo esa hoja se ordena de nuevo
+    _entrada(entrada, kgs_b=2.0)
+    assert fase3(entrada, tmp_path / "salida2.xlsx") == ["ZREP_B"]
+
+    antes, despues = _hojas(tmp_path / "salida1.xlsx"), _hojas(tmp_path / "salida2.xlsx")
+    pd.testing.assert_frame_equal(despues["ZREP_A"], antes["ZREP_A"])
+    assert despues["ZREP_B"]["Kgs"].tolist() == [2, 2, 2]
+
+
+def test_nueva_generacion_de_la_geocache_invalida_las_hojas(fase3, tmp_path, geocache):
+    entrada = tmp_path / "entrada.xlsx"
+    _entrada(entrada)
+    assert fase3(entrada, tmp_path / "salida1.xlsx") == ["ZREP_A", "ZREP_B"]
+    assert fase3(entrada, tmp_path / "salida2.xlsx") == []
+
+    geocache.nueva_generacion()
+    assert fase3(entrada, tmp_path / "salida3.xlsx") == ["ZREP_A", "ZREP_B"]
+
+
+# -------------------------
+# RESPALDOS
+# -------------------------
+
+def test_hoja_con_respaldo_no_se_guarda(fase3, tmp_path, capsys):
+    entrada = tmp_path / "entrada.xlsx"
+    _entrada(entrada)
+    antes = reordenar_rutas.respaldos_rutas()
+    fase3.estado["sin_ruta"] = {lat for _, lat, _ in HOJAS["ZREP_B"]}
+    assert fase3(entrada, tmp_path / "salida1.xlsx") == ["ZREP_A", "ZREP_B"]
+    assert reordenar_rutas.respaldos_rutas() > antes
+    assert "no se guarda en la caché" in capsys.readouterr().out
+
+    # Con la API ya respondiendo: ZREP_A (sin respaldos) se recupera y ZREP_B se ordena de nuevo
+    fase3.estado["sin_ruta"] = set()
+    assert fase3(entrada, tmp_path / "salida1.xlsx") == ["ZREP_B"]
+    # Ahora sí se guarda todo: la misma petición ya no ordena nada
+    assert fase3(entrada, tmp_path / "salida1.xlsx") == []
+
+
+def test_error_de_la_api_cuenta_como_respaldo(fase3, tmp_path, monkeypatch):
+    entrada = tmp_path / "entrada.xlsx"
+    _entrada(entrada)
+
+    def caida(*args, **kwargs):
+        raise ConnectionError("sin red")
+
+    monkeypatch.setattr(reordenar_rutas.requests, "post", caida)
+    antes = reordenar_rutas.respaldos_rutas()
+    assert fase3(entrada, tmp_path / "salida.xlsx") == ["ZREP_A", "ZREP_B"]
+    assert reordenar_rutas.respaldos_rutas() > antes
+    assert fase3(entrada, tmp_path / "salida.xlsx") == ["ZREP_A", "ZREP_B"]
+
+
+def test_sin_api_key_no_se_guardan_las_hojas(fase3, tmp_path):
+    entrada = tmp_path / "entrada.xlsx"
+    _entrada(entrada)
+    assert fase3(entrada, tmp_path / "salida1.xlsx", api_key="") == ["ZREP_A", "ZREP_B"]
+    assert fase3(entrada, tmp_path / "salida2.xlsx", api_key="") == ["ZREP_A", "ZREP_B"]
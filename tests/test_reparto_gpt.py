@@ -0,0 +1,88 @@
+import json
+import shutil
+from pathlib import Path
+
+import pytest
+
+import reparto_gpt
+from instantanea import leer_libro
+
+RAIZ = Path(__file__).resolve().parent.parent
+
+CABECERA = "N.Exp;Ref.;Población;Domicilio;Consignatario;Cliente;Kgs;Btos.;B.Doc;Z.Rep;N. servicio;Cod.Pos;Obs."
+
+# (población, domicilio, consignatario, C.P.): hospital, federación y repartos normales
+DIRECCIONES = [
+    ("CASTELLO DE LA PLANA", "AVINGUDA DEL DOCTOR CLARÀ, 19", "HOSPITAL PROVINCIAL", "12002"),
+    ("ALMASSORA/ALMAZORA", "CALLE SANTA QUITERIA 342", "FEDERACION FCA.", "12550"),
+    ("CASTELLO DE LA PLANA", "C/ MAYOR, 12", "FARMACIA CENTRO", "12001"),
+    ("BENICASSIM/BENICASIM", "AV DEL MAR, 42", "FARMACIA MAR", "12560"),
+    ("VILA-REAL", "CARRER MAJOR 5 2º", "FARMACIA MAJOR", "12540"),
+    ("CASTELLO DE LA PLANA", "AVDA. REY DON JAIME, 7", "FARMACIA REY", "12001"),
+]
+ZONAS = ["1", "2", ".", "10", "3"]
+
+
+def _csv(ruta, filas=30):
+    lineas = [CABECERA]
+    for i in range(filas):
+        poblacion, domicilio, consignatario, cp = DIRECCIONES[i % len(DIRECCIONES)]
+        zona = ZONAS[i % len(ZONAS)]
+        lineas.append(f"{100000 + i};R{i};{poblacion};{domicilio};{consignatario};X;{i},5;{i % 4 + 1};1;{zona};S;{cp};")
+        if i == 20:
+            # Fila con un campo de más: se descarta igual en los dos modos
+            lineas.append("999999;R;CASTELLO DE LA PLANA;C/ MAYOR, 1;X;X;1;1;1;1;S;12001;;extra")
+    ruta.write_text("\n".join(lineas) + "\n", encoding="utf-8")
+
+
+def _hojas(ruta) -> dict:
+    # METADATOS lleva los tiempos de cada ejecución
+    return {
+        nombre: list(hoja.itertuples(index=False, name=None))
+        for nombre, hoja in leer_libro(ruta).items() if nombre != "METADATOS"
+    }
+
+
+@pytest.fixture
+def reglas(tmp_path):
+    # Copia: cargar_reglas deja el compilado junto al Excel
+    ruta = tmp_path / "Reglas_hospitales.xlsx"
+    shutil.copyfile(RAIZ / "Reglas_hospitales.xlsx", ruta)
+    return ruta
+
+
+@pytest.mark.parametrize("libro_final", [False, True])
+def test_por_bloques_igual_que_de_una_vez(tmp_path, geocache, reglas, libro_final):
+    csv = tmp_path / "llegadas.csv"
+    _csv(csv)
+
+    def ejecutar(nombre, bloque):
+        salida = tmp_path / f"{nombre}.xlsx"
+        r = reparto_gpt.run(csv, reglas, salida, "LLEGADAS", "castellon", bloque=bloque, libro_final=libro_final)
+        return r, salida
+
+    r, salida = ejecutar("completo", None)
+    esperadas = _hojas(salida)
+    assert {"HOSPITALES", "FEDERACION", "ZREP_1", "ZREP_", "ZREP_10"} <= set(esperadas)
+    assert len(esperadas["HOSPITALES"]) > 1 and len(esperadas["FEDERACION"]) > 1
+    paradas = json.loads(salida.with_suffix(".paradas.json").read_text(encoding="utf-8"))
+
+    for bloque in (1, 7, 1000):
+        r_bloques, salida = ejecutar(f"bloque{bloque}", bloque)
+        hojas = _hojas(salida)
+        assert list(hojas) == list(esperadas), bloque
+        for nombre, filas in esperadas.items():
+            assert hojas[nombre] == filas, (bloque, nombre)
+        assert r_bloques["expediciones"] == r["expediciones"] == 30
+        assert r_bloques["paradas_por_hoja"] == r["paradas_por_hoja"] == paradas
+
+
+def test_csv_solo_con_cabecera(tmp_path, geocache, reglas):
+    csv = tmp_path / "llegadas.csv"
+    csv.write_text(CABECERA + "\n", encoding="utf-8")
+    hojas = []
+    for bloque in (None, 5):
+        salida = tmp_path / f"salida{bloque}.xlsx"
+        assert reparto_gpt.run(csv, reglas, salida, "LLEGADAS", "castellon", bloque=bloque)["expediciones"] == 0
+        hojas.append(_hojas(salida))
+    assert hojas[0] == hojas[1]
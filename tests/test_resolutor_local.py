@@ -0,0 +1,50 @@
+from normalizacion import clave_canonica
+from resolutor_local import IndiceLocal
+
+
+def _clave(direccion: str) -> str:
+    return clave_canonica(f"{direccion}, 46001 Valencia, Valencia, ESPAÑA")
+
+
+# -------------------------
+# INTERPOLACIÓN
+# -------------------------
+
+def test_numero_del_nombre_no_es_el_portal():
+    indice = IndiceLocal()
+    indice.anadir(_clave("AV 9 D'OCTUBRE 14"), 39.47, -0.37)
+
+    # El portal es 180, no el 9 del nombre: a 166 números del 14 no hay vecino
+    assert indice.interpolar(_clave("AV 9 D'OCTUBRE 180")) is None
+    assert indice.interpolar(_clave("AV 9 D'OCTUBRE 16"))[:2] == (39.47, -0.37)
+
+
+def test_calles_con_numero_distinto_no_se_mezclan():
+    indice = IndiceLocal()
+    indice.anadir(_clave("CALLE 1 DE MAYO 30"), 39.40, -0.40)
+
+    assert indice.interpolar(_clave("CALLE 3 DE MAYO 1")) is None
+    assert indice.resolver(_clave("CALLE 3 DE MAYO 1")) is None
+
+
+def test_portal_ambiguo_no_se_interpola():
+    indice = IndiceLocal()
+    indice.anadir(_clave("CALLE 1 4"), 39.40, -0.40)
+    assert indice.interpolar(_clave("CALLE 1 5")) is None
+
+
+# -------------------------
+# CENTROIDES DE CALLE
+# -------------------------
+
+def test_centroides_separados_para_calles_numeradas():
+    indice = IndiceLocal()
+    indice.anadir(_clave("CALLE 1 DE MAYO 2"), 39.40, -0.40)
+    indice.anadir(_clave("CALLE 1 DE MAYO 4"), 39.42, -0.40)
+    indice.anadir(_clave("CALLE 3 DE MAYO 2"), 39.50, -0.30)
+    indice.anadir(_clave("CALLE MAYOR 2"), 39.60, -0.20)
+
+    assert indice.resolver(_clave("CALLE 1 DE MAYO 90")) == (39.41, -0.40, "calle")
+    assert indice.resolver(_clave("CALLE 3 DE MAYO 90")) == (39.50, -0.30, "calle")
+    # El piso y la puerta no crean otra calle ('CALLE MAYOR B')
+    assert indice.resolver(_clave("C/ MAYOR 90 2º B")) == (39.60, -0.20, "calle")
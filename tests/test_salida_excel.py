@@ -0,0 +1,141 @@
+import datetime as dt
+import math
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from instantanea import Registro, guardar_libro, leer_libro
+from salida_excel import HojaSalida, escribir_como_to_excel, escribir_df, nuevo_libro, valor_leido
+
+AHORA = dt.datetime(2024, 3, 5, 14, 30, 15)
+
+# Una columna por tipo que llega a las hojas de salida
+DF = pd.DataFrame({
+    "texto": ["a", "", None, "ñandú", "x"],
+    "entero": [1, 2, 3, 4, 5],
+    "real": [1.5, math.nan, math.inf, -math.inf, 0.1 + 0.2],
+    "nulos": [None, 1.0, None, 2.5, None],
+    "fecha_hora": [AHORA, pd.NaT, pd.Timestamp("2023-12-31 23:59:59"), AHORA, AHORA],
+    "fecha": [dt.date(2024, 1, 2)] * 5,
+    "duracion": [dt.timedelta(hours=36), dt.timedelta(minutes=90), dt.timedelta(0), None, dt.timedelta(days=-1)],
+    "logico": [True, False, True, None, False],
+})
+
+
+def _celdas(ruta, hoja=None) -> list:
+    wb = load_workbook(ruta)
+    try:
+        ws = wb[hoja] if hoja else wb.worksheets[0]
+        return [[(c.value, c.number_format) for c in fila] for fila in ws.iter_rows()]
+    finally:
+        wb.close()
+
+
+def _valores(ruta) -> dict:
+    wb = load_workbook(ruta, data_only=True)
+    try:
+        return {ws.title: list(ws.iter_rows(values_only=True)) for ws in wb.worksheets}
+    finally:
+        wb.close()
+
+
+# -------------------------
+# COMO DataFrame.to_excel
+# -------------------------
+
+def test_escribir_como_to_excel_igual_que_pandas(tmp_path):
+    referencia = tmp_path / "pandas.xlsx"
+    DF.to_excel(referencia, index=False, sheet_name="Datos")
+
+    wb = nuevo_libro()
+    escribir_como_to_excel(wb, "Datos", DF)
+    propio = tmp_path / "propio.xlsx"
+    wb.save(propio)
+
+    esperado, obtenido = _celdas(referencia), _celdas(propio)
+    # La cabecera de pandas va con estilo; aquí solo cuentan sus valores
+    assert [v for v, _ in obtenido[0]] == [v for v, _ in esperado[0]]
+    assert obtenido[1:] == esperado[1:]
+
+
+def test_valores_especiales_al_releer(tmp_path):
+    wb = nuevo_libro()
+    escribir_como_to_excel(wb, "Datos", DF)
+    ruta = tmp_path / "libro.xlsx"
+    wb.save(ruta)
+
+    filas = _valores(ruta)["Datos"]
+    columnas = list(filas[0])
+    por_columna = {c: [f[i] for f in filas[1:]] for i, c in enumerate(columnas)}
+    assert por_columna["texto"] == ["a", None, None, "ñandú", "x"]
+    # Excel guarda 16 cifras: 0.1 + 0.2 vuelve como 0.3
+    assert por_columna["real"] == [1.5, None, "inf", "-inf", 0.3]
+    assert por_columna["fecha_hora"] == [AHORA, None, dt.datetime(2023, 12, 31, 23, 59, 59), AHORA, AHORA]
+    assert por_columna["fecha"] == [dt.datetime(2024, 1, 2)] * 5
+    assert por_columna["duracion"] == [1.5, 90 / 1440, 0, None, -1]
+    assert por_columna["logico"] == [True, False, True, None, False]
+
+
+# -------------------------
+# HOJAS CON FORMATO
+# -------------------------
+
+def test_escribir_df_limpia_caracteres_de_control(tmp_path):
+    df = pd.DataFrame({"Nombre\x07": ["ab\x00c", "línea\x1f", None], "Valor": [1.0, math.nan, 2.0]})
+    wb = nuevo_libro()
+    escribir_df(wb, "Hoja", df, list(df.columns))
+    ruta = tmp_path / "libro.xlsx"
+    wb.save(ruta)
+
+    assert _valores(ruta)["Hoja"] == [("Nombre", "Valor"), ("abc", 1), ("línea", None), (None, 2)]
+    wb = load_workbook(ruta)
+    try:
+        ws = wb["Hoja"]
+        assert ws.freeze_panes == "A2"
+        assert ws["A1"].font.b and not ws["A2"].font.b
+        assert ws["B3"].border.left.style == "thin"
+    finally:
+        wb.close()
+
+
+def test_fila_mezcla_celdas_y_valores(tmp_path):
+    wb = nuevo_libro()
+    hoja = HojaSalida(wb, "Mezcla", anchos={1: 30, "B": 12})
+    hoja.fila([hoja.celda("=1+1", "cabecera"), AHORA, dt.date(2024, 1, 2)],
+              formatos=[None, "DD/MM/YYYY HH:MM", None])
+    ruta = tmp_path / "libro.xlsx"
+    wb.save(ruta)
+
+    (formula, fecha_hora, fecha), = _celdas(ruta, "Mezcla")
+    assert formula == ("=1+1", "General")
+    assert fecha_hora == (AHORA, "DD/MM/YYYY HH:MM")
+    # Sin formato propio, una fecha suelta no hereda el estilo de la celda anterior
+    assert fecha[0] == dt.datetime(2024, 1, 2) and fecha[1] != "DD/MM/YYYY HH:MM"
+
+
+# -------------------------
+# REGISTRO (INSTANTÁNEA)
+# -------------------------
+
+def test_registro_igual_a_lo_que_lee_openpyxl(tmp_path):
+    ruta = tmp_path / "libro.xlsx"
+    wb = nuevo_libro(registro=Registro(ruta))
+    escribir_como_to_excel(wb, "Datos", DF)
+    df = pd.DataFrame({"Nombre\x07": ["ab\x00c", None], "Valor": [1 / 3, 2.0]})
+    escribir_df(wb, "Limpia", df, list(df.columns))
+    guardar_libro(wb, ruta)
+
+    leidas = _valores(ruta)
+    tablas = leer_libro(ruta)
+    assert list(tablas) == list(leidas) == ["Datos", "Limpia"]
+    for nombre, filas in leidas.items():
+        assert list(tablas[nombre].itertuples(index=False, name=None)) == filas
+
+
+def test_valor_leido_redondea_como_excel():
+    assert valor_leido(0.1 + 0.2) == 0.3
+    assert valor_leido(2.0) == 2 and isinstance(valor_leido(2.0), int)
+    assert valor_leido(1e20) == 10 ** 20
+    assert valor_leido(math.nan) is None
+    assert valor_leido("") is None and valor_leido("=SUMA(A1)") is None and valor_leido("=") == "="
+    assert valor_leido(dt.date(2024, 1, 2)) == dt.datetime(2024, 1, 2)
@@ -0,0 +1,37 @@
+import sys
+import types
+from multiprocessing import spawn
+
+import trabajadores
+
+
+def test_hijos_sin_script_principal(tmp_path, monkeypatch):
+    # Un __main__ como el de Streamlit: ejecutarlo en el hijo dejaría una marca
+    marca = tmp_path / "ejecutado"
+    script = tmp_path / "app.py"
+    script.write_text(f"open({str(marca)!r}, 'w').close()\n")
+    principal = types.ModuleType("__main__")
+    principal.__file__ = str(script)
+    principal.__spec__ = None
+    monkeypatch.setitem(sys.modules, "__main__", principal)
+
+    assert "init_main_from_path" in spawn.get_preparation_data("otro")
+    proceso = trabajadores._Contexto().Process(target=trabajadores._listo)
+    assert proceso.name.startswith(trabajadores._PREFIJO)
+    assert "init_main_from_path" not in spawn.get_preparation_data(proceso.name)
+
+    proceso.start()
+    proceso.join(60)
+    assert proceso.exitcode == 0
+    assert not marca.exists()
+    # sys.modules["__main__"] no se ha tocado
+    assert sys.modules["__main__"] is principal
+
+
+def test_volver_a_importar_no_anida_el_envoltorio():
+    import importlib
+
+    original = trabajadores._datos_preparacion.__wrapped__
+    importlib.reload(trabajadores)
+    assert spawn.get_preparation_data is trabajadores._datos_preparacion
+    assert trabajadores._datos_preparacion.__wrapped__ is original
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+trabajadores.py — Fase 1 en procesos que se mantienen arrancados entre ejecuciones
+- Procesos 'spawn' que importan reparto_gpt una sola vez y conservan lo ya cargado:
+  callejeros, reglas compiladas, coordenadas de municipios, conexión a la caché
+  de geocodificación e índice del resolutor local
+- PoolFase1.ejecutar llama a reparto_gpt.run en un proceso libre y devuelve un dict
+  con el resultado o el error, lo que imprimió y los segundos empleados
+- Si un proceso muere (p. ej. sin memoria) el pool se recrea para la siguiente ejecución
+- reparto_gpt.py sigue funcionando como script por línea de comandos
+"""
+
+import contextlib
+import io
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import spawn
+from multiprocessing.context import SpawnContext, SpawnProcess
+
+TRABAJADORES = 2
+
+# Cada proceso se renueva tras este número de ejecuciones (memoria fragmentada, fugas)
+EJECUCIONES_POR_PROCESO = 50
+
+DELEGACIONES = ("castellon", "valencia")
+
+
+# -------------------------
+# EN EL PROCESO TRABAJADOR
+# -------------------------
+
+def _calentar(delegaciones):
+    """Inicializador de cada proceso: importa y carga lo que se reutiliza entre ejecuciones."""
+    import reparto_gpt  # noqa: F401  (pandas, openpyxl, googlemaps…)
+    from callejero import callejero_delegacion
+    from geocodificador import preparar_indices
+
+    for delegacion in delegaciones:
+        callejero_delegacion(delegacion)
+    try:
+        preparar_indices()
+    except Exception as e:
+        print(f"Aviso: no se pudo preparar la caché de geocodificación: {e}")
+
+
+def _listo() -> bool:
+    return True
+
+
+def _ejecutar_fase1(parametros: dict) -> dict:
+    import reparto_gpt
+    from geocodificador import vaciar_escrituras
+
+    salida = io.StringIO()
+    inicio = time.perf_counter()
+    resultado = {"ok": False, "resultado": None, "error": "", "detalle": ""}
+    try:
+        with contextlib.redirect_stdout(salida):
+            resultado["resultado"] = reparto_gpt.run(**parametros)
+        resultado["ok"] = True
+    except Exception as e:
+        resultado["error"] = f"{type(e).__name__}: {e}"
+        resultado["detalle"] = traceback.format_exc()
+    finally:
+        # Lo geocodificado queda confirmado en la caché antes de devolver el resultado
+        vaciar_escrituras()
+    resultado["mensajes"] = salida.getvalue()
+    resultado["segundos"] = round(time.perf_counter() - inicio, 3)
+    return resultado
+
+
+# -------------------------
+# POOL
+# -------------------------
+
+# Prefijo del nombre de los procesos del pool
+_PREFIJO = "Fase1-"
+
+
+def _datos_preparacion(nombre):
+    """
+    spawn.get_preparation_data sin el script principal para los procesos del
+    pool. Streamlit registra app.py como __main__ y spawn lo ejecutaría entero
+    en cada hijo. Se decide por el nombre del proceso, sin tocar
+    sys.modules["__main__"], que comparten los hilos de todas las sesiones.
+    """
+    datos = _datos_preparacion.__wrapped__(nombre)
+    if nombre.startswith(_PREFIJO):
+        datos.pop("init_main_from_path", None)
+        datos.pop("init_main_from_name", None)
+    return datos
+
+
+# Una sola vez aunque el módulo se vuelva a importar (recarga de Streamlit)
+_datos_preparacion.__wrapped__ = getattr(spawn.get_preparation_data, "__wrapped__", spawn.get_preparation_data)
+spawn.get_preparation_data = _datos_preparacion
+
+
+class _Proceso(SpawnProcess):
+    """Proceso 'spawn' que no vuelve a ejecutar el script principal (_datos_preparacion)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.name = _PREFIJO + self.name
+
+
+class _Contexto(SpawnContext):
+    Process = _Proceso
+
+
+class PoolFase1:
+    """Procesos de Fase 1 ya arrancados; seguro para varias sesiones a la vez."""
+
+    def __init__(self, trabajadores: int = TRABAJADORES, delegaciones=DELEGACIONES):
+        self.trabajadores = trabajadores
+        self.delegaciones = tuple(delegaciones)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._arrancar()
+
+    def _arrancar(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is not None:
+                return self._pool
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.trabajadores,
+                mp_context=_Contexto(),
+                initializer=_calentar,
+                initargs=(self.delegaciones,),
+                max_tasks_per_child=EJECUCIONES_POR_PROCESO,
+            )
+            # Los procesos se crean al enviar trabajo: se arrancan ya, sin esperar
+            for _ in range(self.trabajadores):
+                self._pool.submit(_listo)
+            return self._pool
+
+    def ejecutar(self, **parametros) -> dict:
+        """
+        reparto_gpt.run(**parametros) en un proceso del pool (rutas absolutas).
+        {"ok", "resultado" (lo que devuelve run), "error", "detalle" (traceback),
+        "mensajes" (lo impreso), "segundos"}.
+        """
+        pool = self._arrancar()
+        try:
+            return pool.submit(_ejecutar_fase1, parametros).result()
+        except BrokenProcessPool as e:
+            self._descartar(pool)
+            return {
+                "ok": False,
+                "resultado": None,
+                "error": f"El proceso de Fase 1 terminó inesperadamente: {e}",
+                "detalle": "",
+                "mensajes": "",
+                "segundos": None,
+            }
+
+    def _descartar(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        # Lo que ya estaba enviado termina en los procesos antiguos
+        pool.shutdown(wait=False)
+
+    def reiniciar(self):
+        """Procesos nuevos: p. ej. tras invalidar entradas de la caché de geocodificación."""
+        pool = self._pool
+        if pool is not None:
+            self._descartar(pool)
+        self._arrancar()
+
+    def cerrar(self):
+        pool = self._pool
+        if pool is not None:
+            self._descartar(pool)